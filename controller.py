@@ -6,17 +6,19 @@ from lib.scheduler import Scheduler
 from filelock import FileLock
 from lib.influxdb import *
 from lib.configuration import *
+from lib.config_bus import ConfigBus, Command
+from measurement_worker import MeasurementWorker
 
-import socket
-import threading
+import asyncio
 import json
 
 # Booleans
 socket_server_started = False
 
 # Config
-vna_script_path = "librevna.py"
 system_script_path = "system.py"
+config_error = None
+single_task = None
 
 # Initial start time
 start_time = datetime(2000, 1, 1, 0, 0, 0, tzinfo=timezone.utc)
@@ -29,200 +31,319 @@ temp_interval = timedelta(hours=0, minutes=1, seconds=0)
 vna_countdown_vars = ["vna_countdown_hour", "vna_countdown_minute", "vna_countdown_second"]
 temp_countdown_vars = ["temp_countdown_hour", "temp_countdown_minute", "temp_countdown_second"]
 
+# Resident measurement worker, keeps the LibreVNA session open between measurements
+measurement_worker = MeasurementWorker()
+
+# Config change bus, its events are handled on the main loop
+config_bus = ConfigBus()
+
+# Backlog uploads between measurements
+upload_interval_s = 60
+
+async def measure(priority, start_deadline=None):
+    # The worker thread owns the LibreVNA session, the arbiter decides when the sweep gets it
+    await asyncio.wrap_future(measurement_worker.submit("measure", priority=priority, start_deadline=start_deadline))
+
+async def scheduled_measurement():
+    # A sweep that cannot start before the next one is due is dropped
+    await measure("scheduled", vna_scheduler.interval.total_seconds())
+
 # Init
-vna_scheduler = Scheduler("LibreVNA", vna_script_path, start_time, vna_interval, vna_countdown_vars, True)
+vna_scheduler = Scheduler("LibreVNA", scheduled_measurement, start_time, vna_interval, vna_countdown_vars, True)
 system_scheduler = Scheduler("System", system_script_path, start_time, temp_interval, temp_countdown_vars, False)
 
-def wait_for_network(host="8.8.8.8", port=53, timeout=3, retry_interval=5, max_wait=300):
+async def wait_for_network(host="8.8.8.8", port=53, timeout=3, retry_interval=5, max_wait=300):
     """
     Wacht tot netwerk beschikbaar is of tot max_wait seconden verstreken zijn.
     """
-    start_time = time.time()
+    start_time = time.monotonic()
     
     while True:
         try:
-            socket.setdefaulttimeout(timeout)
-            with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-                sock.connect((host, port))
+            _, writer = await asyncio.wait_for(asyncio.open_connection(host, port), timeout)
+            writer.close()
             print("✅ Netwerkverbinding is beschikbaar.")
             return True
-        except socket.error:
-            elapsed = time.time() - start_time
+        except (OSError, asyncio.TimeoutError):
+            elapsed = time.monotonic() - start_time
             if elapsed > max_wait:
                 print("❌ Timeout: netwerk niet beschikbaar binnen de toegestane tijd.")
                 return False
             print(f"⏳ Geen verbinding. Probeer opnieuw in {retry_interval} seconden...")
-            time.sleep(retry_interval)
-
-def update_auto_vna_timer_settings(settings):
-    start_time = datetime(settings["init_year"], settings["init_month"], settings["init_day"], settings["init_hour"], settings["init_minute"], settings["init_second"], tzinfo=timezone.utc)
-    vna_interval = timedelta(hours=settings["interval_hour"], minutes=settings["interval_minute"], seconds=settings["interval_second"])
+            await asyncio.sleep(retry_interval)
 
-    vna_scheduler.update_parameters(start_time, vna_interval)
+def update_auto_vna_timer_settings(timers):
+    vna_scheduler.update_parameters(timers.start_time, timers.interval)
 
 
-def update_system_timer_settings(settings):
-    temp_interval = timedelta(hours=settings["temp_interval_hour"], minutes=settings["temp_interval_minute"], seconds=settings["temp_interval_second"])
-
-    system_scheduler.update_parameters(start_time, temp_interval)
+def update_system_timer_settings(timers):
+    system_scheduler.update_parameters(start_time, timers.temp_interval)
 
 
 def check_device_mode(settings):
-    if settings.get("measurement_status", {}).get("device_mode", 0) == 'calibration':
-        if settings.get("configurations", {}).get("power", 0) > -26:
+    if settings.status.device_mode == 'calibration':
+        if settings.vna.power > -26:
             
-            # Update VNA output power
-            update_yaml_flag("configurations","power", -26)
-
-            time.sleep(0.1)
+            # Update VNA output power, the bus delivers the change (and sends it to influxdb)
+            update_yaml_flag("configurations", "power", -26)
+            config_bus.refresh()
 
             # For debugging
             print("Calibration Mode: Power settings changed to -26dBm!")
+            return True
 
-            # Send new data to influxdb
-            update_yaml_flag("configurations","update", 1)
-            # send_configurations(settings, "[New VNA configurations]")
+    return False
 
 
 # *** *** #
 SOCKET_PATH = "/tmp/streaming_socket.sock"
 
-def stream_data(conn):
-    with conn:
+# Status subscribers and the event that wakes publish_status()
+status_subscribers = []
+status_changed = asyncio.Event()
+
+def status_data():
+    lease = measurement_worker.arbiter.lease
+    return {
+        "vna_activity": int(lease is not None),
+        "vna_lease": None if lease is None else lease.name,
+        "vna_queue": measurement_worker.arbiter.pending(),
+        vna_countdown_vars[0]: vna_scheduler.countdown_remaining // 3600,
+        vna_countdown_vars[1]: (vna_scheduler.countdown_remaining % 3600) // 60,
+        vna_countdown_vars[2]: vna_scheduler.countdown_remaining % 60
+    }
+
+def status_line():
+    return (json.dumps(status_data()) + "\n").encode()
+
+def next_status_tick():
+    # Seconds until the countdown changes, None while nothing is scheduled
+    if vna_scheduler.next_run is None:
+        return None
+    remaining = (vna_scheduler.next_run - datetime.now(timezone.utc)).total_seconds()
+    if remaining <= 0:
+        return None
+    return remaining - int(remaining) + 0.01
+
+async def stream_data(reader, writer):
+    # Every client gets the current status. A client that sends {"op": "subscribe"}
+    # stays connected and gets a new line whenever the status changes.
+    try:
+        writer.write(status_line())
+        await writer.drain()
+
+        line = await reader.readline()
+        if line and json.loads(line).get("op") == "subscribe":
+            status_subscribers.append(writer)
+            writer.write(status_line())
+            await writer.drain()
+
+            # Until the client disconnects
+            while await reader.read(1024):
+                pass
+    except (BrokenPipeError, ConnectionResetError) as e:
+        print(f"⚠️ Broken connection during transmission: {e}")
+    except Exception as e:
+        print(f"❌ Unexpected error during transmission: {e}")
+    finally:
+        if writer in status_subscribers:
+            status_subscribers.remove(writer)
+        writer.close()
+
+async def publish_status():
+    # Pushes the status to the subscribers when the activity or the countdown changed
+    last = None
+    while True:
+        data = status_data()
+        if data != last:
+            last = data
+            line = (json.dumps(data) + "\n").encode()
+            for writer in list(status_subscribers):
+                if writer.is_closing() or writer.transport.get_write_buffer_size() > 65536:
+                    # Gone, or not reading: it has to reconnect
+                    status_subscribers.remove(writer)
+                    writer.close()
+                else:
+                    writer.write(line)
+
+        status_changed.clear()
         try:
-            data = {
-                "vna_activity": vna_scheduler.activity,
-                vna_countdown_vars[0]: vna_scheduler.countdown_remaining // 3600,
-                vna_countdown_vars[1]: (vna_scheduler.countdown_remaining % 3600) // 60,
-                vna_countdown_vars[2]: vna_scheduler.countdown_remaining % 60
-            }
-            conn.sendall((json.dumps(data) + "\n").encode())
-        except (BrokenPipeError, ConnectionResetError) as e:
-            print(f"⚠️ Broken connection during transmission: {e}")
-        except Exception as e:
-            print(f"❌ Unexpected error during transmission: {e}")
+            await asyncio.wait_for(status_changed.wait(), timeout=next_status_tick())
+        except asyncio.TimeoutError:
+            pass
 
-def start_server():
+async def start_server():
     if os.path.exists(SOCKET_PATH):
         os.remove(SOCKET_PATH)
 
-    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-    server.bind(SOCKET_PATH)
-    server.listen(1)
+    server = await asyncio.start_unix_server(stream_data, path=SOCKET_PATH)
+    vna_scheduler.add_listener(status_changed.set)
 
-    print(f"🟢 Server luistert op {SOCKET_PATH}")
+    # Leases start and end on the worker thread
+    loop = asyncio.get_running_loop()
+    measurement_worker.arbiter.add_listener(lambda: loop.call_soon_threadsafe(status_changed.set))
 
-    try:
-        while True:
-            conn, _ = server.accept()
-            # print("✅ Client connected")
-            t = threading.Thread(target=stream_data, args=(conn,))
-            t.daemon = True
-            t.start()
-    except KeyboardInterrupt:
-        print("🛑 Server stopped.")
-    finally:
-        server.close()
-        os.remove(SOCKET_PATH)
+    print(f"🟢 Server luistert op {SOCKET_PATH}")
+    return server
 # *** *** #
 
-def main_loop():
-
-    #   Load YAML config file
-    config = retrieve_yaml_file()
-
-    #   Init auto measurement settings
-    update_auto_vna_timer_settings(config["timer_settings"])
-    update_system_timer_settings(config["timer_settings"])
-
-    #   Check device mode and change power settings
-    check_device_mode(config)
+def read_settings():
+    """
+    Compiled config file, None while it is invalid. Every new error is printed once.
+    """
+    global config_error
+    try:
+        settings = get_settings()
+    except ConfigError as e:
+        if str(e) != config_error:
+            print(f"⚠️ Invalid configuration, waiting for a valid one: {e}")
+            config_error = str(e)
+        return None
+    config_error = None
+    return settings
+
+def apply_measurement_status(settings):
+    #   Start or stop automatic measurements, start() checks if it was previously enabled
+    if settings.status.auto_measurement:
+        vna_scheduler.start()
+    else:
+        vna_scheduler.stop()
 
-    #   Initialisation done
-    print("Init done")
+async def single_measurement():
+    print("Single measurement")
 
-    system_scheduler.start()
+    # Try to execute the measurement, it goes before scheduled sweeps and temperature reads
+    try:
+        print(f"⏳ Requesting single measurement at {datetime.now(timezone.utc).isoformat()}")
+        await measure("manual")
+    except Exception as e:
+        print(f"⚠️ Error while running single measurement: {e}")
+
+async def handle_changes(changes):
+    # Settings the changes lead to
+    settings = config_bus.settings
+    sections = {change.section for change in changes}
+
+    for change in changes:
+        print(f"Config changed: {change.section}.{change.key} {change.old} -> {change.new}")
+
+    #   Changes in "timer_settings"
+    if "timers" in sections:
+        print("Timer settings changed!")
+
+        # Todo send new timer settings to influxdb
+
+        # Update timer settings vna and temperature measurements
+        update_auto_vna_timer_settings(settings.timers)
+        update_system_timer_settings(settings.timers)
+
+    #   Changes in "measurement_status"
+    if "status" in sections:
+        apply_measurement_status(settings)
+
+    #   Changes in "configurations" (or of the device mode)
+    if ("vna" in sections or "status" in sections) and check_device_mode(settings):
+        # The power change follows as an event of its own
+        return
+
+    if "vna" in sections:
+        print("Configurations changed!")
+
+        # Apply the settings while the session is idle, and send new data to influxdb
+        measurement_worker.submit("configure")
+        await asyncio.to_thread(send_configurations, settings, "[New VNA configurations]")
+
+def handle_command(command):
+    global single_task
+    if command.name == "single_measurement":
+        # Runs next to the event handling, a second request while it runs is ignored
+        if single_task is None or single_task.done():
+            single_task = asyncio.get_running_loop().create_task(single_measurement())
+    else:
+        print(f"⚠️ Unknown command '{command.name}'")
 
+async def startup():
     #   Before starting the communication with influxdb
     max_wait_time_s = 300
-    if wait_for_network(max_wait=max_wait_time_s):
+    if await wait_for_network(max_wait=max_wait_time_s):
         print("Proceed with network-dependent tasks...")
 
-        # During startup system 
-        # --> Send current VNA configurations 
-        # --> Update flag in config file
-        update_yaml_flag("configurations","update", 1)
+        # During startup system --> Send current VNA configurations
+        await asyncio.to_thread(send_configurations, config_bus.settings, "[VNA configurations]")
     else:
         print(f"No network connection achieved after {max_wait_time_s} minutes")
 
     #   Perform a single sweep to disable VNA
-    update_yaml_flag("measurement_status","single_measurement", 1)
-    
-    #   Loop
-    while True:
+    await single_measurement()
 
-        time.sleep(0.1)
+    #   Start automatic measurements when enabled
+    apply_measurement_status(config_bus.settings)
 
-        #   Load YAML config file
-        config = retrieve_yaml_file()
-
-        #   Check updates in "configurations"
-        if config.get("configurations", {}).get("update", 0) == 1:
-            print("Configurations changed!")
-
-            # Send new data to influxdb
-            if send_configurations(config, "[New VNA configurations]"):
-
-                # Update flag in config file
-                update_yaml_flag("configurations","update", 0)
+async def upload_backlog():
+    # Sends what the measurements could not upload, while no sweep is running or due
+    while True:
+        await asyncio.sleep(upload_interval_s)
+        if measurement_worker.busy or measurement_worker.arbiter.pending() or 0 < vna_scheduler.countdown_remaining < upload_interval_s:
+            continue
+        try:
+            await asyncio.to_thread(send_vna_data, config_bus.settings.raw, "[Upload]")
+        except Exception as e:
+            print(f"⚠️ Error while uploading: {e}")
 
+async def main_loop():
 
-        #   Check updates in "timer_settings"
-        if config.get("timer_settings", {}).get("update", 0) == 1:
-            print("Timer settings changed!")
+    #   Load YAML config file
+    settings = read_settings()
+    while settings is None:
+        await asyncio.sleep(1)
+        settings = read_settings()
 
-            # Todo send new timer settings to influxdb
+    #   Changes are delivered by the config bus from here on, events are handled one at a time
+    events = asyncio.Queue()
+    config_bus.subscribe(events.put_nowait)
+    await config_bus.start(settings)
 
-            # Update timer settings vna measurements
-            update_auto_vna_timer_settings(config["timer_settings"])
+    status_server = await start_server()
 
-            # Update timer settings temperature measurements
-            update_system_timer_settings(config["timer_settings"])
-            
-            # Update flag in config file
-            update_yaml_flag("timer_settings","update", 0)
+    #   Init auto measurement settings
+    update_auto_vna_timer_settings(settings.timers)
+    update_system_timer_settings(settings.timers)
 
+    #   Check device mode and change power settings
+    check_device_mode(settings)
 
-        #   Check automatic measurements is enabled
-        if config.get("measurement_status", {}).get("auto_measurement", 0) == 1:
+    #   Initialisation done
+    print("Init done")
 
-            #   This function checks if it was previously enabled
-            vna_scheduler.start()
-            #vna_scheduler.
-            #start_socket_server()
+    system_scheduler.start()
 
-        
-        if config.get("measurement_status", {}).get("auto_measurement", 0) == 0:
+    tasks = [asyncio.create_task(startup()), asyncio.create_task(upload_backlog()),
+             asyncio.create_task(publish_status())]
 
-            vna_scheduler.stop()
+    #   Loop
+    try:
+        while True:
+            event = await events.get()
 
-        #   Check single measurement is requested
-        if config.get("measurement_status", {}).get("single_measurement", 0) == 1:
-            print("Single measurement")
-            
-            # Try to execute the script
             try:
-                vna_scheduler.activity = 1
-                print(f"⏳ Executing {vna_script_path} at {datetime.now(timezone.utc).isoformat()}")
-                subprocess.run(["python", vna_script_path])
-                vna_scheduler.activity = 0
+                if isinstance(event, Command):
+                    handle_command(event)
+                else:
+                    await handle_changes(event)
             except Exception as e:
-                print(f"⚠️ Error while running {vna_script_path}: {e}")
-
-            update_yaml_flag("measurement_status","single_measurement", 0)
+                print(f"⚠️ Error while handling {event}: {e}")
+    finally:
+        for task in tasks:
+            task.cancel()
+        status_server.close()
+        if os.path.exists(SOCKET_PATH):
+            os.remove(SOCKET_PATH)
 
 if __name__ == "__main__":
 
-    threading.Thread(target=start_server, daemon=True).start()
-    
-    main_loop()
+    measurement_worker.start()
+
+    try:
+        asyncio.run(main_loop())
+    except KeyboardInterrupt:
+        print("🛑 Controller stopped.")
@@ -0,0 +1,257 @@
+import argparse
+import os
+import re
+import sqlite3
+import threading
+import time
+import zipfile
+from datetime import datetime, timedelta
+
+from filelock import FileLock
+
+from lib.trace_file import parse_trace_record
+
+# Compacting archive for uploaded sweep files
+#
+# Uploaded text sweeps are not kept as one file each but added to compressed
+# zip bundles, one per day (<YYYY-MM-DD>.zip, <YYYY-MM-DD>_1.zip, ... once a
+# bundle reaches bundle_bytes). index.db maps every sweep name to its bundle,
+# so a single sweep is read back without scanning: the zip central directory
+# gives direct access to the member. Retention removes whole bundles, oldest
+# first, by age and by disk budget.
+
+BUNDLE_SUFFIX = ".zip"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS bundles (
+    name TEXT PRIMARY KEY,
+    date TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    size INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS sweeps (
+    name TEXT PRIMARY KEY,
+    bundle TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    archived REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sweeps_bundle ON sweeps (bundle);
+"""
+
+
+def sweep_date(name):
+    match = re.search(r"\d{4}-\d{2}-\d{2}", name)
+    return match.group() if match else datetime.now().strftime("%Y-%m-%d")
+
+
+class SweepArchive:
+    def __init__(self, directory, bundle_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.bundle_bytes = bundle_bytes
+        self.lock = threading.Lock()
+        self.connection = None
+
+    def connect(self):
+        if self.connection is None:
+            os.makedirs(self.directory, exist_ok=True)
+            connection = sqlite3.connect(os.path.join(self.directory, "index.db"), timeout=30,
+                                         isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.executescript(SCHEMA)
+            self.connection = connection
+        return self.connection
+
+    def locked(self):
+        # Threads of this process and other processes adding to the archive
+        os.makedirs(self.directory, exist_ok=True)
+        return FileLock(os.path.join(self.directory, ".archive.lock"))
+
+    # *** Adding *** #
+    def add_files(self, paths, remove=True):
+        """Adds sweep files to their daily bundle, returns the names they are archived under."""
+        by_date = {}
+        for path in paths:
+            by_date.setdefault(sweep_date(os.path.basename(path)), []).append(path)
+
+        names = []
+        with self.lock, self.locked():
+            connection = self.connect()
+            # Bundle -> its central directory before this call, restored when the index is rolled back
+            snapshots = {}
+            try:
+                with connection:
+                    connection.execute("BEGIN IMMEDIATE")
+                    for date, date_paths in sorted(by_date.items()):
+                        names += self.add_to_bundles(connection, date, date_paths, snapshots)
+            except BaseException:
+                self.restore_bundles(snapshots)
+                raise
+
+        if remove:
+            for path in paths:
+                os.remove(path)
+        return names
+
+    def add_to_bundles(self, connection, date, paths, snapshots):
+        # A bundle is closed once its compressed size reached bundle_bytes
+        names = []
+        bundle = None
+        zf = None
+        try:
+            for path in paths:
+                size = os.path.getsize(path)
+                if bundle is None or bundle[2] >= self.bundle_bytes:
+                    if zf is not None:
+                        zf.close()
+                        self.update_bundle_size(connection, bundle[0])
+                    bundle = self.open_bundle(connection, date)
+                    bundle_path = os.path.join(self.directory, bundle[0])
+                    if bundle[0] not in snapshots:
+                        snapshots[bundle[0]] = self.snapshot_bundle(bundle_path)
+                    zf = zipfile.ZipFile(bundle_path, "a", zipfile.ZIP_DEFLATED)
+
+                name = self.unique_name(connection, os.path.basename(path))
+                zf.write(path, name)
+                connection.execute("INSERT INTO sweeps (name, bundle, size, archived) VALUES (?, ?, ?, ?)",
+                                   (name, bundle[0], size, time.time()))
+                bundle[2] += zf.getinfo(name).compress_size + len(name) + 76
+                names.append(name)
+        finally:
+            if zf is not None:
+                zf.close()
+                self.update_bundle_size(connection, bundle[0])
+        return names
+
+    def open_bundle(self, connection, date):
+        # Latest bundle of the day, or a new one when it is full
+        row = connection.execute("SELECT name, seq, size FROM bundles WHERE date = ? ORDER BY seq DESC LIMIT 1",
+                                 (date,)).fetchone()
+        if row is not None and row[2] < self.bundle_bytes:
+            return [row[0], row[1], row[2]]
+
+        seq = 0 if row is None else row[1] + 1
+        name = date + (f"_{seq}" if seq else "") + BUNDLE_SUFFIX
+        connection.execute("INSERT INTO bundles (name, date, seq, size) VALUES (?, ?, ?, 0)", (name, date, seq))
+        return [name, seq, 0]
+
+    @staticmethod
+    def snapshot_bundle(path):
+        # Members are appended over the central directory, keep it to undo the append
+        if not os.path.exists(path):
+            return None
+        with zipfile.ZipFile(path, "r") as zf:
+            start = zf.start_dir
+        with open(path, "rb") as fp:
+            fp.seek(start)
+            return start, fp.read()
+
+    def restore_bundles(self, snapshots):
+        for bundle, snapshot in snapshots.items():
+            path = os.path.join(self.directory, bundle)
+            try:
+                if snapshot is None:
+                    if os.path.exists(path):
+                        os.remove(path)
+                    continue
+                start, central_directory = snapshot
+                with open(path, "r+b") as fp:
+                    fp.seek(start)
+                    fp.write(central_directory)
+                    fp.truncate()
+            except OSError as e:
+                print(f"[Archive] ⚠️ Could not restore {bundle}: {e}")
+
+    def update_bundle_size(self, connection, bundle):
+        size = os.path.getsize(os.path.join(self.directory, bundle))
+        connection.execute("UPDATE bundles SET size = ? WHERE name = ?", (size, bundle))
+
+    @staticmethod
+    def unique_name(connection, name):
+        # Same name archived before (sweeps with the same timestamp): add a suffix
+        if connection.execute("SELECT 1 FROM sweeps WHERE name = ?", (name,)).fetchone() is None:
+            return name
+        base, ext = os.path.splitext(name)
+        counter = 1
+        while connection.execute("SELECT 1 FROM sweeps WHERE name = ?", (f"{base}_{counter}{ext}",)).fetchone():
+            counter += 1
+        return f"{base}_{counter}{ext}"
+
+    def compact(self, directory):
+        """Moves the loose sweep files of directory into the archive."""
+        with os.scandir(directory) as entries:
+            paths = sorted(entry.path for entry in entries if entry.is_file() and entry.name.endswith(".txt"))
+        for start in range(0, len(paths), 1000):
+            self.add_files(paths[start:start + 1000])
+        return len(paths)
+
+    # *** Reading *** #
+    def names(self, prefix=""):
+        with self.lock:
+            rows = self.connect().execute("SELECT name FROM sweeps WHERE name LIKE ? ORDER BY name",
+                                          (prefix.replace("%", "") + "%",)).fetchall()
+        return [row[0] for row in rows]
+
+    def read_bytes(self, name):
+        with self.lock:
+            row = self.connect().execute("SELECT bundle FROM sweeps WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            raise KeyError(f"{name} is not archived")
+        with zipfile.ZipFile(os.path.join(self.directory, row[0]), "r") as zf:
+            return zf.read(name)
+
+    def read(self, name):
+        """Returns (frequencies, traces, parameters) of an archived sweep file."""
+        return parse_trace_record(self.read_bytes(name).decode())
+
+    # *** Retention *** #
+    def enforce_retention(self, max_age_days=None, max_bytes=None, extra_files=()):
+        """
+        Removes bundles (and extra_files, e.g. sweep store segments named by date)
+        older than max_age_days, then the oldest ones until max_bytes is met.
+        Returns the removed file names.
+        """
+        with self.lock, self.locked():
+            connection = self.connect()
+            items = [(date, name, size, True) for name, date, size in
+                     connection.execute("SELECT name, date, size FROM bundles").fetchall()]
+            for path in extra_files:
+                items.append((sweep_date(os.path.basename(path)), path, os.path.getsize(path), False))
+            items.sort()
+
+            cutoff = (datetime.now() - timedelta(days=max_age_days)).strftime("%Y-%m-%d") if max_age_days else None
+            total = sum(item[2] for item in items)
+            removed = []
+            for date, name, size, is_bundle in items:
+                too_old = cutoff is not None and date < cutoff
+                over_budget = bool(max_bytes) and total > max_bytes
+                if not too_old and not over_budget:
+                    break
+                if is_bundle:
+                    path = os.path.join(self.directory, name)
+                    if os.path.exists(path):
+                        os.remove(path)
+                    with connection:
+                        connection.execute("BEGIN IMMEDIATE")
+                        connection.execute("DELETE FROM sweeps WHERE bundle = ?", (name,))
+                        connection.execute("DELETE FROM bundles WHERE name = ?", (name,))
+                else:
+                    os.remove(name)
+                total -= size
+                removed.append(os.path.basename(name))
+            return removed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep archive of results/vna_backup")
+    parser.add_argument("command", choices=["compact", "list", "get"])
+    parser.add_argument("name", nargs="?", default="", help="sweep name (get) or name prefix (list)")
+    parser.add_argument("--directory", default=os.path.join(os.getcwd(), "results/vna_backup"))
+    args = parser.parse_args()
+
+    archive = SweepArchive(os.path.join(args.directory, "archive"))
+    if args.command == "compact":
+        print(f"[Archive] {archive.compact(args.directory)} files archived")
+    elif args.command == "list":
+        print("\n".join(archive.names(args.name)))
+    else:
+        print(archive.read_bytes(args.name).decode())
@@ -0,0 +1,141 @@
+import json
+import os
+import threading
+import time
+
+from filelock import FileLock
+
+# Circuit breaker for a remote endpoint
+#
+# After `threshold` connection failures in a row the circuit opens: callers
+# fail fast with CircuitOpenError instead of waiting out a timeout. While it
+# is open one background probe checks the endpoint, with an exponentially
+# growing delay, and closes the circuit once it answers. The state is kept in
+# a small JSON file so every process on the Pi (controller, worker, system
+# script) shares it, and only one of them probes at a time.
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class CircuitBreaker:
+    def __init__(self, name, probe, state_path, threshold=3, base_delay=5, max_delay=300):
+        self.name = name
+        self.probe = probe
+        self.state_path = state_path
+        self.file_lock = FileLock(state_path + ".lock")
+        self.threshold = threshold
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self.lock = threading.Lock()
+        self.probing = False
+        self.state_stat = None
+        self.state = self.closed_state()
+
+    @staticmethod
+    def closed_state():
+        return {"open": False, "failures": 0, "delay": 0, "probe_at": 0}
+
+    # *** Shared state *** #
+    def load(self):
+        # Only read the file again when it changed
+        try:
+            stat = os.stat(self.state_path)
+        except FileNotFoundError:
+            self.state_stat = None
+            self.state = self.closed_state()
+            return self.state
+        key = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+        if key != self.state_stat:
+            try:
+                with open(self.state_path, "r") as fp:
+                    self.state = {**self.closed_state(), **json.load(fp)}
+            except (OSError, ValueError):
+                self.state = self.closed_state()
+            self.state_stat = key
+        return self.state
+
+    def save(self, state):
+        tmp_path = f"{self.state_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as fp:
+            json.dump(state, fp)
+        os.replace(tmp_path, self.state_path)
+        self.state = state
+        self.state_stat = None
+
+    def update(self, change):
+        # Read-modify-write of the shared state
+        with self.lock, self.file_lock:
+            self.state_stat = None
+            state = dict(self.load())
+            change(state)
+            self.save(state)
+            return state
+
+    # *** Callers *** #
+    def is_open(self):
+        with self.lock:
+            is_open = self.load()["open"]
+        if is_open:
+            self.start_probe()
+        return is_open
+
+    def check(self):
+        if self.is_open():
+            raise CircuitOpenError(f"{self.name} unreachable, circuit open")
+
+    def success(self):
+        with self.lock:
+            state = self.load()
+        if state["failures"] or state["open"]:
+            self.update(lambda state: state.update(self.closed_state()))
+
+    def failure(self):
+        def count(state):
+            state["failures"] += 1
+            if not state["open"] and state["failures"] >= self.threshold:
+                state.update(open=True, delay=self.base_delay, probe_at=time.time() + self.base_delay)
+                print(f"[Circuit] ⚠️ {self.name} unreachable, retrying in {self.base_delay} s")
+
+        if self.update(count)["open"]:
+            self.start_probe()
+
+    # *** Health probe *** #
+    def start_probe(self):
+        with self.lock:
+            if self.probing:
+                return
+            self.probing = True
+        threading.Thread(target=self.run_probe, daemon=True).start()
+
+    def run_probe(self):
+        try:
+            while True:
+                # Claim the next probe, or wait for the one another process claimed
+                with self.lock, self.file_lock:
+                    self.state_stat = None
+                    state = dict(self.load())
+                    if not state["open"]:
+                        return
+                    wait = state["probe_at"] - time.time()
+                    if wait <= 0:
+                        state["delay"] = min(max(state["delay"], self.base_delay) * 2, self.max_delay)
+                        state["probe_at"] = time.time() + state["delay"]
+                        self.save(state)
+                if wait > 0:
+                    time.sleep(min(wait, self.max_delay))
+                    continue
+
+                try:
+                    healthy = self.probe()
+                except Exception:
+                    healthy = False
+                if healthy:
+                    self.update(lambda state: state.update(self.closed_state()))
+                    print(f"[Circuit] ✓ {self.name} reachable again")
+                    return
+        finally:
+            with self.lock:
+                self.probing = False
@@ -0,0 +1,230 @@
+import asyncio
+import json
+import os
+import socket
+import time
+from collections import namedtuple
+from dataclasses import fields
+from datetime import datetime, timedelta
+
+from lib.configuration import get_settings, ConfigError
+from lib.socket_helper import CONFIG_BUS_PATH
+
+# Config change bus
+#
+# The controller hosts a Unix socket that carries newline delimited JSON.
+# Whoever wrote config.yaml (the dashboard) publishes {"op": "publish"}; the
+# host compiles the file, compares it with the previous settings and sends
+# the difference to every subscriber as typed changes:
+#
+#   {"type": "changes", "changes": [{"section": "vna", "key": "power", "old": 0, "new": -26}]}
+#
+# Requests that are not settings (a single measurement) are sent as commands
+# ({"op": "command", "name": ...}) and never touch the file. Clients send
+# {"op": "subscribe"} to receive the events on their connection. The host
+# also checks the file every second, so edits made without a publish are
+# delivered as well.
+
+ConfigChange = namedtuple("ConfigChange", ["section", "key", "old", "new"])
+Command = namedtuple("Command", ["name", "arguments"])
+
+# Keys the dashboard posts that are events, not settings: command name, or None to drop the key
+EVENT_KEYS = {
+    ("measurement_status", "single_measurement"): "single_measurement",
+    ("configurations", "update"): None,
+    ("timer_settings", "update"): None,
+}
+
+
+def diff_settings(old, new):
+    """Changed fields between two compiled configs (lib.configuration.Settings)."""
+    changes = []
+    for section in fields(new):
+        if section.name == "raw":
+            continue
+        old_section = getattr(old, section.name)
+        new_section = getattr(new, section.name)
+        if old_section == new_section:
+            continue
+        for item in fields(new_section):
+            old_value = getattr(old_section, item.name)
+            new_value = getattr(new_section, item.name)
+            if old_value != new_value:
+                changes.append(ConfigChange(section.name, item.name, old_value, new_value))
+    return changes
+
+
+def split_events(data):
+    """Removes the EVENT_KEYS from posted config data, returns the commands they requested."""
+    commands = []
+    for (section, key), command in EVENT_KEYS.items():
+        values = data.get(section)
+        if not isinstance(values, dict) or key not in values:
+            continue
+        if values.pop(key) and command is not None:
+            commands.append(command)
+        if not values:
+            data.pop(section)
+    return commands
+
+
+def encode_value(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, timedelta):
+        return value.total_seconds()
+    if isinstance(value, tuple):
+        return list(value)
+    return value
+
+
+def encode_event(event):
+    if isinstance(event, Command):
+        return {"type": "command", "name": event.name, "arguments": event.arguments}
+    return {"type": "changes", "changes": [{**change._asdict(), "old": encode_value(change.old),
+                                            "new": encode_value(change.new)} for change in event]}
+
+
+def decode_event(message):
+    if message.get("type") == "command":
+        return Command(message["name"], message.get("arguments") or {})
+    return [ConfigChange(**change) for change in message.get("changes", [])]
+
+
+class ConfigBus:
+    """
+    Host side of the bus, runs as tasks on the controller's event loop.
+    Handlers are called on the loop with a list of ConfigChange or a Command.
+    """
+
+    def __init__(self, path=CONFIG_BUS_PATH, watch_interval=1.0):
+        self.path = path
+        self.watch_interval = watch_interval
+        self.handlers = []
+        self.clients = []
+        self.settings = None
+        self.error = None
+        self.server = None
+
+    def subscribe(self, handler):
+        self.handlers.append(handler)
+
+    async def start(self, settings):
+        self.settings = settings
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self.server = await asyncio.start_unix_server(self.handle_client, path=self.path)
+        asyncio.get_running_loop().create_task(self.watch())
+        print(f"[Bus] 🟢 Listening on {self.path}")
+
+    # *** Events *** #
+    def refresh(self):
+        """Compiles the config file and delivers what changed, returns the changes."""
+        try:
+            settings = get_settings()
+        except ConfigError as e:
+            if str(e) != self.error:
+                print(f"[Bus] ⚠️ Invalid configuration, changes are not applied: {e}")
+                self.error = str(e)
+            return []
+        self.error = None
+
+        changes = []
+        if self.settings is not None and settings is not self.settings:
+            changes = diff_settings(self.settings, settings)
+        self.settings = settings
+        if changes:
+            self.dispatch(changes)
+        return changes
+
+    def command(self, name, **arguments):
+        self.dispatch(Command(name, arguments))
+
+    def dispatch(self, event):
+        for handler in self.handlers:
+            try:
+                handler(event)
+            except Exception as e:
+                print(f"[Bus] ⚠️ Handler failed: {e}")
+
+        line = (json.dumps(encode_event(event)) + "\n").encode()
+        for writer in list(self.clients):
+            if writer.is_closing():
+                self.clients.remove(writer)
+            else:
+                writer.write(line)
+
+    async def watch(self):
+        # A stat() per interval, the file is only parsed when it changed
+        while True:
+            await asyncio.sleep(self.watch_interval)
+            self.refresh()
+
+    # *** Socket *** #
+    async def handle_client(self, reader, writer):
+        try:
+            while line := await reader.readline():
+                try:
+                    request = json.loads(line)
+                    op = request.get("op")
+                    if op == "subscribe":
+                        self.clients.append(writer)
+                        response = {"status": "ok"}
+                    elif op == "publish":
+                        response = {"status": "ok", "changes": len(self.refresh())}
+                    elif op == "command":
+                        self.command(request["name"], **(request.get("arguments") or {}))
+                        response = {"status": "ok"}
+                    else:
+                        raise ValueError(f"Unknown operation '{op}'")
+                except Exception as e:
+                    response = {"status": "error", "message": str(e)}
+                writer.write((json.dumps(response) + "\n").encode())
+                await writer.drain()
+        except (ConnectionError, OSError):
+            pass
+        finally:
+            if writer in self.clients:
+                self.clients.remove(writer)
+            writer.close()
+
+
+# *** Clients *** #
+def request_bus(message, path=CONFIG_BUS_PATH, timeout=2):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(path)
+        client.sendall((json.dumps(message) + "\n").encode())
+
+        with client.makefile('rb') as stream:
+            response = json.loads(stream.readline() or b"{}")
+
+    if response.get("status") != "ok":
+        raise Exception(f"Config bus: {response.get('message', 'no response')}")
+    return response
+
+
+def publish_config_change(path=CONFIG_BUS_PATH):
+    """Tells the host that config.yaml changed, returns the number of changed settings."""
+    return request_bus({"op": "publish"}, path)["changes"]
+
+
+def send_command(name, path=CONFIG_BUS_PATH, **arguments):
+    request_bus({"op": "command", "name": name, "arguments": arguments}, path)
+
+
+def listen(handler, path=CONFIG_BUS_PATH, retry_interval=5):
+    """Calls handler(event) for every event of the bus, reconnects while the host is down."""
+    while True:
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+                client.connect(path)
+                client.sendall(b'{"op": "subscribe"}\n')
+                with client.makefile('rb') as stream:
+                    for line in stream:
+                        message = json.loads(line)
+                        if "type" in message:
+                            handler(decode_event(message))
+        except (OSError, ValueError) as e:
+            print(f"[Bus] Not connected ({e}), retrying in {retry_interval} s")
+        time.sleep(retry_interval)
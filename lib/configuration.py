@@ -1,40 +1,354 @@
 import yaml
 import os
+import copy
+import hashlib
+import threading
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
 from filelock import FileLock
 
 home_dir = os.path.expanduser("~")
 CONFIG_PATH = home_dir + "/config.yaml"
 LOCK_PATH = CONFIG_PATH + ".lock"
 
+def read_yaml_file(path=CONFIG_PATH, lock_path=LOCK_PATH):
+    with FileLock(lock_path):
+        return _load_yaml(path)
+
+def _load_yaml(path):
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r') as file:
+        return yaml.safe_load(file) or {}
+
 def retrieve_yaml_file():
+    # Fresh, mutable copy of the config file; see get_config() for the cached snapshot
     config = {}
     try:
-        with FileLock(LOCK_PATH):
-            if os.path.exists(CONFIG_PATH):
-                with open(CONFIG_PATH, 'r') as file:
-                    config = yaml.safe_load(file) or {}
+        config = read_yaml_file()
     except Exception as e:
         print(f"⚠️ Error reading YAML file: {e}")
 
     return config
 
-#   YAML functions
-def update_yaml_flag(TAGlvl1, TAGlvl2, value):
+#   Cached config
+class FrozenDict(dict):
+    """Read-only dict of a config snapshot, copy.deepcopy() returns a plain mutable copy."""
+
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("Config snapshots are read-only, use copy.deepcopy() for a mutable copy")
+
+    __setitem__ = __delitem__ = __ior__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+def freeze(value):
+    if isinstance(value, dict):
+        return FrozenDict((key, freeze(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+def thaw(value):
+    if isinstance(value, dict):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [thaw(item) for item in value]
+    return value
+
+class ConfigCache:
+    """
+    Keeps the parsed config file and parses it again only when its inode,
+    modification time or size changed. Every get() returns the same immutable
+    snapshot until then, so polling it is a single stat() call.
+    """
+
+    def __init__(self, path=CONFIG_PATH, lock_path=LOCK_PATH):
+        self.path = path
+        self.lock_path = lock_path
+        self.lock = threading.Lock()
+        self.key = None
+        self.snapshot = None
+        self.compiled = None
+
+    def stat_key(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def get(self):
+        key = self.stat_key()
+        with self.lock:
+            if self.snapshot is None or key != self.key:
+                try:
+                    self.snapshot = freeze(read_yaml_file(self.path, self.lock_path))
+                    self.key = key
+                except Exception as e:
+                    # Keep the last good snapshot, the next call tries again
+                    print(f"⚠️ Error reading YAML file: {e}")
+                    if self.snapshot is None:
+                        return freeze({})
+            return self.snapshot
+
+    def settings(self):
+        # Compiled once per snapshot, an invalid file raises the same ConfigError until it changes
+        snapshot = self.get()
+        with self.lock:
+            if self.compiled is None or self.compiled[0] is not snapshot:
+                try:
+                    self.compiled = (snapshot, compile_config(snapshot), None)
+                except ConfigError as e:
+                    self.compiled = (snapshot, None, e)
+            if self.compiled[2] is not None:
+                raise self.compiled[2]
+            return self.compiled[1]
+
+    def invalidate(self):
+        with self.lock:
+            self.key = None
+            self.snapshot = None
+            self.compiled = None
+
+config_cache = ConfigCache()
+
+def get_config():
+    return config_cache.get()
+
+def get_settings():
+    return config_cache.settings()
+
+def get_parameters(settings):
+    # "parameter" holds one S-parameter or a list ("S11,S21" or a YAML list)
+    parameters = settings['parameter']
+    if isinstance(parameters, str):
+        parameters = parameters.split(',')
+    return [str(parameter).strip().upper() for parameter in parameters]
+
+def config_hash(settings):
+    # Identifies the instrument settings a sweep was taken with
+    keys = ("center", "span", "points", "ifbw", "power", "sweeps", "parameter")
+    description = ";".join(f"{key}={settings.get(key)}" for key in keys)
+    return hashlib.sha1(description.encode()).hexdigest()[:16]
+
+#   Typed settings
+# The YAML file is compiled into frozen dataclasses once per change of the
+# file (see get_settings()). Values are converted and checked against the
+# limits of the LibreVNA there, so an invalid file raises ConfigError before
+# a sweep starts and the measurement code only reads attributes.
+FREQUENCY_RANGE = (100_000, 6_000_000_000)
+POINTS_RANGE = (2, 4501)
+IFBW_RANGE = (10, 50_000)
+POWER_RANGE = (-42, 0)
+S_PARAMETERS = ("S11", "S12", "S21", "S22")
+STORAGE_MODES = ("binary", "text")
+
+class ConfigError(ValueError):
+    pass
+
+def config_section(config, name):
+    value = config.get(name)
+    if not isinstance(value, dict):
+        raise ConfigError(f"Missing section '{name}'")
+    return value
+
+def config_int(settings, name, key, default=None):
+    value = settings.get(key, default)
     try:
-        with FileLock(LOCK_PATH):
-            with open(CONFIG_PATH, 'r') as f:
-                config = yaml.safe_load(f) or {}
+        # center and span are quoted in the YAML file, "5e9" is fine as well
+        number = float(value) if isinstance(value, str) else value
+        if isinstance(number, bool) or int(number) != number:
+            raise ValueError
+        return int(number)
+    except (TypeError, ValueError, OverflowError):
+        raise ConfigError(f"{name}.{key}: {value!r} is not an integer") from None
+
+def check_range(name, key, value, limits):
+    if not limits[0] <= value <= limits[1]:
+        raise ConfigError(f"{name}.{key}: {value} is outside {limits[0]}..{limits[1]}")
+    return value
+
+@dataclass(frozen=True, slots=True)
+class VnaSettings:
+    center: int
+    span: int
+    points: int
+    ifbw: int
+    power: int
+    sweeps: int
+    measurements: int
+    parameters: tuple
+    start: float
+    stop: float
+    parameter_number: int
+    config_hash: str
+
+    @classmethod
+    def compile(cls, settings, name="configurations"):
+        center = config_int(settings, name, "center")
+        span = config_int(settings, name, "span")
+        start, stop = center - span / 2, center + span / 2
+        if span < 0 or start < FREQUENCY_RANGE[0] or stop > FREQUENCY_RANGE[1]:
+            raise ConfigError(f"{name}: sweep {start:.0f}..{stop:.0f} Hz is outside "
+                              f"{FREQUENCY_RANGE[0]}..{FREQUENCY_RANGE[1]} Hz")
+
+        if settings.get("parameter") in (None, ""):
+            raise ConfigError(f"{name}.parameter is missing")
+        parameters = tuple(get_parameters(settings))
+        for parameter in parameters:
+            if parameter not in S_PARAMETERS:
+                raise ConfigError(f"{name}.parameter: unknown S-parameter '{parameter}'")
+
+        return cls(
+            center=center,
+            span=span,
+            points=check_range(name, "points", config_int(settings, name, "points"), POINTS_RANGE),
+            ifbw=check_range(name, "ifbw", config_int(settings, name, "ifbw"), IFBW_RANGE),
+            power=check_range(name, "power", config_int(settings, name, "power"), POWER_RANGE),
+            sweeps=check_range(name, "sweeps", config_int(settings, name, "sweeps", 1), (1, 1000)),
+            measurements=check_range(name, "measurements", config_int(settings, name, "measurements", 1), (1, 1000)),
+            parameters=parameters,
+            start=start,
+            stop=stop,
+            parameter_number=int(parameters[0][1:]),
+            config_hash=config_hash(settings),
+        )
+
+@dataclass(frozen=True, slots=True)
+class FixedSettings:
+    radar_name: str
+    firmware_version: str
+    rf_switch_pin: int
+    polarisation_inverted: bool
+    storage: str
+
+    @classmethod
+    def compile(cls, settings, name="fixed_configurations"):
+        if not settings.get("radar_name"):
+            raise ConfigError(f"{name}.radar_name is missing")
+        storage = settings.get("storage", "binary")
+        if storage not in STORAGE_MODES:
+            raise ConfigError(f"{name}.storage: '{storage}' is not one of {', '.join(STORAGE_MODES)}")
+        return cls(
+            radar_name=str(settings["radar_name"]),
+            firmware_version=str(settings.get("firmware_version", "")),
+            rf_switch_pin=check_range(name, "rf_switch_pin", config_int(settings, name, "rf_switch_pin"), (0, 27)),
+            polarisation_inverted=bool(config_int(settings, name, "polarisation_inverted", 0)),
+            storage=storage,
+        )
+
+@dataclass(frozen=True, slots=True)
+class MeasurementStatus:
+    auto_measurement: bool
+    device_mode: str
+
+    @classmethod
+    def compile(cls, settings, name="measurement_status"):
+        return cls(
+            auto_measurement=bool(config_int(settings, name, "auto_measurement", 0)),
+            device_mode=str(settings.get("device_mode", "")),
+        )
+
+@dataclass(frozen=True, slots=True)
+class TimerSettings:
+    start_time: datetime
+    interval: timedelta
+    temp_interval: timedelta
+    live_updates: bool
+
+    @classmethod
+    def compile(cls, settings, name="timer_settings"):
+        def interval(prefix):
+            value = timedelta(hours=config_int(settings, name, f"{prefix}_hour", 0),
+                              minutes=config_int(settings, name, f"{prefix}_minute", 0),
+                              seconds=config_int(settings, name, f"{prefix}_second", 0))
+            if value <= timedelta(0):
+                raise ConfigError(f"{name}: {prefix} must be longer than 0 s")
+            return value
 
-            # Check of de eerste en tweede tag bestaan
-            if TAGlvl1 not in config or TAGlvl2 not in config[TAGlvl1]:
-                raise KeyError(f"'{TAGlvl1}' or '{TAGlvl2}' not found in config")
+        try:
+            start_time = datetime(*(config_int(settings, name, f"init_{key}") for key in
+                                    ("year", "month", "day", "hour", "minute", "second")), tzinfo=timezone.utc)
+        except ValueError as e:
+            raise ConfigError(f"{name}: invalid start time ({e})") from None
 
-            # Pas de waarde aan
-            config[TAGlvl1][TAGlvl2] = value
+        return cls(
+            start_time=start_time,
+            interval=interval("interval"),
+            temp_interval=interval("temp_interval"),
+            live_updates=bool(config_int(settings, name, "live_updates", 0)),
+        )
 
-            # Schrijf het bestand terug
-            with open(CONFIG_PATH, 'w') as f:
+@dataclass(frozen=True, slots=True)
+class Settings:
+    vna: VnaSettings
+    fixed: FixedSettings
+    status: MeasurementStatus
+    timers: TimerSettings
+    # The snapshot it was compiled from, for the sections without a schema (influxdb, archive)
+    raw: dict = field(repr=False, compare=False)
+
+def compile_config(config):
+    """Converts and validates a config dict, raises ConfigError when it is invalid."""
+    return Settings(
+        vna=VnaSettings.compile(config_section(config, "configurations")),
+        fixed=FixedSettings.compile(config_section(config, "fixed_configurations")),
+        status=MeasurementStatus.compile(config_section(config, "measurement_status")),
+        timers=TimerSettings.compile(config_section(config, "timer_settings")),
+        raw=config if isinstance(config, FrozenDict) else freeze(config),
+    )
+
+#   YAML functions
+@contextmanager
+def config_transaction(path=CONFIG_PATH, lock_path=LOCK_PATH):
+    """
+    Yields a mutable copy of the config file, read and written back under one
+    lock. The new content goes to a temp file that replaces the config file,
+    so readers never see a half written file. Nothing is written when the
+    content did not change.
+    """
+    with FileLock(lock_path):
+        config = _load_yaml(path)
+        original = copy.deepcopy(config)
+
+        yield config
+
+        if config == original:
+            return
+
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
                 yaml.safe_dump(config, f, default_flow_style=False)
+                f.flush()
+                os.fsync(f.fileno())
+            if os.path.exists(path):
+                os.chmod(tmp_path, os.stat(path).st_mode & 0o7777)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+def update_yaml_flags(changes):
+    """Applies {(TAGlvl1, TAGlvl2): value} in one transaction, returns False when it failed."""
+    try:
+        with config_transaction() as config:
+            for (TAGlvl1, TAGlvl2), value in changes.items():
+                # Check of de eerste en tweede tag bestaan
+                if TAGlvl1 not in config or TAGlvl2 not in config[TAGlvl1]:
+                    raise KeyError(f"'{TAGlvl1}' or '{TAGlvl2}' not found in config")
+
+                # Pas de waarde aan
+                config[TAGlvl1][TAGlvl2] = value
+        return True
 
     except Exception as e:
-        print(f"⚠️ Failed to update config: {e}")
\ No newline at end of file
+        print(f"⚠️ Failed to update config: {e}")
+        return False
+
+def update_yaml_flag(TAGlvl1, TAGlvl2, value):
+    return update_yaml_flags({(TAGlvl1, TAGlvl2): value})
@@ -0,0 +1,136 @@
+import argparse
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from lib.trace_file import read_trace_record
+from lib.sweep_store import SweepStore, SEGMENT_SUFFIX
+
+# Converts sweep files (.txt) and sweep store segments (.swp) to csv files
+# with magnitude [dB] and phase [deg]. The manifest remembers what has been
+# converted already, so running it again on a directory only touches new data.
+
+MANIFEST_NAME = ".converted.json"
+
+
+def calculate_magnitude_phase_arrays(trace):
+    magnitude = 20*np.log10(np.abs(trace))
+    phase = np.degrees(np.angle(trace))
+    return magnitude, phase
+
+
+def write_csv_file(path, frequencies, traces, parameters=None):
+    traces = np.asarray(traces).reshape(-1, len(frequencies))
+    magnitude, phase = calculate_magnitude_phase_arrays(traces)
+
+    # Single-trace records keep the plain column names
+    if len(traces) == 1:
+        parameters = None
+
+    header = ['Frequency [Hz]']
+    columns = [np.asarray(frequencies).tolist()]
+    for i, parameter in enumerate(parameters or [None]):
+        prefix = f"{parameter} " if parameter else ""
+        header += [f"{prefix}Magnitude [dB]", f"{prefix}Phase [deg]"]
+        columns += [magnitude[i].tolist(), phase[i].tolist()]
+
+    with open(path, 'w', newline='') as csvfile:
+        csvwriter = csv.writer(csvfile)
+        csvwriter.writerow(header)
+        csvwriter.writerows(zip(*columns))
+
+
+def convert_text_file(path, output_dir):
+    frequencies, traces, parameters = read_trace_record(path)
+    name = os.path.splitext(os.path.basename(path))[0]
+    write_csv_file(os.path.join(output_dir, f"{name}.csv"), frequencies, traces, parameters)
+    return 1
+
+
+def convert_segment(path, output_dir, offset=0):
+    # Segments are append-only, only records after offset are new
+    store = SweepStore(os.path.dirname(path))
+    converted = 0
+    for ref, sweep in store.iter_segment(path, offset):
+        name = sweep.timestamp.strftime("%Y-%m-%d_%H-%M-%S") + f"_dataset_{sweep.polarisation}"
+        write_csv_file(os.path.join(output_dir, f"{name}.csv"), sweep.frequencies, sweep.traces, sweep.parameters)
+        converted += 1
+    return converted
+
+
+def convert_source(path, output_dir, offset=0):
+    if path.endswith(SEGMENT_SUFFIX):
+        return convert_segment(path, output_dir, offset)
+    return convert_text_file(path, output_dir)
+
+
+def convert_directory(directory, output_dir=None, workers=None):
+    """Converts every new or changed sweep file in directory, returns the number of sweeps written."""
+    if output_dir is None:
+        output_dir = directory
+    os.makedirs(output_dir, exist_ok=True)
+
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+
+    jobs = []
+    with os.scandir(directory) as entries:
+        for entry in entries:
+            if not entry.is_file() or not entry.name.endswith((".txt", SEGMENT_SUFFIX)):
+                continue
+            stat = entry.stat()
+            previous = manifest.get(entry.name)
+            if previous == [stat.st_size, stat.st_mtime_ns]:
+                continue
+
+            # A segment that only grew continues where the last run stopped
+            offset = 0
+            if entry.name.endswith(SEGMENT_SUFFIX) and previous is not None and previous[0] <= stat.st_size:
+                offset = previous[0]
+            jobs.append((entry.path, entry.name, offset, [stat.st_size, stat.st_mtime_ns]))
+
+    if not jobs:
+        return 0
+
+    converted = 0
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [(executor.submit(convert_source, path, output_dir, offset), name, state)
+                   for path, name, offset, state in jobs]
+        for future, name, state in futures:
+            try:
+                converted += future.result()
+            except Exception as e:
+                print(f"⚠️ Failed to convert {name}: {e}")
+                continue
+            manifest[name] = state
+
+    save_manifest(manifest_path, manifest)
+    return converted
+
+
+def load_manifest(path):
+    try:
+        with open(path, 'r') as fp:
+            return json.load(fp)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+def save_manifest(path, manifest):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'w') as fp:
+        json.dump(manifest, fp)
+    os.replace(tmp_path, path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert sweep files in a directory to csv")
+    parser.add_argument("directory", nargs="?", default=os.path.join(os.getcwd(), "results/vna_backup"))
+    parser.add_argument("--output", default=None, help="directory for the csv files (default: same directory)")
+    parser.add_argument("--workers", type=int, default=None, help="number of worker processes")
+    args = parser.parse_args()
+
+    print(f"[Convert] {convert_directory(args.directory, args.output, args.workers)} sweeps converted")
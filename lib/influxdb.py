@@ -6,6 +6,22 @@ import os
 import re
 import shutil
 import glob
+import threading
+import time
+import atexit
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+from lib.trace_file import read_trace_file, read_trace_record
+from lib.sweep_store import SweepStore, SweepRef, CURSOR_SUFFIX, SEGMENT_SUFFIX
+from lib.archive import SweepArchive
+from lib.upload_queue import UploadQueue, upload_location
+from lib.rate_limiter import RateLimiter
+from lib.circuit_breaker import CircuitBreaker, CircuitOpenError
+from lib.offline_sink import LineProtocolSink
+from lib.line_protocol import trace_lines
+from lib.sweep_schema import pack_trace, pack_axis, unpack_trace, unpack_axis, axis_hash
 
 # Directory with latest results
 result_vna_dir = os.path.join(os.getcwd(), "results/vna")
@@ -13,44 +29,17 @@ result_vna_dir = os.path.join(os.getcwd(), "results/vna")
 # Directory with backup results
 result_vna_backup_dir = os.path.join(os.getcwd(), "results/vna_backup")
 
-#   Init lists
-frequencies = []
-reals = []
-imags = []
-number_of_points = 0
+# Binary sweep store in the results directory
+vna_store = SweepStore(result_vna_dir)
 
-def get_oldest_file(debug_name):
-    files = [os.path.join(result_vna_dir, f) for f in os.listdir(result_vna_dir) if os.path.isfile(os.path.join(result_vna_dir, f))]
-
-    if files:
-        oldest_file = min(files, key=os.path.getmtime)
-        # print("📄 File:", oldest_file)
-        debug(debug_name, f"📄 File: {oldest_file}")
-        return oldest_file
-    else:
-        # print("⚠️ No files found", result_vna_dir)
-        debug(debug_name, f"⚠️ No files found {result_vna_dir}")
-        return ""
-    
+# Upload journal in the results directory, see lib/upload_queue.py
+upload_queue = UploadQueue(os.path.join(result_vna_dir, "upload_queue.db"))
 
+# Compressed bundles of uploaded text files, see lib/archive.py
+vna_archive = SweepArchive(os.path.join(result_vna_backup_dir, "archive"))
 
 def retrieve_data_from_file(file):
-
-    with open(file, "r") as file:
-        for line in file:
-            try:
-                freq_str, complex_str = line.strip().split(";")
-                freq = float(freq_str)
-
-                # Verwijder haakjes en zet om naar complex getal
-                complex_val = complex(complex_str.replace("(", "").replace(")", ""))
-                
-                # Waarden toevoegen aan lijsten
-                frequencies.append(freq)
-                reals.append(complex_val.real)
-                imags.append(complex_val.imag)
-            except Exception as e:
-                print(f"⚠️ Error processing rule: {line.strip()} → {e}")
+    return SweepUpload.from_file(file)
 
 
 def find_timestamp_in_filename(file_path):
@@ -128,164 +117,622 @@ def find_polarisation_in_filename(file_path):
 #     imags = []
 #     number_of_points = 0
 
-def send_data_influxdb(config, debug_name, ts, pol):
-    global frequencies, reals, imags
+class WriteBatch:
+    """Ticket for records handed to an InfluxWriter, resolved when their write request finished."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.success = False
+        self.error = None
+
+    def done(self):
+        return self.event.is_set()
+
+    def wait(self, timeout=None):
+        self.event.wait(timeout)
+        return self.success
+
+    def resolve(self, error=None):
+        self.error = error
+        self.success = error is None
+        self.event.set()
+
+
+class InfluxWriter:
+    """
+    One client per process. Records are buffered and written in large gzip
+    compressed requests, once batch_size points are waiting or the oldest
+    record waited flush_interval seconds. A record is a Point or a line
+    protocol string, which may hold many points. With a sink the requests are
+    written to offline line protocol segments instead.
+    """
+
+    def __init__(self, url, token, org, bucket, batch_size=20000, flush_interval=1.0, sink=None):
+        self.org = org
+        self.bucket = bucket
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.sink = sink
+        self.client = None
+        self.breaker = None
+        if sink is None:
+            self.client = InfluxDBClient(url=url, token=token, org=org, enable_gzip=True)
+            self.write_api = self.client.write_api(write_options=SYNCHRONOUS)
+
+            # Connectivity state shared by every process writing to this server
+            state_path = f"/tmp/influxdb_circuit_{hashlib.sha1(str(url).encode()).hexdigest()[:8]}.json"
+            self.breaker = CircuitBreaker("InfluxDB", self.client.ping, state_path)
+
+        self.records = []
+        self.sizes = []
+        self.size = 0
+        self.batches = []
+        self.oldest = None
+        self.lock = threading.Lock()
+        # Requests go out one at a time and in the order the records came in
+        self.flush_lock = threading.Lock()
+        self.closed = threading.Event()
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def write(self, records, flush=False):
+        if not isinstance(records, list):
+            records = [records]
+        sizes = [record.count("\n") + 1 if isinstance(record, str) else 1 for record in records]
+        batch = WriteBatch()
+        with self.lock:
+            self.records.extend(records)
+            self.sizes.extend(sizes)
+            self.size += sum(sizes)
+            self.batches.append(batch)
+            if self.oldest is None:
+                self.oldest = time.monotonic()
+            full = self.size >= self.batch_size
+        if flush or full:
+            self.flush()
+        return batch
+
+    def flush(self):
+        with self.flush_lock:
+            with self.lock:
+                records, sizes, batches = self.records, self.sizes, self.batches
+                self.records, self.sizes, self.batches, self.oldest = [], [], [], None
+                self.size = 0
+            if not batches:
+                return True
+
+            error = None
+            try:
+                for request in self.split(records, sizes):
+                    self.write_request(request)
+            except Exception as e:
+                error = e
+
+            for batch in batches:
+                batch.resolve(error)
+            return error is None
+
+    def write_request(self, records):
+        # Unbuffered write, for callers that batch and pace requests themselves.
+        # Fails fast with CircuitOpenError while the server is known to be down.
+        if self.sink is not None:
+            self.sink.write(records)
+            return
+        self.breaker.check()
+        try:
+            self.write_api.write(bucket=self.bucket, org=self.org, record=records)
+        except Exception as e:
+            if is_connection_error(e):
+                self.breaker.failure()
+            raise
+        self.breaker.success()
+
+    def available(self):
+        return self.sink is not None or not self.breaker.is_open()
+
+    def split(self, records, sizes):
+        # Requests of about batch_size points, a record is never split
+        request, size = [], 0
+        for record, record_size in zip(records, sizes):
+            request.append(record)
+            size += record_size
+            if size >= self.batch_size:
+                yield request
+                request, size = [], 0
+        if request:
+            yield request
+
+    def run(self):
+        # Age based flushing
+        while not self.closed.wait(self.flush_interval / 2):
+            with self.lock:
+                due = self.oldest is not None and time.monotonic() - self.oldest >= self.flush_interval
+            if due:
+                self.flush()
+
+    def close(self):
+        self.closed.set()
+        self.flush()
+        if self.sink is not None:
+            self.sink.close()
+        else:
+            self.client.close()
+
+
+writers = {}
+writers_lock = threading.Lock()
+
+def get_writer(config):
+    # influxdb.mode: "online" (default) or "offline", which writes line protocol segments to influxdb.offline_dir
+    influx = config['influxdb']
+    key = (influx['url'], influx['token'], influx['org'], influx['bucket'])
+    offline_dir = None
+    if influx.get('mode', 'online') == 'offline':
+        offline_dir = influx.get('offline_dir') or os.path.join(os.getcwd(), "results/influx_offline")
+        key = ('offline', offline_dir)
+
+    with writers_lock:
+        if key not in writers:
+            sink = LineProtocolSink(offline_dir) if offline_dir else None
+            writers[key] = InfluxWriter(influx['url'], influx['token'], influx['org'], influx['bucket'],
+                                        batch_size=int(influx.get('batch_size', 20000)),
+                                        flush_interval=float(influx.get('flush_interval', 1.0)),
+                                        sink=sink)
+        return writers[key]
+
+@atexit.register
+def close_writers():
+    with writers_lock:
+        for writer in writers.values():
+            try:
+                writer.close()
+            except Exception:
+                pass
+        writers.clear()
+
+def is_connection_error(error):
+    # Errors that say nothing about the server being reachable do not count
+    if isinstance(error, ApiException):
+        return error.status is None or error.status >= 500 or error.status == 429
+    return True
 
-    try:
-        client = InfluxDBClient(
-            url=config['influxdb']['url'],
-            token=config['influxdb']['token'],
-            org=config['influxdb']['org']
-        )
-        write_api = client.write_api(write_options=SYNCHRONOUS)
-
-        debug(debug_name, f"✓ Write API open.")
-
-        number_of_points = len(frequencies)
-
-        # Create points
-        points = []
-        for i in range(number_of_points):
-            point = (
-                Point("radar_measurement")
-                .time(ts)
-                .tag("radar", config['fixed_configurations']['radar_name'])
-                .tag("pol", pol)
-                .tag("frequency", str(frequencies[i]))
-                .field("real", reals[i])
-                .field("imag", imags[i])
-            )
-            points.append(point)
+def wait_batch(debug_name, batch):
+    if batch.wait():
+        return True
+    report_error(debug_name, batch.error)
+    return False
 
+def report_error(debug_name, error):
+    if isinstance(error, ApiException):
+        debug(debug_name, f"❗ InfluxDB API error: {error}")
+    else:
+        debug(debug_name, f"❗ Failed to write to InfluxDB: {error}")
+
+
+def build_trace_lines(config, ts, pol, trace_frequencies, trace_reals, trace_imags, parameter=None):
+    # One radar_measurement line per frequency bin, as a single line protocol body
+    tags = {"radar": config['fixed_configurations']['radar_name'], "pol": pol}
+    if parameter is not None:
+        tags["parameter"] = parameter
+    return trace_lines("radar_measurement", tags, trace_frequencies, trace_reals, trace_imags, ts)
+
+def use_packed_schema(config):
+    # influxdb.schema: "frequency" (default, one series per bin) or "packed"
+    return config['influxdb'].get('schema', 'frequency') == 'packed'
+
+# Frequency axes written for the packed schema, (url, bucket, radar, hash) → WriteBatch
+sent_axes = {}
+
+def queue_axis(config, ts, key, axis_frequencies):
+    radar = config['fixed_configurations']['radar_name']
+    axis_key = (config['influxdb']['url'], config['influxdb']['bucket'], radar, key)
+
+    # Write the axis again only when the previous write failed
+    batch = sent_axes.get(axis_key)
+    if batch is not None and (batch.success or not batch.done()):
+        return batch
+
+    point = Point("radar_configuration").time(ts).tag("radar", radar).tag("config", key)
+    for name, value in pack_axis(axis_frequencies).items():
+        point.field(name, value)
+    sent_axes[axis_key] = get_writer(config).write(point)
+    return sent_axes[axis_key]
+
+def build_packed_points(config, ts, pol, key, traces, parameters=None):
+    points = []
+    for i, trace in enumerate(traces):
+        point = (
+            Point("radar_sweep")
+            .time(ts)
+            .tag("radar", config['fixed_configurations']['radar_name'])
+            .tag("pol", pol)
+            .tag("config", key)
+        )
+        if parameters:
+            point.tag("parameter", parameters[i])
+        for name, value in pack_trace(trace).items():
+            point.field(name, value)
+        points.append(point)
+    return points
+
+def flux_string(value):
+    # Flux string literal, query parameters are not supported by InfluxDB OSS
+    return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('${', '\\${') + '"'
+
+def query_packed_sweeps(config, start="-1h", stop="now()", polarisation=None):
+    """
+    Rebuilds sweeps written with the packed schema.
+    Returns a list of (time, polarisation, parameter, frequencies, trace).
+    start and stop are Flux time expressions (-1h, now(), an RFC3339 time).
+    """
+    bucket = flux_string(config['influxdb']['bucket'])
+    radar = flux_string(config['fixed_configurations']['radar_name'])
+    pivot = '|> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")'
+    pol_filter = f' and r.pol == {flux_string(polarisation)}' if polarisation else ""
+
+    writer = get_writer(config)
+    if writer.client is None:
+        raise Exception("Reading sweeps back needs influxdb.mode: online")
+    query_api = writer.client.query_api()
+    axes_tables = query_api.query(
+        f'from(bucket: {bucket}) |> range(start: 0)'
+        f' |> filter(fn: (r) => r._measurement == "radar_configuration" and r.radar == {radar} and exists r.config)'
+        f' |> last() {pivot}')
+    axes = {record.values["config"]: unpack_axis(record.values) for table in axes_tables for record in table.records}
+
+    sweep_tables = query_api.query(
+        f'from(bucket: {bucket}) |> range(start: {start}, stop: {stop})'
+        f' |> filter(fn: (r) => r._measurement == "radar_sweep" and r.radar == {radar}{pol_filter}) {pivot}')
+
+    sweeps = []
+    for table in sweep_tables:
+        for record in table.records:
+            values = record.values
+            sweeps.append((record.get_time(), values["pol"], values.get("parameter"),
+                           axes.get(values["config"]), unpack_trace(values)))
+    return sorted(sweeps, key=lambda sweep: sweep[0])
+
+class SweepUpload:
+    """One sweep on its way to InfluxDB, uploads do not share any state."""
+
+    def __init__(self, timestamp, polarisation, frequencies, traces, parameters=None, config_hash=None, upload=None):
+        self.timestamp = timestamp
+        self.polarisation = polarisation
+        self.frequencies = np.asarray(frequencies)
+        self.traces = np.asarray(traces).reshape(-1, len(self.frequencies))
+        # Only multi-trace records are tagged with their parameter
+        self.parameters = parameters if len(self.traces) > 1 else None
+        self.config_hash = config_hash
+        self.upload = upload
+
+    @classmethod
+    def from_sweep(cls, sweep, upload=None):
+        return cls(sweep.timestamp.strftime('%Y-%m-%dT%H:%M:%S.000Z'), sweep.polarisation, sweep.frequencies,
+                   sweep.traces, sweep.parameters, sweep.config_hash, upload)
+
+    @classmethod
+    def from_file(cls, file, upload=None):
+        sweep_frequencies, traces, parameters = read_trace_record(file)
+        if upload is None:
+            return cls(find_timestamp_in_filename(file), find_polarisation_in_filename(file), sweep_frequencies, traces, parameters)
+        return cls(upload.timestamp, upload.polarisation, sweep_frequencies, traces, parameters, upload.config_hash, upload)
+
+    @classmethod
+    def load(cls, upload):
+        # Journal entry → sweep data from its text file or sweep store record
+        if upload.offset < 0:
+            return cls.from_file(upload.path, upload)
+        return cls.from_sweep(vna_store.read(upload_location(upload)), upload)
+
+    @property
+    def number_of_points(self):
+        return self.traces.size
+
+    def records(self, config):
+        if use_packed_schema(config):
+            key = self.config_hash or axis_hash(self.frequencies)
+            queue_axis(config, self.timestamp, key, self.frequencies)
+            return build_packed_points(config, self.timestamp, self.polarisation, key, self.traces, self.parameters)
+
+        # One line protocol body per trace
+        return [build_trace_lines(config, self.timestamp, self.polarisation, self.frequencies, trace.real, trace.imag,
+                                  self.parameters[i] if self.parameters else None)
+                for i, trace in enumerate(self.traces)]
+
+    def queue(self, config):
+        return get_writer(config).write(self.records(config))
+
+    def send(self, config, debug_name):
+        batch = self.queue(config)
+        get_writer(config).flush()
+        return wait_batch(debug_name, batch)
+
+
+def send_data_influxdb(config, debug_name, upload):
+    try:
         debug(debug_name, f"✓ Try to send points.")
 
         # Write data
-        write_api.write(
-            bucket=config['influxdb']['bucket'],
-            org=config['influxdb']['org'],
-            record=points
-        )
+        if not upload.send(config, debug_name):
+            return False
 
-        debug(debug_name, f"✓ VNA sweep written with {number_of_points} points.")
+        debug(debug_name, f"✓ VNA sweep written with {upload.number_of_points} points.")
         return True
 
-    except ApiException as e:
-        debug(debug_name, f"❗ InfluxDB API error: {e}")
-        return False
     except Exception as e:
         debug(debug_name, f"❗ Failed to write to InfluxDB: {e}")
         return False
-    finally:
-        try:
-            client.close()
-        except Exception:
-            pass  # If client is undefined due to earlier failure
-
-        # Clear global buffers
-        frequencies = []
-        reals = []
-        imags = []
 
 def debug(debug_name, string):
     print(f"{debug_name} {string}")
 
 # ***************
-def send_vna_data(config, debug_name):
+# Uploads taken from the journal per round, and per write request of the drain
+UPLOAD_BATCH = 200
+UPLOADS_PER_REQUEST = 8
+SPOOL_BATCH = 5000
 
-    while(len(glob.glob(os.path.join(result_vna_dir, "*.txt"))) > 0):
+legacy_imported = False
+legacy_lock = threading.Lock()
+drain_lock = threading.Lock()
 
-        # Get oldest file
-        file = get_oldest_file(debug_name)
+def open_upload_queue():
+    # Sweeps stored before the journal existed are added once per process,
+    # ahead of anything this process stores
+    global legacy_imported
 
-        if file != "":
-            # Get data
-            retrieve_data_from_file(file)
+    with legacy_lock:
+        if not legacy_imported:
+            import_legacy_uploads()
+            legacy_imported = True
+    return upload_queue
 
-            # Find timestamp in filename
-            timestamp = find_timestamp_in_filename(file)
+def import_legacy_uploads():
+    entries = []
 
-            # Find polarisation in filename
-            polarisation = find_polarisation_in_filename(file)
-            
-            # Send data to influxdb
-            status = send_data_influxdb(config, debug_name, timestamp, polarisation)
+    # Text files, ordered by the timestamp in their name
+    for file in sorted(glob.glob(os.path.join(result_vna_dir, "*.txt")), key=os.path.basename):
+        entries.append((file, find_timestamp_in_filename(file), find_polarisation_in_filename(file), None, None))
 
-            # Check influxdb transmission succeeded
-            if status:
-                # Join right folders
-                filename = os.path.basename(file)
-                dst = os.path.join(result_vna_backup_dir, filename)
-
-                # If target file already exists → add suffix
-                if os.path.exists(dst):
-                    base, ext = os.path.splitext(filename)
-                    counter = 1
-                    while os.path.exists(os.path.join(result_vna_backup_dir, f"{base}_{counter}{ext}")):
-                        counter += 1
-                    dst = os.path.join(result_vna_backup_dir, f"{base}_{counter}{ext}")
-
-                # Move file to backup directory
-                shutil.move(file, dst)
-            else:
-                debug(debug_name, f"Connection error! Data file stays in folder!")
+    # Sweep store records after the upload cursor of their segment
+    for segment in vna_store.segments():
+        for ref, sweep in vna_store.iter_segment(segment, vna_store.uploaded_offset(segment)):
+            entries.append((ref, sweep.timestamp.strftime('%Y-%m-%dT%H:%M:%S.000Z'), sweep.polarisation,
+                            sweep.config_hash, sweep.parameters))
+
+    if entries:
+        upload_queue.enqueue_many(entries)
+
+def enqueue_upload(location, sweep):
+    """Adds a sweep that was just stored to the upload journal."""
+    open_upload_queue().enqueue(location, sweep.timestamp.strftime('%Y-%m-%dT%H:%M:%S.000Z'), sweep.polarisation,
+                                sweep.config_hash, sweep.parameters if len(sweep.traces) > 1 else None)
+
+
+def send_vna_data(config, debug_name):
+    """
+    Drains the upload journal in order. Up to influxdb.drain_workers threads
+    load, serialize and write groups of uploads at the same time, limited to
+    influxdb.max_bytes_per_second and influxdb.max_requests_per_second
+    (0 means no limit) so a catch up does not starve the measurements.
+    """
+    influx = config['influxdb']
+    workers = max(1, int(influx.get('drain_workers', 2)))
+    limits = (RateLimiter(influx.get('max_bytes_per_second', 0)), RateLimiter(influx.get('max_requests_per_second', 0)))
+
+    open_upload_queue()
+    archive_settings(config)
+    if not get_writer(config).available():
+        debug(debug_name, f"InfluxDB unreachable, {upload_queue.pending()} sweeps stay queued!")
+        return False
+
+    with drain_lock, ThreadPoolExecutor(max_workers=workers, thread_name_prefix="influx-drain") as executor:
+        if not send_spooled_records(config, debug_name):
+            return False
+
+        while True:
+            uploads = upload_queue.peek(UPLOAD_BATCH)
+            if not uploads:
                 break
+            if not send_uploads(config, debug_name, uploads, executor, limits):
+                debug(debug_name, f"Connection error! {upload_queue.pending()} sweeps stay queued!")
+                return False
 
+        get_writer(config).flush()
+        archive_segments()
+        enforce_retention(config)
+    return True
 
-def send_configurations(config, debug_name):
-    client = InfluxDBClient(url=config['influxdb']['url'], token=config['influxdb']['token'], org=config['influxdb']['org'])
 
-    write_api = client.write_api(write_options=SYNCHRONOUS)
+def send_uploads(config, debug_name, uploads, executor, limits):
+    groups = [uploads[i:i + UPLOADS_PER_REQUEST] for i in range(0, len(uploads), UPLOADS_PER_REQUEST)]
+    futures = [executor.submit(send_upload_group, config, group, limits) for group in groups]
+
+    # Uploads of successful groups are done, the segment cursors only move up to the first failure
+    done = []
+    contiguous = []
+    status = True
+    for group, future in zip(groups, futures):
+        error, dropped = future.result()
+        if error is not None and status:
+            report_error(debug_name, error)
+        for upload in group:
+            if upload.id in dropped:
+                # Unreadable text files are archived as well, so they are not imported again
+                debug(debug_name, f"⚠️ Dropping {os.path.basename(upload.path)} from the upload queue: {dropped[upload.id]}")
+            elif error is not None:
+                upload_queue.failed(upload.id, error)
+                status = False
+                continue
+            done.append(upload)
+            if status:
+                contiguous.append(upload)
+
+    archive_files([upload.path for upload in done if upload.offset < 0])
+    upload_queue.complete([upload.id for upload in done])
+    update_cursors(contiguous)
+    return status
 
-    # Timestamp
-    ts = datetime.now()
 
-    vna_config = config["configurations"]
+def spool_records(records):
+    # Points that could not be written wait in the upload journal
+    open_upload_queue().enqueue_records([record if isinstance(record, str) else record.to_line_protocol()
+                                         for record in records])
 
-    center = int(vna_config["center"])
-    span = int(vna_config["span"])
-    power = int(vna_config["power"])
-    sweeps = int(vna_config["sweeps"])
-    points = int(vna_config["points"])
-    ifbw = int(vna_config["ifbw"])
-    param = int(vna_config["parameter"][1:])
+
+def send_spooled_records(config, debug_name):
+    while True:
+        records = upload_queue.peek_records(SPOOL_BATCH)
+        if not records:
+            return True
+        try:
+            get_writer(config).write_request([line for _, line in records])
+        except Exception as e:
+            report_error(debug_name, e)
+            if is_connection_error(e) or isinstance(e, CircuitOpenError):
+                return False
+            # Rejected by the server, sending them again will not help
+            debug(debug_name, f"⚠️ Dropping {len(records)} queued records")
+        upload_queue.complete_records([id for id, _ in records])
+
+
+def send_upload_group(config, uploads, limits):
+    """Loads and writes uploads in one request, returns (error, {id: reason} of dropped uploads)."""
+    records = []
+    dropped = {}
+    for upload in uploads:
+        try:
+            records += SweepUpload.load(upload).records(config)
+        except (OSError, ValueError) as e:
+            dropped[upload.id] = e
+    if not records:
+        return None, dropped
+
+    body = [record if isinstance(record, str) else record.to_line_protocol() for record in records]
+    max_bytes, max_requests = limits
+    max_bytes.acquire(sum(map(len, body)))
+    max_requests.acquire(1)
+    try:
+        get_writer(config).write_request(body)
+    except Exception as e:
+        return e, dropped
+    return None, dropped
+
+
+def update_cursors(uploads):
+    # Keep the segment cursors in step with the journal, one write per segment
+    ends = {}
+    for upload in uploads:
+        if upload.offset >= 0:
+            ends[upload.path] = max(ends.get(upload.path, 0), upload.offset + upload.size)
+    for segment, end in ends.items():
+        if os.path.exists(segment) and end > vna_store.uploaded_offset(segment):
+            vna_store.set_uploaded_offset(segment, end)
+
+
+def archive_segments():
+    # Segments of past days without queued sweeps go to the backup directory
+    today = vna_store.segment_path(datetime.now())
+    for segment in vna_store.segments():
+        if segment == today or upload_queue.pending(segment):
+            continue
+        os.makedirs(result_vna_backup_dir, exist_ok=True)
+        vna_store.export_axes(result_vna_backup_dir)
+        shutil.move(segment, os.path.join(result_vna_backup_dir, os.path.basename(segment)))
+        if os.path.exists(segment + CURSOR_SUFFIX):
+            os.remove(segment + CURSOR_SUFFIX)
+
+
+def send_vna_record(config, debug_name, location, sweep):
+    # Sends a sweep that was just stored from memory, when it is next in the upload journal
+    uploads = open_upload_queue().peek(1)
+    if not uploads or upload_location(uploads[0]) != location:
+        return False
+    upload = uploads[0]
+
+    with drain_lock:
+        batch = SweepUpload.from_sweep(sweep, upload).queue(config)
+        get_writer(config).flush()
+        if not wait_batch(debug_name, batch):
+            upload_queue.failed(upload.id, batch.error)
+            return False
+        if upload.offset < 0:
+            archive_files([upload.path])
+        upload_queue.complete([upload.id])
+        update_cursors([upload])
+    return True
+
+
+def send_sweep(config, debug_name, sweep):
+    return SweepUpload.from_sweep(sweep).send(config, debug_name)
+
+
+def send_traces(config, debug_name, timestamp, polarisation, sweep_frequencies, traces, parameters=None):
+    return SweepUpload(timestamp, polarisation, sweep_frequencies, traces, parameters).send(config, debug_name)
+
+
+def archive_files(files):
+    # Uploaded text files go into the compressed daily bundles of the backup directory
+    files = [file for file in files if os.path.exists(file)]
+    if files:
+        vna_archive.add_files(files)
+
+
+def archive_settings(config):
+    # archive: max_age_days / max_bytes limit the backup directory, bundle_bytes the size of one bundle
+    settings = config.get('archive') or {}
+    vna_archive.bundle_bytes = int(settings.get('bundle_bytes', vna_archive.bundle_bytes))
+    return settings
+
+
+def enforce_retention(config):
+    settings = archive_settings(config)
+    if not settings.get('max_age_days') and not settings.get('max_bytes'):
+        return []
+    segments = glob.glob(os.path.join(result_vna_backup_dir, "*" + SEGMENT_SUFFIX))
+    return vna_archive.enforce_retention(settings.get('max_age_days'), settings.get('max_bytes'), segments)
+
+
+def send_configurations(settings, debug_name):
+    # settings: compiled config (get_settings())
+    ts = datetime.now()
+
+    vna = settings.vna
 
     # Create point
     point = (
         Point("radar_configuration")
         .time(ts)
-        .tag("radar", config['fixed_configurations']['radar_name'])
-        .field("center", center)
-        .field("span", span)
-        .field("start", center - span / 2)
-        .field("stop", center + span / 2)
-        .field("power", power)
-        .field("sweeps", sweeps)
-        .field("points", points)
-        .field("ifbw", ifbw)
-        .field("parameter", param)  # This is a string
+        .tag("radar", settings.fixed.radar_name)
+        .field("center", vna.center)
+        .field("span", vna.span)
+        .field("start", vna.start)
+        .field("stop", vna.stop)
+        .field("power", vna.power)
+        .field("sweeps", vna.sweeps)
+        .field("points", vna.points)
+        .field("ifbw", vna.ifbw)
+        .field("parameter", vna.parameter_number)  # This is a string
+        .field("parameters", ",".join(vna.parameters))
     )
 
-    # Write data in batch
-    try:
-        write_api.write(bucket=config['influxdb']['bucket'], org=config['influxdb']['org'], record=point)
-    except Exception as e:
-        print(f"[Warning] Could not write to InfluxDB: {e}")
-        client.close()
-        return False
+    # Write data, or keep it for the next upload round while InfluxDB is unreachable
+    batch = get_writer(settings.raw).write(point, flush=True)
+    if not batch.wait():
+        print(f"[Warning] Could not write to InfluxDB: {batch.error}")
+        try:
+            spool_records([point])
+        except Exception as e:
+            print(f"[Warning] Could not queue the configuration: {e}")
+            return False
+        debug(debug_name, f"Configuration queued.")
+        return True
     
     debug(debug_name, f"✓ Configuration sended.")
 
-    client.close()
-
     return True
 
 
 def send_system_info(config, debug_name, temperature_data, system_data):
-
-    client = InfluxDBClient(url=config['influxdb']['url'], token=config['influxdb']['token'], org=config['influxdb']['org'])
-
-    write_api = client.write_api(write_options=SYNCHRONOUS)
-
     # Timestamp
     ts = datetime.now()
 
@@ -304,11 +751,20 @@ def send_system_info(config, debug_name, temperature_data, system_data):
         .field("system-disk", system_data["system-disk"])
     )
 
-    # Write data in batch
-    write_api.write(bucket=config['influxdb']['bucket'], org=config['influxdb']['org'], record=point)
+    # Write data, or keep it for the next upload round while InfluxDB is unreachable
+    batch = get_writer(config).write(point, flush=True)
+    if not batch.wait():
+        report_error(debug_name, batch.error)
+        try:
+            spool_records([point])
+        except Exception as e:
+            # Disk full or journal locked: this point is lost, the script goes on
+            debug(debug_name, f"⚠️ Could not queue the system data: {e}")
+            return False
+        debug(debug_name, f"System data queued.")
+        return False
     debug(debug_name, f"✓ System data sended.")
-
-    client.close()
+    return True
 
 
 # # For testing
@@ -0,0 +1,186 @@
+import heapq
+import itertools
+import threading
+import time
+from concurrent.futures import Future
+
+# Instrument arbiter
+#
+# There is one LibreVNA and every job that needs it asks the arbiter for it.
+# Requests wait in a priority queue, the lowest number first and in order of
+# arrival within a priority:
+#
+#   calibration (0), manual sweep (1), scheduled sweep (2), temperature (3)
+#
+# The instrument is handed out as a lease with a deadline. The moment a lease
+# ends the next request is granted, nobody polls for a free window. A request
+# with a start deadline that is not granted in time fails with LeaseTimeout
+# instead of running late. Jobs run one at a time on the thread that calls
+# serve(). When a lease expires the job's on_expire(lease) is called to abort
+# it (the measurement worker shuts down its LibreVNA connection), the next
+# request is granted once the aborted job returned. A lease that is held for
+# an external user (calibration in the GUI) ends when it is released or when
+# its deadline passed.
+
+PRIORITIES = {"calibration": 0, "manual": 1, "scheduled": 2, "temperature": 3}
+
+
+class LeaseTimeout(TimeoutError):
+    pass
+
+
+class Lease:
+    ids = itertools.count(1)
+
+    def __init__(self, name, priority, lease_time, start_deadline=None):
+        self.id = next(Lease.ids)
+        self.name = name
+        self.priority = priority
+        self.lease_time = lease_time
+        self.expires = None
+        self.expired = False
+        # Resolved once the lease is granted, future with the result of the job
+        self.granted = Future()
+        self.future = Future()
+        self.released = threading.Event()
+
+    def remaining(self):
+        if self.expires is None:
+            return self.lease_time
+        return max(0.0, self.expires - time.monotonic())
+
+    def release(self):
+        self.released.set()
+
+    def hold(self):
+        """Blocks until the lease is released, returns False when it expired first."""
+        return self.released.wait(timeout=self.remaining())
+
+    def fail(self, error):
+        for future in (self.granted, self.future):
+            if not future.done():
+                future.set_exception(error)
+
+    def info(self):
+        return {"lease": self.id, "job": self.name, "priority": self.priority,
+                "expires_in": round(self.remaining(), 1)}
+
+
+class InstrumentArbiter:
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.queue = []
+        self.counter = itertools.count()
+        self.lease = None
+        self.listeners = []
+
+    def add_listener(self, listener):
+        # listener() is called from the serving thread when a lease starts or ends
+        self.listeners.append(listener)
+
+    def notify(self):
+        for listener in self.listeners:
+            try:
+                listener()
+            except Exception as e:
+                print(f"[Arbiter] ⚠️ Listener failed: {e}")
+
+    # *** Requests *** #
+    def submit(self, name, action, priority="scheduled", lease_time=60, start_deadline=None, on_expire=None):
+        """Queues action(lease) for the instrument, returns the Lease (lease.future has the result)."""
+        lease = Lease(name, PRIORITIES.get(priority, priority), lease_time, start_deadline)
+        with self.condition:
+            heapq.heappush(self.queue, (lease.priority, next(self.counter), lease, action, on_expire))
+            self.condition.notify()
+
+        if start_deadline is not None:
+            timer = threading.Timer(start_deadline, self.expire, args=(lease,))
+            timer.daemon = True
+            timer.start()
+            lease.granted.add_done_callback(lambda _: timer.cancel())
+        return lease
+
+    def expire(self, lease):
+        # Start deadline passed while the request was still waiting
+        with self.condition:
+            entries = [entry for entry in self.queue if entry[2] is not lease]
+            if len(entries) == len(self.queue):
+                return
+            self.queue = entries
+            heapq.heapify(self.queue)
+        lease.fail(LeaseTimeout(f"{lease.name} was not started within its deadline"))
+        print(f"[Arbiter] ⚠️ {lease.name} dropped, the instrument was not free before its deadline")
+        self.notify()
+
+    def expire_lease(self, lease, on_expire):
+        # Deadline of a running lease passed, the job has to give the instrument back
+        with self.condition:
+            if self.lease is not lease or lease.future.done():
+                return
+            lease.expired = True
+        print(f"[Arbiter] ⚠️ Lease of {lease.name} expired after {lease.lease_time:.0f} s, aborting it")
+        try:
+            on_expire(lease)
+        except Exception as e:
+            print(f"[Arbiter] ⚠️ Could not abort {lease.name}: {e}")
+
+    def release(self, lease_id):
+        """Ends the running lease or cancels a waiting request, returns False for an unknown id."""
+        with self.condition:
+            if self.lease is not None and self.lease.id == lease_id:
+                self.lease.release()
+                return True
+            for entry in self.queue:
+                if entry[2].id == lease_id:
+                    self.queue.remove(entry)
+                    heapq.heapify(self.queue)
+                    break
+            else:
+                return False
+        entry[2].granted.cancel()
+        entry[2].future.cancel()
+        self.notify()
+        return True
+
+    def pending(self):
+        with self.condition:
+            return [entry[2].name for entry in sorted(self.queue)]
+
+    # *** Serving *** #
+    def take(self):
+        with self.condition:
+            while not self.queue:
+                self.condition.wait()
+            _, _, lease, action, on_expire = heapq.heappop(self.queue)
+
+            # Granted under the lock, status readers never see a free instrument in between
+            lease.expires = time.monotonic() + lease.lease_time
+            self.lease = lease
+        return lease, action, on_expire
+
+    def serve(self):
+        while True:
+            lease, action, on_expire = self.take()
+            if not lease.future.set_running_or_notify_cancel():
+                # Cancelled by the requester while it was waiting
+                lease.granted.cancel()
+            else:
+                lease.granted.set_result(lease)
+                self.notify()
+
+                timer = None
+                if on_expire is not None:
+                    timer = threading.Timer(lease.lease_time, self.expire_lease, args=(lease, on_expire))
+                    timer.daemon = True
+                    timer.start()
+                try:
+                    lease.future.set_result(action(lease))
+                except Exception as e:
+                    lease.future.set_exception(e)
+                finally:
+                    if timer is not None:
+                        timer.cancel()
+
+            with self.condition:
+                self.lease = None
+            self.notify()
@@ -0,0 +1,87 @@
+from datetime import datetime, timezone
+
+import numpy as np
+
+# Line protocol for whole sweeps, without building a Point per frequency bin.
+# The measurement and tag set are escaped once per trace; the per bin values
+# are formatted in a single pass over the arrays. The output matches what
+# influxdb_client's Point produces for the same data.
+
+_ESCAPE_MEASUREMENT = str.maketrans({',': r'\,', ' ': r'\ ', '\n': r'\n', '\t': r'\t', '\r': r'\r'})
+_ESCAPE_KEY = str.maketrans({',': r'\,', '=': r'\=', ' ': r'\ ', '\n': r'\n', '\t': r'\t', '\r': r'\r'})
+
+
+def escape_measurement(value):
+    return str(value).translate(_ESCAPE_MEASUREMENT)
+
+
+def escape_key(value):
+    return str(value).translate(_ESCAPE_KEY)
+
+
+def timestamp_ns(ts):
+    # Accepts datetimes (naive means UTC) and ISO 8601 strings such as 2025-01-01T10:00:00.000Z
+    if ts is None:
+        return None
+    if isinstance(ts, str):
+        ts = datetime.fromisoformat(ts.replace("Z", "+00:00"))
+    if ts.tzinfo is None:
+        ts = ts.replace(tzinfo=timezone.utc)
+    delta = ts - datetime(1970, 1, 1, tzinfo=timezone.utc)
+    return (delta.days * 86400 + delta.seconds) * 10**9 + delta.microseconds * 1000
+
+
+def format_floats(values):
+    # Same text as Point: str(float) without a trailing ".0"
+    text = map(str, np.asarray(values, dtype=np.float64).tolist())
+    return [value[:-2] if value.endswith(".0") else value for value in text]
+
+
+def trace_lines(measurement, tags, frequencies, reals, imags, ts=None):
+    """
+    Returns the line protocol body of one trace: one line per frequency bin,
+    tagged with the bin frequency next to the constant tags.
+    """
+    frequencies = np.asarray(frequencies, dtype=np.float64)
+    reals = np.asarray(reals, dtype=np.float64)
+    imags = np.asarray(imags, dtype=np.float64)
+
+    # Line protocol has no NaN or inf: like Point, a non-finite field is left out,
+    # and a bin without any finite field has no line
+    finite_reals = np.isfinite(reals)
+    finite_imags = np.isfinite(imags)
+    keep = finite_reals | finite_imags
+    if not keep.all():
+        frequencies, reals, imags = frequencies[keep], reals[keep], imags[keep]
+        finite_reals, finite_imags = finite_reals[keep], finite_imags[keep]
+
+    # Tags sorted by key like Point does, "frequency" is the one that varies per line
+    before = escape_measurement(measurement)
+    after = ""
+    for key in sorted(tags):
+        tag = f",{escape_key(key)}={escape_key(tags[key])}"
+        if key < "frequency":
+            before += tag
+        else:
+            after += tag
+    before += ",frequency="
+
+    ns = timestamp_ns(ts)
+    suffix = "" if ns is None else f" {ns}"
+    head = _escape_format(before) + "{}" + _escape_format(after)
+    frequency_tags = map(escape_key, frequencies.tolist())
+
+    if finite_reals.all() and finite_imags.all():
+        line_format = head + " imag={},real={}" + suffix
+        return "\n".join(map(line_format.format, frequency_tags, format_floats(imags), format_floats(reals)))
+
+    fields = []
+    for imag, real, has_imag, has_real in zip(format_floats(imags), format_floats(reals),
+                                              finite_imags.tolist(), finite_reals.tolist()):
+        fields.append(f"imag={imag},real={real}" if has_imag and has_real else
+                      f"imag={imag}" if has_imag else f"real={real}")
+    return "\n".join(map((head + " {}" + suffix).format, frequency_tags, fields))
+
+
+def _escape_format(text):
+    return text.replace("{", "{{").replace("}", "}}")
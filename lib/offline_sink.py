@@ -0,0 +1,189 @@
+import argparse
+import glob
+import gzip
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from datetime import datetime
+
+# Offline line protocol sink
+#
+# For deployments without a reachable InfluxDB (influxdb.mode: offline) the
+# writer hands its requests to a LineProtocolSink instead of the network. The
+# sink appends them to a gzip compressed segment (<time>_<pid>.lp.gz.part)
+# and renames it to .lp.gz once it is rotated, by size or age. Finished
+# segments are collected by swapping storage and replayed with:
+#
+#   python3 -m lib.offline_sink <directory> [--workers 4] [--batch-lines 50000]
+
+SEGMENT_SUFFIX = ".lp.gz"
+PART_SUFFIX = ".part"
+IMPORTED_DIRECTORY = "imported"
+
+
+class LineProtocolSink:
+    def __init__(self, directory, max_bytes=64 * 1024 * 1024, max_age=3600):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        self.fp = None
+        self.path = None
+        self.written = 0
+        self.opened = 0
+        finish_stale_segments(directory)
+
+    def write(self, records):
+        data = "\n".join(record if isinstance(record, str) else record.to_line_protocol() for record in records)
+        if not data:
+            return
+        data = (data + "\n").encode()
+
+        with self.lock:
+            if self.fp is not None and (self.written >= self.max_bytes or time.monotonic() - self.opened >= self.max_age):
+                self.finish()
+            if self.fp is None:
+                self.open()
+            self.fp.write(data)
+            # Every request ends on a flush point, a crash loses at most the request being written
+            self.fp.flush()
+            self.written += len(data)
+
+    def open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        name = datetime.now().strftime("%Y-%m-%d_%H-%M-%S") + f"_{os.getpid()}{SEGMENT_SUFFIX}"
+        self.path = os.path.join(self.directory, name)
+        self.fp = gzip.open(self.path + PART_SUFFIX, "ab")
+        self.written = 0
+        self.opened = time.monotonic()
+
+    def finish(self):
+        self.fp.close()
+        os.replace(self.path + PART_SUFFIX, self.path)
+        self.fp = None
+        self.path = None
+
+    def rotate(self):
+        with self.lock:
+            if self.fp is not None:
+                self.finish()
+
+    def close(self):
+        self.rotate()
+
+
+def finish_stale_segments(directory):
+    # Segments left open by a process that is gone, their last request may be cut off
+    for part in glob.glob(os.path.join(directory, "*" + SEGMENT_SUFFIX + PART_SUFFIX)):
+        pid = part[:-len(SEGMENT_SUFFIX + PART_SUFFIX)].rsplit("_", 1)[-1]
+        if pid.isdigit() and not pid_alive(int(pid)):
+            os.replace(part, part[:-len(PART_SUFFIX)])
+
+
+def pid_alive(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+# *** Bulk import *** #
+def read_segment_batches(path, batch_lines):
+    lines = []
+    with gzip.open(path, "rt") as fp:
+        try:
+            for line in fp:
+                if line.strip():
+                    lines.append(line.rstrip("\n"))
+                if len(lines) >= batch_lines:
+                    yield lines
+                    lines = []
+        except (EOFError, gzip.BadGzipFile):
+            # Truncated segment: everything before the damaged end is imported
+            print(f"[Import] ⚠️ {os.path.basename(path)} is truncated")
+    if lines:
+        yield lines
+
+
+def import_segments(directory, url, token, org, bucket, workers=4, batch_lines=50000):
+    """Replays finished segments of directory, returns (imported segments, failed segments)."""
+    from influxdb_client import InfluxDBClient, WritePrecision
+    from influxdb_client.client.write_api import SYNCHRONOUS
+
+    segments = sorted(glob.glob(os.path.join(directory, "*" + SEGMENT_SUFFIX)))
+    if not segments:
+        return 0, 0
+
+    imported_directory = os.path.join(directory, IMPORTED_DIRECTORY)
+    os.makedirs(imported_directory, exist_ok=True)
+
+    client = InfluxDBClient(url=url, token=token, org=org, enable_gzip=True, timeout=60_000)
+    write_api = client.write_api(write_options=SYNCHRONOUS)
+
+    def write(lines):
+        write_api.write(bucket=bucket, org=org, record=lines, write_precision=WritePrecision.NS)
+        return len(lines)
+
+    imported = failed = 0
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for segment in segments:
+                # Batches of one segment go out concurrently, a bounded number in flight
+                pending = set()
+                errors = []
+                points = 0
+                for lines in read_segment_batches(segment, batch_lines):
+                    pending.add(executor.submit(write, lines))
+                    if len(pending) >= 2 * workers:
+                        finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        points += collect(finished, errors)
+                points += collect(wait(pending)[0], errors)
+
+                if errors:
+                    failed += 1
+                    print(f"[Import] ❗ {os.path.basename(segment)} failed: {errors[0]}")
+                    continue
+                shutil.move(segment, os.path.join(imported_directory, os.path.basename(segment)))
+                imported += 1
+                print(f"[Import] ✓ {os.path.basename(segment)}: {points} points")
+    finally:
+        client.close()
+
+    return imported, failed
+
+
+def collect(futures, errors):
+    points = 0
+    for future in futures:
+        try:
+            points += future.result()
+        except Exception as e:
+            errors.append(e)
+    return points
+
+
+if __name__ == "__main__":
+    from lib.configuration import retrieve_yaml_file
+
+    influx = retrieve_yaml_file().get("influxdb") or {}
+
+    parser = argparse.ArgumentParser(description="Import offline line protocol segments into InfluxDB")
+    parser.add_argument("directory", nargs="?", default=influx.get("offline_dir") or os.path.join(os.getcwd(), "results/influx_offline"))
+    parser.add_argument("--url", default=influx.get("url"))
+    parser.add_argument("--token", default=influx.get("token"))
+    parser.add_argument("--org", default=influx.get("org"))
+    parser.add_argument("--bucket", default=influx.get("bucket"))
+    parser.add_argument("--workers", type=int, default=4, help="concurrent write requests")
+    parser.add_argument("--batch-lines", type=int, default=50000, help="points per write request")
+    args = parser.parse_args()
+
+    imported, failed = import_segments(args.directory, args.url, args.token, args.org, args.bucket,
+                                       args.workers, args.batch_lines)
+    print(f"[Import] {imported} segments imported, {failed} failed")
@@ -1,28 +1,67 @@
 # lib/scheduler.py
 
-import subprocess
+import asyncio
+import sys
 from datetime import datetime, timedelta, timezone
-import threading
-from filelock import FileLock
 
 class Scheduler:
+    """
+    Runs a job at start_utc + n * interval as a task on the controller's event
+    loop. The target is a coroutine function, a blocking callable (run in a
+    thread) or a script path (run as a subprocess). start(), stop() and
+    update_parameters() must be called from the loop.
+    """
+
     def __init__(self, name, target_script, start_utc, interval, countdown_vars, update_countdown_status):
         self.name = name
         self.target_script = target_script
-        self.activity = 0
+        self.listeners = []
+        self._activity = 0
         self.start_utc = start_utc
         self.interval = interval
         self.scheduler_enabled = False
-        self.scheduler_timer = None
-        self.countdown_updater = None
-        self.countdown_remaining = 0  # In seconden
+        self.task = None
+        self.next_run = None
+        self.changed = None
         self.countdown_vars = countdown_vars
         self.update_countdown = update_countdown_status
-    
+
+    def add_listener(self, listener):
+        # listener() is called when the activity or the next run changed
+        self.listeners.append(listener)
+
+    def notify(self):
+        for listener in self.listeners:
+            listener()
+
+    @property
+    def activity(self):
+        return self._activity
+
+    @activity.setter
+    def activity(self, value):
+        if value != self._activity:
+            self._activity = value
+            self.notify()
+
     def update_parameters(self, start_utc, interval):
         self.start_utc = start_utc
         self.interval = interval
 
+        # Plan the next run again with the new timing
+        if self.changed is not None:
+            self.changed.set()
+
+    @property
+    def countdown_remaining(self):
+        # In seconden
+        if not self.scheduler_enabled or self.next_run is None:
+            return 0
+        return max(0, int((self.next_run - datetime.now(timezone.utc)).total_seconds()))
+
+    def target_name(self):
+        return getattr(self.target_script, "__qualname__", self.target_script)
+
     def calculate_next_run(self, now):
         if now < self.start_utc:
             return self.start_utc
@@ -30,68 +69,66 @@ class Scheduler:
         intervals_passed = int(elapsed.total_seconds() // self.interval.total_seconds())
         return self.start_utc + (intervals_passed + 1) * self.interval
 
-    def execute_script(self):
-        if not self.scheduler_enabled:
-            print(f"[{self.name}] ⚠️ Scheduler is disabled. Skipping execution.")
-            return
-
+    async def execute_script(self):
         try:
             self.activity = 1
-            print(f"[{self.name}] ⏳ Executing {self.target_script} at {datetime.now(timezone.utc).isoformat()}")
-            subprocess.run(["python", self.target_script])
-            self.activity = 0
+            print(f"[{self.name}] ⏳ Executing {self.target_name()} at {datetime.now(timezone.utc).isoformat()}")
+            if asyncio.iscoroutinefunction(self.target_script):
+                await self.target_script()
+            elif callable(self.target_script):
+                # In-process blocking job, e.g. a resident measurement worker
+                await asyncio.to_thread(self.target_script)
+            else:
+                process = await asyncio.create_subprocess_exec(sys.executable, self.target_script)
+                returncode = await process.wait()
+                if returncode != 0:
+                    print(f"[{self.name}] ⚠️ {self.target_script} exited with code {returncode}")
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
-            print(f"[{self.name}] ⚠️ Error while running {self.target_script}: {e}")
-
-        # Plan next run
-        self.schedule_next_run()
+            print(f"[{self.name}] ⚠️ Error while running {self.target_name()}: {e}")
+        finally:
+            self.activity = 0
 
-    def schedule_next_run(self):
-        now = datetime.now(timezone.utc)
-        next_run = self.calculate_next_run(now)
-        wait_time = (next_run - now).total_seconds()
+    async def run(self):
+        while self.scheduler_enabled:
+            now = datetime.now(timezone.utc)
+            self.next_run = self.calculate_next_run(now)
+            wait_time = (self.next_run - now).total_seconds()
+            self.notify()
 
-        print(f"[{self.name}] [{now.isoformat()}] Next execution at {next_run.isoformat()} UTC (in {int(wait_time)} seconds)")
+            print(f"[{self.name}] [{now.isoformat()}] Next execution at {self.next_run.isoformat()} UTC (in {int(wait_time)} seconds)")
 
-        # Stel de countdown-timer in
-        self.countdown_remaining = int(wait_time)
-        self.start_countdown_updates()
+            # Sleep until the next run, or until the timing changed
+            self.changed.clear()
+            try:
+                await asyncio.wait_for(self.changed.wait(), timeout=wait_time)
+                continue
+            except asyncio.TimeoutError:
+                pass
 
-        # Plan daadwerkelijke scriptuitvoering
-        self.scheduler_timer = threading.Timer(wait_time, self.execute_script)
-        self.scheduler_timer.start()
+            await self.execute_script()
 
     def start(self):
         if not self.scheduler_enabled:
             print(f"[{self.name}] ✅ Scheduler started.")
             self.scheduler_enabled = True
-            self.schedule_next_run()
+            self.changed = asyncio.Event()
+            self.task = asyncio.get_running_loop().create_task(self.run())
+            self.notify()
 
     def stop(self):
         if self.scheduler_enabled:
             self.scheduler_enabled = False
-            if self.scheduler_timer is not None:
-                self.scheduler_timer.cancel()
-            if self.countdown_updater is not None:
-                self.countdown_updater.cancel()
-            
+            if self.task is not None:
+                # A running job is cancelled with it, a subprocess keeps running to its end
+                self.task.cancel()
+                self.task = None
+            self.next_run = None
+            self.notify()
+
             # Print status
             print(f"[{self.name}] ⛔ Scheduler stopped.")
-            
-            # Update counter
-            self.countdown_remaining = 0
 
     def is_running(self):
         return self.scheduler_enabled
-    
-    def start_countdown_updates(self):
-        if self.countdown_updater:
-            self.countdown_updater.cancel()
-
-        if self.countdown_remaining <= 0:
-            return
-  
-        self.countdown_remaining -= 1
-
-        self.countdown_updater = threading.Timer(1.0, self.start_countdown_updates)
-        self.countdown_updater.start()
\ No newline at end of file
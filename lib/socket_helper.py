@@ -1,9 +1,84 @@
 import socket
 import json
+import threading
+import time
+from contextlib import contextmanager
 
 SOCKET_PATH = "/tmp/streaming_socket.sock"
+WORKER_SOCKET_PATH = "/tmp/measurement_worker.sock"
+CONFIG_BUS_PATH = "/tmp/config_bus.sock"
+
+class StatusSubscriber:
+    """
+    One long-lived subscription to the controller status socket. A background
+    thread keeps the latest status, so reading it costs no connection. While
+    the controller is not reachable the state is empty and the thread retries.
+    """
+
+    def __init__(self, path=SOCKET_PATH, retry_interval=5):
+        self.path = path
+        self.retry_interval = retry_interval
+        self.state = {}
+        self.connected = False
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def start(self):
+        with self.condition:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+        return self
+
+    def get(self, timeout=1.0):
+        # Latest status, the first call waits up to timeout for the subscription
+        first = self.thread is None
+        self.start()
+        with self.condition:
+            if first:
+                self.condition.wait_for(lambda: self.connected, timeout)
+            return dict(self.state)
+
+    def wait(self, timeout=None):
+        # Blocks until the next status update, returns the new state
+        self.start()
+        with self.condition:
+            self.condition.wait(timeout)
+            return dict(self.state)
+
+    def run(self):
+        while True:
+            try:
+                with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+                    client.connect(self.path)
+                    client.sendall(b'{"op": "subscribe"}\n')
+                    with client.makefile('rb') as stream:
+                        for line in stream:
+                            state = json.loads(line)
+                            with self.condition:
+                                self.state = state
+                                self.connected = True
+                                self.condition.notify_all()
+            except (OSError, ValueError):
+                pass
+
+            with self.condition:
+                self.state = {}
+                self.connected = False
+                self.condition.notify_all()
+            time.sleep(self.retry_interval)
+
+# Shared by every caller in this process
+status_subscriber = StatusSubscriber()
 
 def get_local_socket_info():
+    # Cached status of the subscription, a single request when it is not connected
+    state = status_subscriber.get()
+    if status_subscriber.connected:
+        return state
+    return request_socket_info()
+
+def request_socket_info():
     countdown_dict = {}
 
     try:
@@ -31,16 +106,55 @@ def get_local_socket_info():
 
     return countdown_dict
 
-def check_measurement_active():
-    countdown_dict = get_local_socket_info()
+def check_measurement_active(countdown_dict=None):
+    if countdown_dict is None:
+        countdown_dict = get_local_socket_info()
 
     return countdown_dict.get("vna_activity", 0)
 
-def check_next_measurement():
-    countdown_dict = get_local_socket_info()
+def check_next_measurement(countdown_dict=None):
+    if countdown_dict is None:
+        countdown_dict = get_local_socket_info()
 
     hour = countdown_dict.get("vna_countdown_hour", 0)
     min = countdown_dict.get("vna_countdown_minute", 0) 
     sec = countdown_dict.get("vna_countdown_second", 0)
 
-    return hour*3600 + min*60 + sec
\ No newline at end of file
+    return hour*3600 + min*60 + sec
+
+def request_worker_job(job, timeout=None, **kwargs):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(WORKER_SOCKET_PATH)
+        client.sendall((json.dumps({"job": job, **kwargs}) + "\n").encode())
+
+        with client.makefile('rb') as stream:
+            response = json.loads(stream.readline() or b"{}")
+
+    if response.get("status") != "ok":
+        raise Exception(f"Worker job '{job}' failed: {response.get('message', 'no response')}")
+    return response["result"]
+
+@contextmanager
+def instrument_lease(duration=900, timeout=None):
+    """
+    Holds the LibreVNA for calibration: waits until the controller's arbiter
+    grants the lease, yields its info and releases it on exit. The lease also
+    ends when the duration (s) passed or the connection closes.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(WORKER_SOCKET_PATH)
+        with client.makefile('rwb') as stream:
+            stream.write((json.dumps({"job": "calibration", "lease_time": duration}) + "\n").encode())
+            stream.flush()
+            response = json.loads(stream.readline() or b"{}")
+            if response.get("status") != "ok":
+                raise Exception(f"Calibration lease failed: {response.get('message', 'no response')}")
+
+            try:
+                yield response["result"]
+            finally:
+                stream.write((json.dumps({"job": "release", "lease": response["result"]["lease"]}) + "\n").encode())
+                stream.flush()
+                stream.readline()
@@ -0,0 +1,62 @@
+import base64
+import hashlib
+
+import numpy as np
+
+# Packed sweep schema
+#
+# Instead of one series per frequency bin, a trace is sent as one point with
+# its complex samples packed in base64 string fields (data_0, data_1, ...) of
+# CHUNK_BINS bins each. The series is identified by radar, polarisation,
+# parameter and the hash of the configuration, so the number of series does
+# not grow with the number of points. The frequency axis of a configuration is
+# sent once, packed the same way in axis_<i> fields of a radar_configuration
+# point tagged with that hash.
+#
+# Samples are packed as complex128, the precision the sweep store keeps.
+
+CHUNK_BINS = 1024
+
+TRACE_DTYPE = np.dtype("<c16")
+AXIS_DTYPE = np.dtype("<f8")
+
+
+def axis_hash(frequencies):
+    # Key for sweeps without a config hash, e.g. read back from text files
+    return hashlib.sha1(np.asarray(frequencies, dtype=AXIS_DTYPE).tobytes()).hexdigest()[:16]
+
+
+def pack_fields(prefix, values, dtype):
+    values = np.ascontiguousarray(values, dtype=dtype)
+    fields = {"bins": len(values)}
+    for i, start in enumerate(range(0, len(values), CHUNK_BINS)):
+        fields[f"{prefix}_{i}"] = base64.b64encode(values[start:start + CHUNK_BINS].tobytes()).decode()
+    return fields
+
+
+def unpack_fields(prefix, fields, dtype):
+    chunks = []
+    i = 0
+    while f"{prefix}_{i}" in fields:
+        chunks.append(base64.b64decode(fields[f"{prefix}_{i}"]))
+        i += 1
+    values = np.frombuffer(b"".join(chunks), dtype=dtype)
+    if "bins" in fields and len(values) != int(fields["bins"]):
+        raise ValueError(f"Expected {fields['bins']} bins but unpacked {len(values)}")
+    return values
+
+
+def pack_trace(trace):
+    return pack_fields("data", trace, TRACE_DTYPE)
+
+
+def unpack_trace(fields):
+    return unpack_fields("data", fields, TRACE_DTYPE)
+
+
+def pack_axis(frequencies):
+    return pack_fields("axis", frequencies, AXIS_DTYPE)
+
+
+def unpack_axis(fields):
+    return unpack_fields("axis", fields, AXIS_DTYPE)
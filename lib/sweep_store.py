@@ -0,0 +1,253 @@
+import os
+import shutil
+import struct
+import threading
+from collections import namedtuple
+from datetime import datetime, timezone
+
+import numpy as np
+from filelock import FileLock
+
+from lib.configuration import config_hash
+
+# Append-only binary sweep store
+#
+# Sweeps are appended to one segment file per UTC day (<YYYY-MM-DD>.swp), naive
+# timestamps are taken as UTC. Every record is a fixed 64 byte header, the radar
+# name (its length is in the header, padded to 8 bytes) and the complex samples
+# of all its traces, so the samples can be mapped with numpy.memmap.
+# The frequency axis is not repeated per sweep: it is stored once per
+# configuration as axes/<config_hash>.npy. A record cut off by a crash is
+# removed before the next record is appended to its segment.
+
+RECORD_MAGIC = b"SWP1"
+
+# magic, timestamp (UTC epoch s), polarisation, radar name length, config hash, sample size, traces, points, parameters
+RECORD_HEADER = struct.Struct("<4sd2sH16sBBI12s14x")
+
+SAMPLE_DTYPES = {8: np.dtype("<c8"), 16: np.dtype("<c16")}
+
+MAX_TRACES = 4
+
+SEGMENT_SUFFIX = ".swp"
+CURSOR_SUFFIX = ".uploaded"
+
+Sweep = namedtuple("Sweep", ["timestamp", "polarisation", "radar", "config_hash", "parameters", "frequencies", "traces"])
+SweepRef = namedtuple("SweepRef", ["segment", "offset", "size"])
+
+
+def axes_directory(directory):
+    return os.path.join(directory, "axes")
+
+
+def padded(size):
+    # Keeps the samples after the radar name 8 byte aligned
+    return (size + 7) // 8 * 8
+
+
+def utc(timestamp):
+    return timestamp.replace(tzinfo=timestamp.tzinfo or timezone.utc).astimezone(timezone.utc)
+
+
+class SweepStore:
+    def __init__(self, directory, dtype=np.complex128):
+        self.directory = directory
+        self.axes_directory = axes_directory(directory)
+        self.dtype = np.dtype(dtype).newbyteorder("<")
+        self.lock = threading.Lock()
+        self.axes = {}
+        # Segment -> end of its last complete record, as last seen by this process
+        self.ends = {}
+
+    # *** Writing *** #
+    def append(self, sweep):
+        traces = np.asarray(sweep.traces, dtype=self.dtype).reshape(-1, len(sweep.frequencies))
+        parameters = list(sweep.parameters or [])
+        if len(traces) > MAX_TRACES:
+            raise ValueError(f"A sweep record holds at most {MAX_TRACES} traces")
+        radar = sweep.radar.encode()
+        if len(radar) > 0xFFFF:
+            raise ValueError(f"Radar name '{sweep.radar[:32]}...' is too long for a sweep record")
+
+        self.store_axis(sweep.config_hash, sweep.frequencies)
+
+        header = RECORD_HEADER.pack(
+            RECORD_MAGIC,
+            utc(sweep.timestamp).timestamp(),
+            sweep.polarisation.encode(),
+            len(radar),
+            sweep.config_hash.encode(),
+            self.dtype.itemsize,
+            len(traces),
+            traces.shape[1],
+            "".join(f"{parameter:<3}"[:3] for parameter in parameters).encode(),
+        ) + radar.ljust(padded(len(radar)), b"\0")
+        size = len(header) + traces.nbytes
+
+        segment = self.segment_path(sweep.timestamp)
+        os.makedirs(self.directory, exist_ok=True)
+        with self.lock, FileLock(os.path.join(self.directory, ".sweep_store.lock")):
+            with open(segment, "ab") as fp:
+                offset = self.complete_end(segment, fp)
+                fp.write(header + traces.tobytes())
+            self.ends[segment] = offset + size
+        return SweepRef(segment, offset, size)
+
+    def complete_end(self, segment, fp):
+        # Called with the store locked: cuts off a torn record at the end of the segment,
+        # records written after it would be read as part of it
+        size = fp.seek(0, os.SEEK_END)
+        end = self.ends.get(segment, 0)
+        if end > size:
+            end = 0
+        if end == size:
+            return end
+
+        with open(segment, "rb") as reader:
+            while end + RECORD_HEADER.size <= size:
+                header = self.read_header(reader, end)
+                if header is None or end + header["record_size"] > size:
+                    break
+                end += header["record_size"]
+
+        if end < size:
+            print(f"[Sweep store] ⚠️ Removing {size - end} bytes of a torn record from {os.path.basename(segment)}")
+            fp.truncate(end)
+        return end
+
+    def store_axis(self, config_hash, frequencies):
+        if config_hash in self.axes:
+            return
+        path = os.path.join(self.axes_directory, f"{config_hash}.npy")
+        if not os.path.exists(path):
+            os.makedirs(self.axes_directory, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            np.save(tmp_path, np.asarray(frequencies, dtype="<f8"))
+            os.replace(tmp_path + ".npy", path)
+        self.axes[config_hash] = np.load(path, mmap_mode="r")
+
+    def export_axes(self, directory):
+        # Segments moved to another directory need their frequency axes next to them
+        if not os.path.isdir(self.axes_directory):
+            return
+        os.makedirs(axes_directory(directory), exist_ok=True)
+        for name in os.listdir(self.axes_directory):
+            target = os.path.join(axes_directory(directory), name)
+            if name.endswith(".npy") and not os.path.exists(target):
+                shutil.copyfile(os.path.join(self.axes_directory, name), target)
+
+    def segment_path(self, timestamp):
+        return os.path.join(self.directory, utc(timestamp).strftime("%Y-%m-%d") + SEGMENT_SUFFIX)
+
+    # *** Reading *** #
+    def axis(self, config_hash):
+        if config_hash not in self.axes:
+            self.axes[config_hash] = np.load(os.path.join(self.axes_directory, f"{config_hash}.npy"), mmap_mode="r")
+        return self.axes[config_hash]
+
+    def read(self, ref):
+        with open(ref.segment, "rb") as fp:
+            header = self.read_header(fp, ref.offset)
+        if header is None:
+            raise ValueError(f"No sweep record at {ref.segment}:{ref.offset}")
+        return self.map_record(ref.segment, ref.offset, header)
+
+    def iter_segment(self, segment, offset=0):
+        """Yields (SweepRef, Sweep) for every complete record from offset on."""
+        size = os.path.getsize(segment)
+        with open(segment, "rb") as fp:
+            while offset + RECORD_HEADER.size <= size:
+                header = self.read_header(fp, offset)
+                if header is None:
+                    # Torn or corrupt record: resynchronise on the next magic
+                    offset = self.find_next_record(fp, offset + 1)
+                    if offset is None:
+                        return
+                    continue
+
+                record_size = header["record_size"]
+                if offset + record_size > size:
+                    return
+                if offset + record_size + len(RECORD_MAGIC) <= size:
+                    fp.seek(offset + record_size)
+                    if fp.read(len(RECORD_MAGIC)) != RECORD_MAGIC:
+                        # Torn record followed by newer ones (written before torn ends were removed)
+                        offset = self.find_next_record(fp, offset + RECORD_HEADER.size)
+                        if offset is None:
+                            return
+                        continue
+                yield SweepRef(segment, offset, record_size), self.map_record(segment, offset, header)
+                offset += record_size
+
+    def segments(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return sorted(os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                      if name.endswith(SEGMENT_SUFFIX))
+
+    def map_record(self, segment, offset, header):
+        if header["traces"] * header["points"] == 0:
+            traces = np.empty((header["traces"], header["points"]), dtype=header["dtype"])
+        else:
+            traces = np.memmap(segment, dtype=header["dtype"], mode="r", offset=offset + header["data_offset"],
+                               shape=(header["traces"], header["points"]))
+        return Sweep(header["timestamp"], header["polarisation"], header["radar"], header["config_hash"],
+                     header["parameters"], self.axis(header["config_hash"]), traces)
+
+    def read_header(self, fp, offset):
+        # Header and radar name of the record at offset, None when there is no complete one
+        fp.seek(offset)
+        header = self.unpack_header(fp.read(RECORD_HEADER.size))
+        if header is None:
+            return None
+        radar_size = header.pop("radar_size")
+        radar = fp.read(radar_size)
+        if len(radar) < radar_size:
+            return None
+        try:
+            header["radar"] = radar.decode()
+        except UnicodeDecodeError:
+            return None
+        return header
+
+    @staticmethod
+    def unpack_header(data):
+        if len(data) < RECORD_HEADER.size:
+            return None
+        magic, timestamp, polarisation, radar_size, config_hash, itemsize, traces, points, parameters = RECORD_HEADER.unpack(data)
+        if magic != RECORD_MAGIC or itemsize not in SAMPLE_DTYPES or traces > MAX_TRACES:
+            return None
+        parameters = parameters.decode().rstrip("\0")
+        return {
+            "timestamp": datetime.fromtimestamp(timestamp, timezone.utc),
+            "polarisation": polarisation.decode().rstrip("\0"),
+            "config_hash": config_hash.decode().rstrip("\0"),
+            "dtype": SAMPLE_DTYPES[itemsize],
+            "traces": traces,
+            "points": points,
+            "parameters": [parameters[i:i + 3].strip() for i in range(0, len(parameters), 3)] or None,
+            "radar_size": radar_size,
+            "data_offset": RECORD_HEADER.size + padded(radar_size),
+            "record_size": RECORD_HEADER.size + padded(radar_size) + traces * points * itemsize,
+        }
+
+    @staticmethod
+    def find_next_record(fp, offset):
+        fp.seek(offset)
+        data = fp.read()
+        index = data.find(RECORD_MAGIC)
+        return None if index == -1 else offset + index
+
+    # *** Upload cursor, every record before the cursor has been sent *** #
+    def uploaded_offset(self, segment):
+        try:
+            with open(segment + CURSOR_SUFFIX, "r") as fp:
+                return int(fp.read().strip() or 0)
+        except FileNotFoundError:
+            return 0
+
+    def set_uploaded_offset(self, segment, offset):
+        tmp_path = segment + CURSOR_SUFFIX + ".tmp"
+        with open(tmp_path, "w") as fp:
+            fp.write(str(offset))
+        os.replace(tmp_path, segment + CURSOR_SUFFIX)
@@ -0,0 +1,69 @@
+import numpy as np
+
+# Text format of a sweep file: one "frequency;(real+imagj)" line per point.
+# Multi-trace records start with a "#Frequency;S11;S21" header and hold one
+# complex column per S-parameter, all taken from the same acquisition.
+
+def write_trace_file(path, frequencies, trace, parameters=None):
+    with open(path, 'w') as fp:
+        if trace.ndim == 1:
+            fp.write('\n'.join(map('{};{}'.format, frequencies.tolist(), trace.tolist())))
+            return
+
+        line_format = ';'.join(['{}'] * (len(trace) + 1))
+        fp.write('#' + ';'.join(['Frequency', *parameters]) + '\n')
+        fp.write('\n'.join(map(line_format.format, frequencies.tolist(), *trace.tolist())))
+
+
+def read_trace_record(path):
+    """Returns (frequencies, traces, parameters); traces has one row per parameter."""
+    with open(path, 'r') as fp:
+        return parse_trace_record(fp.read())
+
+
+def parse_trace_record(text):
+    lines = text.split()
+
+    parameters = None
+    if lines and lines[0].startswith('#'):
+        parameters = lines.pop(0)[1:].split(';')[1:]
+    columns = 1 + (len(parameters) if parameters else 1)
+
+    try:
+        fields = [line.split(';') for line in lines]
+        if any(len(row) != columns for row in fields):
+            raise ValueError("unexpected number of columns")
+        frequencies = np.array([row[0] for row in fields], dtype=np.float64)
+        traces = np.empty((columns - 1, len(fields)), dtype=np.complex128)
+        for i, values in enumerate(list(zip(*fields))[1:]):
+            traces[i] = np.fromiter(map(complex, values), dtype=np.complex128, count=len(values))
+    except ValueError:
+        # Malformed lines: fall back to a tolerant line by line parse
+        frequencies, traces = _read_trace_lines(lines, columns)
+
+    return frequencies, traces, parameters
+
+
+def read_trace_file(path):
+    frequencies, traces, _ = read_trace_record(path)
+    return frequencies, traces[0]
+
+
+def _read_trace_lines(lines, columns):
+    frequencies = []
+    rows = []
+    for line in lines:
+        try:
+            values = line.split(';')
+            if len(values) != columns:
+                raise ValueError(f"expected {columns} values")
+            freq = float(values[0])
+            complex_vals = [complex(value) for value in values[1:]]
+        except ValueError as e:
+            print(f"⚠️ Error processing rule: {line} → {e}")
+            continue
+        frequencies.append(freq)
+        rows.append(complex_vals)
+
+    traces = np.array(rows, dtype=np.complex128).reshape(-1, columns - 1).T
+    return np.array(frequencies, dtype=np.float64), np.ascontiguousarray(traces)
@@ -0,0 +1,141 @@
+import json
+import os
+import sqlite3
+import threading
+from collections import namedtuple
+
+from lib.sweep_store import SweepRef
+
+# Durable upload journal
+#
+# Every stored sweep gets a row in a SQLite database (WAL mode), in the order
+# it was stored. The uploader takes rows from the head in id order and deletes
+# them once InfluxDB accepted them, so an interrupted drain resumes where it
+# stopped. Rows point at a text file (offset -1) or at a record of a sweep
+# store segment. Other points (configurations, system data) that could not be
+# written are kept as line protocol in the records table.
+
+Upload = namedtuple("Upload", ["id", "path", "offset", "size", "timestamp", "polarisation", "config_hash", "parameters", "attempts"])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS uploads (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    path TEXT NOT NULL,
+    offset INTEGER NOT NULL DEFAULT -1,
+    size INTEGER NOT NULL DEFAULT 0,
+    timestamp TEXT,
+    polarisation TEXT,
+    config_hash TEXT,
+    parameters TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    UNIQUE (path, offset)
+);
+CREATE TABLE IF NOT EXISTS records (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    line TEXT NOT NULL
+);
+"""
+
+
+def upload_location(upload):
+    # Text file path or SweepRef, like persist_sweep returns
+    if upload.offset < 0:
+        return upload.path
+    return SweepRef(upload.path, upload.offset, upload.size)
+
+
+class UploadQueue:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = None
+
+    def connect(self):
+        # Opened on first use, importing the module does not create the database
+        if self.connection is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            connection.executescript(SCHEMA)
+            self.connection = connection
+        return self.connection
+
+    def close(self):
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+    # *** Producer side *** #
+    def enqueue(self, location, timestamp=None, polarisation=None, config_hash=None, parameters=None):
+        return self.enqueue_many([(location, timestamp, polarisation, config_hash, parameters)])
+
+    def enqueue_many(self, entries):
+        """Adds (location, timestamp, polarisation, config_hash, parameters) entries, known locations are skipped."""
+        rows = []
+        for location, timestamp, polarisation, config_hash, parameters in entries:
+            if isinstance(location, SweepRef):
+                path, offset, size = location
+            else:
+                path, offset, size = location, -1, 0
+            rows.append((path, offset, size, timestamp, polarisation, config_hash,
+                         json.dumps(list(parameters)) if parameters else None))
+
+        with self.lock:
+            connection = self.connect()
+            with connection:
+                connection.execute("BEGIN IMMEDIATE")
+                connection.executemany(
+                    "INSERT OR IGNORE INTO uploads (path, offset, size, timestamp, polarisation, config_hash, parameters) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+    # *** Consumer side *** #
+    def peek(self, limit=100, after=0):
+        with self.lock:
+            rows = self.connect().execute(
+                "SELECT id, path, offset, size, timestamp, polarisation, config_hash, parameters, attempts "
+                "FROM uploads WHERE id > ? ORDER BY id LIMIT ?", (after, limit)).fetchall()
+        return [Upload(*row[:7], json.loads(row[7]) if row[7] else None, row[8]) for row in rows]
+
+    def complete(self, ids):
+        if not ids:
+            return
+        with self.lock:
+            connection = self.connect()
+            with connection:
+                connection.execute("BEGIN IMMEDIATE")
+                connection.executemany("DELETE FROM uploads WHERE id = ?", [(id,) for id in ids])
+
+    def failed(self, id, error):
+        with self.lock:
+            self.connect().execute("UPDATE uploads SET attempts = attempts + 1, error = ? WHERE id = ?", (str(error), id))
+
+    def pending(self, path=None):
+        with self.lock:
+            if path is None:
+                return self.connect().execute("SELECT COUNT(*) FROM uploads").fetchone()[0]
+            return self.connect().execute("SELECT COUNT(*) FROM uploads WHERE path = ?", (path,)).fetchone()[0]
+
+    # *** Line protocol records *** #
+    def enqueue_records(self, lines):
+        with self.lock:
+            connection = self.connect()
+            with connection:
+                connection.execute("BEGIN IMMEDIATE")
+                connection.executemany("INSERT INTO records (line) VALUES (?)", [(line,) for line in lines])
+
+    def peek_records(self, limit=5000):
+        with self.lock:
+            return self.connect().execute("SELECT id, line FROM records ORDER BY id LIMIT ?", (limit,)).fetchall()
+
+    def complete_records(self, ids):
+        if not ids:
+            return
+        with self.lock:
+            connection = self.connect()
+            with connection:
+                connection.execute("BEGIN IMMEDIATE")
+                connection.executemany("DELETE FROM records WHERE id = ?", [(id,) for id in ids])
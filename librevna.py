@@ -2,43 +2,68 @@
 # See e.g. https://github.com/jankae/LibreVNA/actions/runs/12914350951
 
 import re
+import asyncio
+import selectors
 import socket
-from asyncio import IncompleteReadError  # only import the exception class
+from asyncio import IncompleteReadError
 import time
 import math
 import cmath
+import warnings
 import csv
 import os
 from datetime import datetime, timedelta
 from pathlib import Path
 import sys
+import queue
+import threading
+from concurrent.futures import Future
 import RPi.GPIO as GPIO
 import time
+import numpy as np
 
 from lib.influxdb import *
 from lib.configuration import *
+from lib.trace_file import *
+from lib.sweep_store import *
+from lib.convert import write_csv_file, calculate_magnitude_phase_arrays, convert_directory
 
 result_dir = os.path.join(os.getcwd(), "results/vna")
 
 class SocketStreamReader:
-    def __init__(self, sock: socket.socket, default_timeout=5):
+    def __init__(self, sock: socket.socket, default_timeout=5, chunk_size=65536):
         self._sock = sock
         self._sock.setblocking(0)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._sock, selectors.EVENT_READ)
+        # One growable receive buffer, consumed through a read cursor
         self._recv_buffer = bytearray()
+        self._read_pos = 0
+        self._chunk = bytearray(chunk_size)
         self.default_timeout = default_timeout
 
-    def read(self, num_bytes: int = -1) -> bytes:
-        raise NotImplementedError
-
-    def readexactly(self, num_bytes: int) -> bytes:
-        buf = bytearray(num_bytes)
-        pos = 0
-        while pos < num_bytes:
-            n = self._recv_into(memoryview(buf)[pos:])
-            if n == 0:
-                raise IncompleteReadError(bytes(buf[:pos]), num_bytes)
-            pos += n
-        return bytes(buf)
+    def close(self):
+        self._selector.close()
+
+    def read(self, num_bytes: int = -1, timeout=None) -> bytes:
+        deadline = self._deadline(timeout)
+        if num_bytes < 0:
+            # Read everything until the GUI closes the connection
+            while self._fill(deadline):
+                pass
+            return self._consume(self._buffered())
+        if num_bytes == 0:
+            return b""
+        if self._buffered() == 0:
+            self._fill(deadline)
+        return self._consume(min(num_bytes, self._buffered()))
+
+    def readexactly(self, num_bytes: int, timeout=None) -> bytes:
+        deadline = self._deadline(timeout)
+        while self._buffered() < num_bytes:
+            if self._fill(deadline) == 0:
+                raise IncompleteReadError(self._consume(self._buffered()), num_bytes)
+        return self._consume(num_bytes)
 
     def readline(self, timeout=None) -> bytes:
         return self.readuntil(b"\n", timeout=timeout)
@@ -46,49 +71,70 @@ class SocketStreamReader:
     def readuntil(self, separator: bytes = b"\n", timeout=None) -> bytes:
         if len(separator) != 1:
             raise ValueError("Only separators of length 1 are supported.")
-        if timeout is None:
-            timeout = self.default_timeout
-
-        chunk = bytearray(4096)
-        start = 0
-        buf = bytearray(len(self._recv_buffer))
-        bytes_read = self._recv_into(memoryview(buf))
-        assert bytes_read == len(buf)
+        deadline = self._deadline(timeout)
 
-        time_limit = time.time() + timeout
+        # Only scan bytes that were not searched before
+        start = self._read_pos
         while True:
-            idx = buf.find(separator, start)
+            idx = self._recv_buffer.find(separator, start)
             if idx != -1:
                 break
-            elif time.time() > time_limit:
-                raise Exception("Timed out waiting for response from GUI")
-
             start = len(self._recv_buffer)
-            bytes_read = self._recv_into(memoryview(chunk))
-            buf += memoryview(chunk)[:bytes_read]
+            if self._fill(deadline) == 0:
+                raise IncompleteReadError(self._consume(self._buffered()), None)
+
+        return self._consume(idx + 1 - self._read_pos)
 
-        result = bytes(buf[: idx + 1])
-        self._recv_buffer = b"".join(
-            (memoryview(buf)[idx + 1:], self._recv_buffer)
-        )
+    def _deadline(self, timeout):
+        if timeout is None:
+            timeout = self.default_timeout
+        return time.monotonic() + timeout
+
+    def _buffered(self) -> int:
+        return len(self._recv_buffer) - self._read_pos
+
+    def _consume(self, num_bytes: int) -> bytes:
+        end = self._read_pos + num_bytes
+        with memoryview(self._recv_buffer) as view:
+            result = bytes(view[self._read_pos:end])
+        self._read_pos = end
+
+        # Drop consumed bytes once they make up most of the buffer
+        if self._read_pos == len(self._recv_buffer):
+            self._recv_buffer.clear()
+            self._read_pos = 0
+        elif self._read_pos > len(self._recv_buffer) // 2:
+            del self._recv_buffer[:self._read_pos]
+            self._read_pos = 0
         return result
 
-    def _recv_into(self, view: memoryview) -> int:
-        bytes_read = min(len(view), len(self._recv_buffer))
-        view[:bytes_read] = self._recv_buffer[:bytes_read]
-        self._recv_buffer = self._recv_buffer[bytes_read:]
-        if bytes_read == len(view):
+    def _fill(self, deadline) -> int:
+        """Block until data arrives and append it to the buffer. Returns 0 on EOF."""
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise Exception("Timed out waiting for response from GUI")
+            if not self._selector.select(remaining):
+                continue
+            try:
+                bytes_read = self._sock.recv_into(self._chunk)
+            except (BlockingIOError, InterruptedError):
+                continue
+            if bytes_read:
+                with memoryview(self._chunk) as view:
+                    self._recv_buffer += view[:bytes_read]
             return bytes_read
-        try:
-            bytes_read += self._sock.recv_into(view[bytes_read:], 0)
-        except:
-            pass
-        return bytes_read
+
+
+_TRACE_BRACKETS = str.maketrans('', '', '[]')
 
 
 class _libreVNA:
     def __init__(self, host='localhost', port=19542,
                  check_cmds=True, timeout=3):
+        # Set before connecting, __del__ also runs when the connection failed
+        self.reader = None
+        self.sock = None
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         try:
             self.sock.connect((host, port))
@@ -101,7 +147,10 @@ class _libreVNA:
         self.timeout = timeout
 
     def __del__(self):
-        self.sock.close()
+        if self.reader is not None:
+            self.reader.close()
+        if self.sock is not None:
+            self.sock.close()
 
     def __read_response(self, timeout=None):
         if timeout is None:
@@ -109,10 +158,14 @@ class _libreVNA:
         return self.reader.readline(timeout=timeout).decode().rstrip()
 
     def cmd(self, cmd, check=None, timeout=None):
+        return self.cmds([cmd], check=check, timeout=timeout)
+
+    def cmds(self, cmds, check=None, timeout=None):
+        # Pipeline all commands in one write, the status register collects
+        # errors of every command so a single *ESR? at the end is enough
         if timeout is None:
             timeout = self.timeout
-        self.sock.sendall(cmd.encode())
-        self.sock.send(b"\n")
+        self.sock.sendall("".join(f"{cmd}\n" for cmd in cmds).encode())
         if check or (check is None and self.default_check_cmds):
             status = self.get_status(timeout=timeout)
             if status & 0x20:
@@ -134,6 +187,13 @@ class _libreVNA:
         self.sock.send(b"\n")
         return self.__read_response(timeout=timeout)
 
+    def query_batch(self, queries, timeout=None):
+        # Send all queries in one write, the GUI answers them in order
+        if timeout is None:
+            timeout = self.timeout
+        self.sock.sendall("".join(f"{query}\n" for query in queries).encode())
+        return [self.__read_response(timeout=timeout) for _ in queries]
+
     def get_status(self, timeout=None):
         if timeout is None:
             timeout = self.timeout
@@ -148,40 +208,234 @@ class _libreVNA:
 
     @staticmethod
     def parse_VNA_trace_data(data):
-        ret = []
-        # Remove brackets (order of data implicitly known)
-        data = data.replace(']', '').replace('[', '')
-        values = data.split(',')
-        if int(len(values) / 3) * 3 != len(values):
-            # number of values must be a multiple of three (frequency, real, imaginary)
-            raise Exception("Invalid input data: expected tuples of three values each")
-        for i in range(0, len(values), 3):
-            freq = float(values[i])
-            real = float(values[i + 1])
-            imag = float(values[i + 2])
-            ret.append((freq, complex(real, imag)))
-        return ret
+        frequencies, trace = _libreVNA.parse_VNA_trace_arrays(data)
+        return list(zip(frequencies.tolist(), trace.tolist()))
 
     @staticmethod
     def parse_SA_trace_data(data):
-        ret = []
+        frequencies, dBm = _libreVNA.parse_SA_trace_arrays(data)
+        return list(zip(frequencies.tolist(), dBm.tolist()))
+
+    @staticmethod
+    def parse_VNA_trace_arrays(data):
+        # number of values must be a multiple of three (frequency, real, imaginary)
+        values = _libreVNA.__parse_trace_values(data, 3)
+        frequencies = np.ascontiguousarray(values[:, 0])
+        trace = np.empty(len(values), dtype=np.complex128)
+        trace.real = values[:, 1]
+        trace.imag = values[:, 2]
+        return frequencies, trace
+
+    @staticmethod
+    def parse_SA_trace_arrays(data):
+        # number of values must be a multiple of two (frequency, dBm)
+        values = _libreVNA.__parse_trace_values(data, 2)
+        return np.ascontiguousarray(values[:, 0]), np.ascontiguousarray(values[:, 1])
+
+    @staticmethod
+    def __parse_trace_values(data, tuple_size):
         # Remove brackets (order of data implicitly known)
-        data = data.replace(']', '').replace('[', '')
-        values = data.split(',')
-        if int(len(values) / 2) * 2 != len(values):
-            # number of values must be a multiple of two (frequency, dBm)
-            raise Exception("Invalid input data: expected tuples of two values each")
-        for i in range(0, len(values), 2):
-            freq = float(values[i])
-            dBm = float(values[i + 1])
-            ret.append((freq, dBm))
-        return ret
+        data = data.translate(_TRACE_BRACKETS)
+        if not data.strip():
+            return np.empty((0, tuple_size), dtype=np.float64)
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", DeprecationWarning)
+                values = np.fromstring(data, dtype=np.float64, sep=',')
+        except ValueError:
+            values = None
+        if values is None or values.size != data.count(',') + 1:
+            raise Exception("Invalid input data: could not parse all values")
+        if values.size % tuple_size != 0:
+            raise Exception(f"Invalid input data: expected tuples of {tuple_size} values each")
+        return values.reshape(-1, tuple_size)
 
 def calculate_magnitude_phase(complex_number):
     magnitude = 20*math.log10(abs(complex_number))
     phase = math.degrees(cmath.phase(complex_number))
     return magnitude, phase
 
+def changed_settings(settings, device_state):
+    """SCPI settings of VnaSettings that differ from the last applied device_state."""
+    desired = {
+        "DEV:MODE": "VNA",
+        "DEV:REF:IN": "INT",
+        "VNA:FREQ:CENT": str(settings.center),
+        "VNA:FREQ:SPAN": str(settings.span),
+        "VNA:ACQ:POINTS": str(settings.points),
+        "VNA:STIM:LVL": str(settings.power),
+        "VNA:ACQ:AVG": str(settings.sweeps),
+        "VNA:ACQ:IFBW": str(settings.ifbw),
+    }
+    return {key: value for key, value in desired.items() if device_state.get(key) != value}
+
+class AcquisitionWaiter:
+    def __init__(self, point_overhead=150e-6, sweep_overhead=0.05, sleep_fraction=0.9,
+                 min_poll_interval=0.005, max_poll_interval=0.05, smoothing=0.3):
+        self.point_overhead = point_overhead
+        self.sweep_overhead = sweep_overhead
+        self.sleep_fraction = sleep_fraction
+        self.min_poll_interval = min_poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.smoothing = smoothing
+        # Ratio between measured and modelled sweep time, learned over sweeps
+        self.correction = 1.0
+        self.last_error = None
+
+    def model(self, settings):
+        # settings: VnaSettings
+        return settings.sweeps * (settings.points * (1 / settings.ifbw + self.point_overhead) + self.sweep_overhead)
+
+    def estimate(self, settings):
+        return self.model(settings) * self.correction
+
+    def wait(self, vna, settings, timeout=None):
+        started, modelled, estimate, timeout = self.__begin(settings, timeout)
+
+        # Sleep most of the expected sweep time without bothering the GUI
+        time.sleep(estimate * self.sleep_fraction)
+
+        # Then poll with a short, bounded backoff
+        interval = self.min_poll_interval
+        while vna.query("VNA:ACQ:FIN?") == "FALSE":
+            self.__check_timeout(started, timeout)
+            time.sleep(interval)
+            interval = min(interval * 2, self.max_poll_interval)
+
+        return self.__finish(started, modelled, estimate)
+
+    async def wait_async(self, vna, settings, timeout=None):
+        # Same as wait() for an asyncio client whose query() is a coroutine
+        started, modelled, estimate, timeout = self.__begin(settings, timeout)
+
+        await asyncio.sleep(estimate * self.sleep_fraction)
+
+        interval = self.min_poll_interval
+        while await vna.query("VNA:ACQ:FIN?") == "FALSE":
+            self.__check_timeout(started, timeout)
+            await asyncio.sleep(interval)
+            interval = min(interval * 2, self.max_poll_interval)
+
+        return self.__finish(started, modelled, estimate)
+
+    def __begin(self, settings, timeout):
+        modelled = self.model(settings)
+        estimate = modelled * self.correction
+        if timeout is None:
+            timeout = max(10.0, 5 * estimate)
+        return time.monotonic(), modelled, estimate, timeout
+
+    def __check_timeout(self, started, timeout):
+        if time.monotonic() - started > timeout:
+            raise Exception(f"Acquisition did not finish within {timeout:.1f} s")
+
+    def __finish(self, started, modelled, estimate):
+        elapsed = time.monotonic() - started
+        self.last_error = elapsed - estimate
+        self.correction += self.smoothing * (elapsed / modelled - self.correction)
+        return elapsed
+
+
+def persist_sweep(config, name, sweep):
+    """Stores a sweep in the binary sweep store (or as a text file with storage: text) and queues it for upload."""
+    if get_storage(config) == "text":
+        path = f"{result_dir}/{name}.txt"
+        Path(result_dir).mkdir(parents=True, exist_ok=True)
+        if len(sweep.traces) == 1:
+            write_trace_file(path, sweep.frequencies, sweep.traces[0])
+        else:
+            write_trace_file(path, sweep.frequencies, sweep.traces, sweep.parameters)
+        location = path
+    else:
+        location = vna_store.append(sweep)
+
+    enqueue_upload(location, sweep)
+    return location
+
+
+def get_storage(config):
+    return config['fixed_configurations'].get('storage', 'binary')
+
+
+class TracePipeline:
+    def __init__(self, debug_name="[LibreVNA]", upload=True, max_pending=2):
+        self.debug_name = debug_name
+        self.upload = upload
+        self.failed = 0
+        self.queue = queue.Queue(maxsize=max_pending)
+        # Uploads run on their own thread, storing a sweep never waits for InfluxDB
+        self.uploads = queue.Queue(maxsize=max_pending)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.upload_thread = threading.Thread(target=self.run_uploads, daemon=True)
+        self.thread.start()
+        self.upload_thread.start()
+
+    def put(self, config, name, sweep):
+        # Blocks when the writer falls behind, which bounds the memory in use.
+        # The future resolves to the stored location of the sweep.
+        future = Future()
+        self.queue.put((config, name, sweep, future))
+        return future
+
+    def join_stored(self):
+        # Wait until every sweep handed over so far is stored, uploads may still run
+        self.queue.join()
+
+    def join(self):
+        # Wait until every sweep handed over so far is stored and uploaded
+        self.queue.join()
+        self.uploads.join()
+
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
+        self.uploads.put(None)
+        self.upload_thread.join()
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    return
+                config, name, sweep, future = item
+
+                try:
+                    location = persist_sweep(config, name, sweep)
+                except Exception as e:
+                    future.set_exception(e)
+                    raise
+                future.set_result(location)
+
+                if self.upload:
+                    try:
+                        self.uploads.put_nowait((config, name, location, sweep))
+                    except queue.Full:
+                        # Uploads fall behind, the sweep is left in the journal for send_vna_data
+                        debug(self.debug_name, f"Upload of {name} left to the backlog")
+            except Exception as e:
+                self.failed += 1
+                debug(self.debug_name, f"⚠️ Failed to store {item[1]}: {e}")
+            finally:
+                self.queue.task_done()
+
+    def run_uploads(self):
+        while True:
+            item = self.uploads.get()
+            try:
+                if item is None:
+                    return
+                config, name, location, sweep = item
+                # A failed upload leaves the sweep for send_vna_data
+                if not send_vna_record(config, self.debug_name, location, sweep):
+                    self.failed += 1
+            except Exception as e:
+                self.failed += 1
+                debug(self.debug_name, f"⚠️ Failed to upload {item[1]}: {e}")
+            finally:
+                self.uploads.task_done()
+
+
 class LibreVNA:
     def __init__(self, ip_address='localhost', port=1234):#10.128.68.13
         self.ip_address = ip_address
@@ -190,9 +444,15 @@ class LibreVNA:
         self.vna = None
         self.last_filename_vh = None
         self.last_filename_vv = None
+        self.last_record_vh = None
+        self.last_record_vv = None
         self.temperature_filename = None
+        self.settings = None
         self.config = None
         self.polarisation_inverted = 0
+        self.device_state = {}
+        self.connected = False
+        self.acquisition = AcquisitionWaiter()
         self.connect()
 
 
@@ -201,6 +461,9 @@ class LibreVNA:
             ip_address = self.ip_address
         if port is None:
             port = self.port
+        # Settings of a new session are unknown
+        self.device_state = {}
+        self.connected = False
         try:
             self.vna = _libreVNA(ip_address, port)
             #time.sleep(5)
@@ -212,49 +475,66 @@ class LibreVNA:
                 return
             else:
                 self.debug("Connected to " + dev)
+                self.connected = True
         except Exception as e:
             self.debug("Failed to connect to Instrument")
             self.debug(e)
             self.debug("-----")
 
-    def setup(self, config):
+    def setup(self, settings, use_cache=True, readback=False):
 
-        self.config = config
+        # Compiled settings (get_settings()), the raw config goes along to storage and upload
+        self.settings = settings
+        self.config = settings.raw
 
         # Get GPIO pin to control the RF switch
-        self.rf_switch_gpio_pin = self.config['fixed_configurations']['rf_switch_pin']
+        self.rf_switch_gpio_pin = settings.fixed.rf_switch_pin
         self.debug(self.rf_switch_gpio_pin)
 
         # Check if polarisation should be inverted (RX antennas are connected in opposite way)
-        self.polarisation_inverted = self.config['fixed_configurations']['polarisation_inverted']
+        self.polarisation_inverted = settings.fixed.polarisation_inverted
         if self.polarisation_inverted:
             self.debug("Polarisation is inverted!")
 
         GPIO.setmode(GPIO.BCM)
         GPIO.setup(self.rf_switch_gpio_pin, GPIO.OUT)
         
-        # Select config file
-        settings = self.config['configurations']
-
-        self.vna.cmd("DEV:MODE VNA")
-        self.vna.cmd("DEV:REF:IN INT")
-        self.vna.cmd(f"VNA:FREQ:CENT {settings['center']}")#5400000000
-        self.vna.cmd(f"VNA:FREQ:SPAN {settings['span']}")#1950000000
-        self.vna.cmd(f"VNA:ACQ:POINTS {settings['points']}")
-        self.vna.cmd(f"VNA:STIM:LVL {settings['power']}")
-        self.vna.cmd(f"VNA:ACQ:AVG {settings['sweeps']}")
-        self.vna.cmd(f"VNA:ACQ:IFBW {settings['ifbw']}")
-
-        self.debug(f"Device mode: {self.vna.query('DEV:MODE?')}")
-        self.debug(f"Reference clock: {self.vna.query('DEV:REF:IN?')}")
-        self.debug(f"Center frequency: {self.vna.query('VNA:FREQ:CENT?')} Hz")#5400000000
-        self.debug(f"Span: {self.vna.query('VNA:FREQ:SPAN?')} Hz")#1950000000
-        self.debug(f"Points: {self.vna.query('VNA:ACQ:POINTS?')}")
-        self.debug(f"Level: {self.vna.query('VNA:STIM:LVL?')} dBm")
-        self.debug(f"Number of sweeps: {self.vna.query('VNA:ACQ:AVG?')}")
-        self.debug(f"IFBW: {self.vna.query('VNA:ACQ:IFBW?')} Hz")
-
-    def measure(self, filename=None):
+        self.apply_settings(settings.vna, use_cache=use_cache)
+
+        if readback:
+            self.debug(f"Device mode: {self.vna.query('DEV:MODE?')}")
+            self.debug(f"Reference clock: {self.vna.query('DEV:REF:IN?')}")
+            self.debug(f"Center frequency: {self.vna.query('VNA:FREQ:CENT?')} Hz")#5400000000
+            self.debug(f"Span: {self.vna.query('VNA:FREQ:SPAN?')} Hz")#1950000000
+            self.debug(f"Points: {self.vna.query('VNA:ACQ:POINTS?')}")
+            self.debug(f"Level: {self.vna.query('VNA:STIM:LVL?')} dBm")
+            self.debug(f"Number of sweeps: {self.vna.query('VNA:ACQ:AVG?')}")
+            self.debug(f"IFBW: {self.vna.query('VNA:ACQ:IFBW?')} Hz")
+
+    def apply_settings(self, settings, use_cache=True):
+        if not use_cache:
+            self.device_state = {}
+
+        # Only send the settings that differ from the last applied state
+        changed = changed_settings(settings, self.device_state)
+        if not changed:
+            self.debug("Instrument settings unchanged")
+            return
+
+        try:
+            self.vna.cmds([f"{key} {value}" for key, value in changed.items()])
+        except Exception:
+            # State of the instrument is unknown, apply everything next time
+            self.device_state = {}
+            raise
+
+        self.device_state.update(changed)
+        self.debug(f"Applied settings: {', '.join(f'{key} {value}' for key, value in changed.items())}")
+
+    def measure(self, filename=None, pipeline=None):
+
+        # All S-parameters are read from the same acquisition
+        parameters = list(self.settings.vna.parameters)
 
         # |*****************************************|
         # |     ***     Measurement VV      ***     |
@@ -278,17 +558,11 @@ class LibreVNA:
             self.last_filename_vv = now.strftime("%Y-%m-%d_%H-%M-%S") + "_" + filename
 
         self.vna.cmd("VNA:ACQ:SINGLE TRUE")
+        self.acquisition.wait(self.vna, self.settings.vna)
 
-        while self.vna.query("VNA:ACQ:FIN?") == "FALSE":
-            time.sleep(0.1)
+        frequencies, data = self.fetch_traces(parameters)
 
-        trace = self.vna.query(f":VNA:TRAC:DATA? {self.config['configurations']['parameter']}")
-        data = self.vna.parse_VNA_trace_data(trace)
-
-        Path(result_dir).mkdir(parents=True, exist_ok=True)
-
-        with open(f"{result_dir}/{self.last_filename_vv}.txt", 'w') as fp:
-            fp.write('\n'.join('{};{}'.format(x[0], x[1]) for x in data))
+        self.last_record_vv = self.store_trace(self.last_filename_vv, now, "VV", frequencies, data, parameters, pipeline)
 
         # |*****************************************|
         # |     ***     Measurement VH      ***     |
@@ -315,48 +589,70 @@ class LibreVNA:
             self.last_filename_vh = now.strftime("%Y-%m-%d_%H-%M-%S") + "_" + filename
 
         self.vna.cmd("VNA:ACQ:SINGLE TRUE")
-        while self.vna.query("VNA:ACQ:FIN?") == "FALSE":
-            time.sleep(0.1)
+        self.acquisition.wait(self.vna, self.settings.vna)
 
-        trace = self.vna.query(f":VNA:TRAC:DATA? {self.config['configurations']['parameter']}")
-        data = self.vna.parse_VNA_trace_data(trace)
+        frequencies, data = self.fetch_traces(parameters)
+
+        self.last_record_vh = self.store_trace(self.last_filename_vh, now, "VH", frequencies, data, parameters, pipeline)
 
-        Path(result_dir).mkdir(parents=True, exist_ok=True)
 
-        with open(f"{result_dir}/{self.last_filename_vh}.txt", 'w') as fp:
-            fp.write('\n'.join('{};{}'.format(x[0], x[1]) for x in data))
+    def fetch_traces(self, parameters):
+        replies = self.vna.query_batch([f":VNA:TRAC:DATA? {parameter}" for parameter in parameters])
+        traces = [self.vna.parse_VNA_trace_arrays(reply) for reply in replies]
+        return traces[0][0], np.stack([trace for _, trace in traces])
 
+    def store_trace(self, name, timestamp, polarisation, frequencies, data, parameters, pipeline=None):
+        sweep = Sweep(timestamp, polarisation, self.settings.fixed.radar_name,
+                      self.settings.vna.config_hash, parameters, frequencies, data)
+
+        if pipeline is not None:
+            # Persist (and upload) in the background while the next sweep runs
+            return pipeline.put(self.config, name, sweep)
+
+        return persist_sweep(self.config, name, sweep)
 
     def convert(self, filename=None):
         if filename is None:
             filename = self.last_filename_vh
+            record = self.last_record_vh
+            if isinstance(record, Future):
+                record = record.result()
+        else:
+            record = None
+
+        if isinstance(record, SweepRef):
+            sweep = vna_store.read(record)
+            frequencies, traces, parameters = sweep.frequencies, sweep.traces, sweep.parameters
+        else:
+            frequencies, traces, parameters = read_trace_record(f"{result_dir}/{filename}.txt")
 
-        data = []
-        with open(f"{result_dir}/{filename}.txt", 'r') as file:
-            lines = file.readlines()
+        Path(result_dir).mkdir(parents=True, exist_ok=True)
 
-        for line in lines:
-            line = line.strip()
+        write_csv_file(f"{result_dir}/{filename}.csv", frequencies, traces, parameters)
 
-            if line:
-                numbers = line.split(';')
-                data.append((float(numbers[0]), complex(numbers[1])))
+    def convert_all(self, directory=None, workers=None):
+        # Batch conversion of every new sweep in a directory (default: results/vna)
+        return convert_directory(directory or result_dir, workers=workers)
 
-        processed_data = [
-            (frequency, *calculate_magnitude_phase(complex_number))
-            for frequency, complex_number in data
-        ]
+    def get_temp(self):
+        t = self.vna.query(":DEV:INF:TEMP?")
+        temperatures = [float(value) for value in t.split('/')]
 
-        Path(result_dir).mkdir(parents=True, exist_ok=True)
+        self.vna.cmd("*CLS")
 
-        with open(f"{result_dir}/{filename}.csv", 'w', newline='') as csvfile:
-            csvwriter = csv.writer(csvfile)
-            csvwriter.writerow(['Frequency [Hz]', 'Magnitude [dB]', 'Phase [deg]'])
-            for row in processed_data:
-                csvwriter.writerow(row)
+        return temperatures
 
     def close(self):
-        del self.vna
+        self.vna = None
+        self.connected = False
+
+    def abort(self):
+        # Called from another thread: a blocked read or write of the session fails right away
+        if self.vna is not None:
+            try:
+                self.vna.sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
 
     def get_last_csv(self):
         files_ = []
@@ -369,12 +665,14 @@ class LibreVNA:
         return files_
 
     def get_last_txt(self):
+        # Only sweeps stored as text have a file, see last_record_vv/vh for sweeps in the binary store
         files_ = []
-        
-        if self.last_filename_vv is not None:
-            files_.append(result_dir + "/" + self.last_filename_vv +".txt")
-        if self.last_filename_vh is not None:
-            files_.append(result_dir + "/" +self.last_filename_vh +".txt")
+
+        for record in (self.last_record_vv, self.last_record_vh):
+            if isinstance(record, Future):
+                record = record.result()
+            if isinstance(record, str):
+                files_.append(record)
         self.debug(files_)
         return files_
     
@@ -387,26 +685,28 @@ if __name__ == "__main__":
     else:
         number_of_measurements = 1
     print(f"[LibreVNA] Number of measurements: {number_of_measurements}")
+    pipeline = TracePipeline()
     for i in range(0, int(number_of_measurements)):
         print(f"[LibreVNA] Starting measurement {i + 1}")
         try:
             # Read configuration file
-            config = retrieve_yaml_file()
+            settings = get_settings()
 
             # Create LibreVNA class
             vna = LibreVNA()
 
             # Setup VNA
-            vna.setup(config)
+            vna.setup(settings)
 
-            # Measure with VNA
-            vna.measure()
+            # Measure with VNA, VV is written and sent while VH is measured
+            vna.measure(pipeline=pipeline)
+            pipeline.join()
 
             # Close VNA connection
             vna.close()
 
-            # Send data to influxdb
-            send_vna_data(config, "[LibreVNA]")
+            # Send data that could not be sent during the measurement
+            send_vna_data(settings.raw, "[LibreVNA]")
 
             print("[LibreVNA] Done")
         except Exception as e:
@@ -0,0 +1,255 @@
+import asyncio
+import copy
+import re
+from datetime import datetime, timedelta
+
+from librevna import *
+from librevna import _libreVNA
+from lib.influxdb import *
+from lib.configuration import *
+
+# Largest reply line the StreamReader accepts, a 4501 point trace is about 300 KB
+READ_LIMIT = 16 * 1024 * 1024
+
+
+class _asyncLibreVNA:
+    """asyncio counterpart of _libreVNA, one TCP connection to a LibreVNA-GUI instance."""
+
+    def __init__(self, reader, writer, check_cmds=True, timeout=3):
+        self.reader = reader
+        self.writer = writer
+        self.default_check_cmds = check_cmds
+        self.timeout = timeout
+        # Requests and responses are matched by order, one exchange at a time
+        self.lock = asyncio.Lock()
+
+    @classmethod
+    async def open(cls, host='localhost', port=19542, check_cmds=True, timeout=3):
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port, limit=READ_LIMIT), timeout)
+        except (OSError, asyncio.TimeoutError):
+            raise Exception(f"Unable to connect to LibreVNA-GUI on {host}:{port}. Make sure it is running and the TCP server is enabled.")
+        return cls(reader, writer, check_cmds, timeout)
+
+    async def close(self):
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except OSError:
+            pass
+
+    async def __send(self, lines):
+        self.writer.write("".join(f"{line}\n" for line in lines).encode())
+        await self.writer.drain()
+
+    async def __read_response(self, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        try:
+            line = await asyncio.wait_for(self.reader.readline(), timeout)
+        except asyncio.TimeoutError:
+            raise Exception("Timed out waiting for response from GUI")
+        except (asyncio.LimitOverrunError, ValueError) as e:
+            # The rest of the reply is still unread, later responses would be out of sync
+            self.writer.close()
+            raise Exception(f"Response from GUI too long: {e}")
+        if not line.endswith(b"\n"):
+            raise IncompleteReadError(line, None)
+        return line.decode().rstrip()
+
+    async def cmd(self, cmd, check=None, timeout=None):
+        return await self.cmds([cmd], check=check, timeout=timeout)
+
+    async def cmds(self, cmds, check=None, timeout=None):
+        async with self.lock:
+            if check or (check is None and self.default_check_cmds):
+                await self.__send([*cmds, "*ESR?"])
+                status = self.__parse_status(await self.__read_response(timeout))
+                if status & 0x20:
+                    raise Exception("Command Error")
+                if status & 0x10:
+                    raise Exception("Execution Error")
+                if status & 0x08:
+                    raise Exception("Device Error")
+                if status & 0x04:
+                    raise Exception("Query Error")
+                return status
+            await self.__send(cmds)
+            return None
+
+    async def query(self, query, timeout=None):
+        return (await self.query_batch([query], timeout=timeout))[0]
+
+    async def query_batch(self, queries, timeout=None):
+        async with self.lock:
+            await self.__send(queries)
+            return [await self.__read_response(timeout) for _ in queries]
+
+    async def get_status(self, timeout=None):
+        return self.__parse_status(await self.query("*ESR?", timeout=timeout))
+
+    async def get_traces(self, parameters, timeout=None):
+        replies = await self.query_batch([f":VNA:TRAC:DATA? {parameter}" for parameter in parameters], timeout=timeout)
+        traces = [_libreVNA.parse_VNA_trace_arrays(reply) for reply in replies]
+        return traces[0][0], np.stack([trace for _, trace in traces])
+
+    @staticmethod
+    def __parse_status(resp):
+        if not re.match(r'^\d+$', resp):
+            raise Exception("Expected numeric response from *ESR? but got "
+                            f"'{resp}'")
+        status = int(resp)
+        if status < 0 or status > 255:
+            raise Exception(f"*ESR? returned invalid value {status}.")
+        return status
+
+
+class Instrument:
+    """One LibreVNA-GUI instance with its own antenna chain, config section and result stream."""
+
+    def __init__(self, name, settings, host='localhost', port=1234):
+        self.name = name
+        self.settings = settings
+        self.config = settings.raw
+        self.host = host
+        self.port = port
+        self.vna = None
+        self.device_state = {}
+        self.acquisition = AcquisitionWaiter()
+        self.pipeline = TracePipeline(f"[LibreVNA {name}]")
+        self.rf_switch_gpio_pin = settings.fixed.rf_switch_pin
+        self.polarisation_inverted = settings.fixed.polarisation_inverted
+
+    async def connect(self):
+        self.device_state = {}
+        self.vna = await _asyncLibreVNA.open(self.host, self.port)
+        await self.vna.cmd("DEV:CONN")
+        dev = await self.vna.query("DEV:CONN?")
+        if dev == "Not connected":
+            raise Exception("Not connected to any device")
+        self.debug("Connected to " + dev)
+
+    async def close(self):
+        if self.vna is not None:
+            await self.vna.close()
+            self.vna = None
+
+    async def setup(self):
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setup(self.rf_switch_gpio_pin, GPIO.OUT)
+
+        changed = changed_settings(self.settings.vna, self.device_state)
+        if changed:
+            try:
+                await self.vna.cmds([f"{key} {value}" for key, value in changed.items()])
+            except Exception:
+                self.device_state = {}
+                raise
+            self.device_state.update(changed)
+
+    async def measure(self):
+        if self.vna is None:
+            await self.connect()
+        await self.setup()
+
+        parameters = list(self.settings.vna.parameters)
+        now = datetime.now()
+
+        # VV with the switch in its default position, then VH
+        for polarisation, level in (("VV", GPIO.HIGH), ("VH", GPIO.LOW)):
+            self.debug(f"Start measurement {polarisation}")
+
+            # Change RF switch
+            if self.polarisation_inverted:
+                level = GPIO.LOW if level == GPIO.HIGH else GPIO.HIGH
+            GPIO.output(self.rf_switch_gpio_pin, level)
+
+            filename = now.strftime("%Y-%m-%d_%H-%M-%S") + f"_{self.name}_dataset_{polarisation}"
+
+            await self.vna.cmd("VNA:ACQ:SINGLE TRUE")
+            await self.acquisition.wait_async(self.vna, self.settings.vna)
+            frequencies, data = await self.vna.get_traces(parameters)
+
+            sweep = Sweep(now, polarisation, self.settings.fixed.radar_name,
+                          self.settings.vna.config_hash, parameters, frequencies, data)
+
+            # Storing and uploading runs on the pipeline thread, keep the event loop free
+            await asyncio.to_thread(self.pipeline.put, self.config, filename, sweep)
+
+            # Prevent two files with the same timestamp
+            now = max(now + timedelta(seconds=1), datetime.now())
+
+        await asyncio.to_thread(self.pipeline.join)
+
+    def debug(self, string):
+        print(f"[LibreVNA {self.name}] {string}")
+
+
+class Orchestrator:
+    def __init__(self, config):
+        self.instruments = [Instrument(name, instrument_settings, host, port)
+                            for name, instrument_settings, host, port in get_instrument_configs(config)]
+
+    async def measure(self):
+        # Instruments sweep concurrently, a failing one does not stop the others
+        results = await asyncio.gather(*(self.measure_instrument(instrument) for instrument in self.instruments),
+                                       return_exceptions=True)
+        return {instrument.name: result for instrument, result in zip(self.instruments, results)}
+
+    async def measure_instrument(self, instrument):
+        try:
+            await instrument.measure()
+        except Exception as e:
+            instrument.debug(f"⚠️ Measurement failed: {e}")
+            await instrument.close()
+            raise
+        return True
+
+    async def close(self):
+        await asyncio.gather(*(instrument.close() for instrument in self.instruments))
+
+
+def get_instrument_configs(config):
+    """
+    Returns (name, settings, host, port) per entry of the optional "instruments" list.
+    Each entry may override keys of "configurations" and "fixed_configurations",
+    the merged config is compiled (and validated) per instrument. Instruments
+    need their own radar_name (it keeps their data apart) and rf_switch_pin.
+    """
+    instruments = config.get("instruments") or [{"name": "vna"}]
+    configs = []
+    for instrument in instruments:
+        instrument_config = copy.deepcopy(config)
+        for section in ("configurations", "fixed_configurations"):
+            instrument_config[section].update(instrument.get(section, {}))
+        configs.append((instrument["name"], compile_config(instrument_config),
+                        instrument.get("host", "localhost"), instrument.get("port", 1234)))
+
+    for key in ("radar_name", "rf_switch_pin"):
+        values = [getattr(settings.fixed, key) for _, settings, _, _ in configs]
+        for value in set(values):
+            if values.count(value) > 1:
+                names = [name for name, settings, _, _ in configs if getattr(settings.fixed, key) == value]
+                raise ConfigError(f"instruments: {', '.join(names)} share fixed_configurations.{key} {value}")
+    return configs
+
+
+async def main():
+    # Read configuration file
+    config = get_config()
+
+    orchestrator = Orchestrator(config)
+    try:
+        results = await orchestrator.measure()
+    finally:
+        await orchestrator.close()
+
+    for name, result in results.items():
+        print(f"[LibreVNA {name}] {'Done' if result is True else f'Failed: {result}'}")
+
+    # Send data that could not be sent during the measurement
+    send_vna_data(config, "[LibreVNA]")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -2,6 +2,7 @@
 # See e.g. https://github.com/jankae/LibreVNA/actions/runs/12914350951
 
 import re
+import selectors
 import socket
 from asyncio import IncompleteReadError  # only import the exception class
 import time
@@ -14,24 +15,39 @@ from lib.influxdb import *
 
 
 class SocketStreamReader:
-    def __init__(self, sock: socket.socket, default_timeout=5):
+    def __init__(self, sock: socket.socket, default_timeout=5, chunk_size=65536):
         self._sock = sock
         self._sock.setblocking(0)
+        self._selector = selectors.DefaultSelector()
+        self._selector.register(self._sock, selectors.EVENT_READ)
+        # One growable receive buffer, consumed through a read cursor
         self._recv_buffer = bytearray()
+        self._read_pos = 0
+        self._chunk = bytearray(chunk_size)
         self.default_timeout = default_timeout
 
-    def read(self, num_bytes: int = -1) -> bytes:
-        raise NotImplementedError
-
-    def readexactly(self, num_bytes: int) -> bytes:
-        buf = bytearray(num_bytes)
-        pos = 0
-        while pos < num_bytes:
-            n = self._recv_into(memoryview(buf)[pos:])
-            if n == 0:
-                raise IncompleteReadError(bytes(buf[:pos]), num_bytes)
-            pos += n
-        return bytes(buf)
+    def close(self):
+        self._selector.close()
+
+    def read(self, num_bytes: int = -1, timeout=None) -> bytes:
+        deadline = self._deadline(timeout)
+        if num_bytes < 0:
+            # Read everything until the GUI closes the connection
+            while self._fill(deadline):
+                pass
+            return self._consume(self._buffered())
+        if num_bytes == 0:
+            return b""
+        if self._buffered() == 0:
+            self._fill(deadline)
+        return self._consume(min(num_bytes, self._buffered()))
+
+    def readexactly(self, num_bytes: int, timeout=None) -> bytes:
+        deadline = self._deadline(timeout)
+        while self._buffered() < num_bytes:
+            if self._fill(deadline) == 0:
+                raise IncompleteReadError(self._consume(self._buffered()), num_bytes)
+        return self._consume(num_bytes)
 
     def readline(self, timeout=None) -> bytes:
         return self.readuntil(b"\n", timeout=timeout)
@@ -39,44 +55,59 @@ class SocketStreamReader:
     def readuntil(self, separator: bytes = b"\n", timeout=None) -> bytes:
         if len(separator) != 1:
             raise ValueError("Only separators of length 1 are supported.")
-        if timeout is None:
-            timeout = self.default_timeout
+        deadline = self._deadline(timeout)
 
-        chunk = bytearray(4096)
-        start = 0
-        buf = bytearray(len(self._recv_buffer))
-        bytes_read = self._recv_into(memoryview(buf))
-        assert bytes_read == len(buf)
-
-        time_limit = time.time() + timeout
+        # Only scan bytes that were not searched before
+        start = self._read_pos
         while True:
-            idx = buf.find(separator, start)
+            idx = self._recv_buffer.find(separator, start)
             if idx != -1:
                 break
-            elif time.time() > time_limit:
-                raise Exception("Timed out waiting for response from GUI")
-
             start = len(self._recv_buffer)
-            bytes_read = self._recv_into(memoryview(chunk))
-            buf += memoryview(chunk)[:bytes_read]
+            if self._fill(deadline) == 0:
+                raise IncompleteReadError(self._consume(self._buffered()), None)
 
-        result = bytes(buf[: idx + 1])
-        self._recv_buffer = b"".join(
-            (memoryview(buf)[idx + 1:], self._recv_buffer)
-        )
+        return self._consume(idx + 1 - self._read_pos)
+
+    def _deadline(self, timeout):
+        if timeout is None:
+            timeout = self.default_timeout
+        return time.monotonic() + timeout
+
+    def _buffered(self) -> int:
+        return len(self._recv_buffer) - self._read_pos
+
+    def _consume(self, num_bytes: int) -> bytes:
+        end = self._read_pos + num_bytes
+        with memoryview(self._recv_buffer) as view:
+            result = bytes(view[self._read_pos:end])
+        self._read_pos = end
+
+        # Drop consumed bytes once they make up most of the buffer
+        if self._read_pos == len(self._recv_buffer):
+            self._recv_buffer.clear()
+            self._read_pos = 0
+        elif self._read_pos > len(self._recv_buffer) // 2:
+            del self._recv_buffer[:self._read_pos]
+            self._read_pos = 0
         return result
 
-    def _recv_into(self, view: memoryview) -> int:
-        bytes_read = min(len(view), len(self._recv_buffer))
-        view[:bytes_read] = self._recv_buffer[:bytes_read]
-        self._recv_buffer = self._recv_buffer[bytes_read:]
-        if bytes_read == len(view):
+    def _fill(self, deadline) -> int:
+        """Block until data arrives and append it to the buffer. Returns 0 on EOF."""
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise Exception("Timed out waiting for response from GUI")
+            if not self._selector.select(remaining):
+                continue
+            try:
+                bytes_read = self._sock.recv_into(self._chunk)
+            except (BlockingIOError, InterruptedError):
+                continue
+            if bytes_read:
+                with memoryview(self._chunk) as view:
+                    self._recv_buffer += view[:bytes_read]
             return bytes_read
-        try:
-            bytes_read += self._sock.recv_into(view[bytes_read:], 0)
-        except:
-            pass
-        return bytes_read
 
 
 class _libreVNA:
@@ -94,6 +125,7 @@ class _libreVNA:
         self.timeout = timeout
 
     def __del__(self):
+        self.reader.close()
         self.sock.close()
 
     def __read_response(self, timeout=None):
@@ -0,0 +1,230 @@
+import json
+import os
+import socket
+import threading
+from datetime import datetime, timezone
+
+from librevna import *
+from lib.influxdb import *
+from lib.configuration import *
+from lib import config_bus
+from lib.instrument_arbiter import InstrumentArbiter, LeaseTimeout
+from lib.socket_helper import WORKER_SOCKET_PATH
+
+# Arbiter priority and lease (s) of a job when the request does not give one,
+# a measurement's lease follows from the expected sweep time
+JOB_PRIORITIES = {"measure": "scheduled", "temperature": "temperature", "configure": "manual", "calibration": "calibration"}
+LEASE_TIMES = {"measure": 600, "temperature": 30, "configure": 30, "calibration": 900}
+
+
+class MeasurementWorker:
+    """
+    Keeps one LibreVNA session alive and runs the jobs on it one at a time, in
+    the order the instrument arbiter grants them.
+    """
+
+    def __init__(self, ip_address='localhost', port=1234, socket_path=WORKER_SOCKET_PATH):
+        self.ip_address = ip_address
+        self.port = port
+        self.socket_path = socket_path
+        self.vna = None
+        self.arbiter = InstrumentArbiter()
+        self.pipeline = TracePipeline()
+        self.job_handlers = {
+            "measure": self.run_measure,
+            "temperature": self.run_temperature,
+            "configure": self.run_configure,
+            "calibration": self.run_calibration,
+        }
+
+    @property
+    def busy(self):
+        return self.arbiter.lease is not None
+
+    def start(self, serve_socket=True):
+        threading.Thread(target=self.arbiter.serve, daemon=True).start()
+        if serve_socket:
+            threading.Thread(target=self.serve, daemon=True).start()
+
+    # *** Job API *** #
+    def request(self, job="measure", priority=None, lease_time=None, start_deadline=None, **kwargs):
+        """Queues a job at the arbiter, returns its Lease."""
+        if job not in self.job_handlers:
+            raise ValueError(f"Unknown job '{job}'")
+        if lease_time is None:
+            lease_time = self.measure_lease_time(kwargs.get("count", 1)) if job == "measure" else LEASE_TIMES[job]
+        # A calibration lease ends by itself, other jobs are aborted when their lease expires
+        on_expire = None if job == "calibration" else self.abort
+        return self.arbiter.submit(job, lambda lease: self.run_job(job, kwargs),
+                                   priority or JOB_PRIORITIES[job], lease_time, start_deadline, on_expire)
+
+    @staticmethod
+    def measure_lease_time(count=1):
+        # VV and VH, each within the acquisition timeout of the AcquisitionWaiter, plus setup and readout
+        try:
+            estimate = AcquisitionWaiter().model(get_settings().vna)
+        except ConfigError:
+            return LEASE_TIMES["measure"] * int(count)
+        return int(count) * (2 * max(10.0, 5 * estimate) + 60)
+
+    def abort(self, lease):
+        # Lease expired: the blocked job fails on its next read of the LibreVNA
+        if self.vna is not None:
+            self.vna.abort()
+
+    def submit(self, job="measure", **kwargs):
+        return self.request(job, **kwargs).future
+
+    def measure(self, count=1):
+        return self.submit("measure", count=count).result()
+
+    def read_temperature(self):
+        return self.submit("temperature").result()
+
+    def run_job(self, job, kwargs):
+        try:
+            return self.job_handlers[job](**kwargs)
+        except Exception as e:
+            self.debug(f"⚠️ Job '{job}' failed: {e}")
+            raise
+
+    # *** Session handling *** #
+    def session(self):
+        if self.vna is None or not self.vna.connected:
+            self.debug("Opening LibreVNA session")
+            if self.vna is None:
+                self.vna = LibreVNA(self.ip_address, self.port)
+            else:
+                self.vna.connect()
+            if not self.vna.connected:
+                raise Exception("Unable to connect to LibreVNA")
+        return self.vna
+
+    def with_session(self, action, retry=True):
+        # Run the action, reconnect once when the connection with the GUI dropped.
+        # Actions that store data are not retried (retry=False), the session is only closed.
+        try:
+            return action(self.session())
+        except (OSError, IncompleteReadError) as e:
+            if not retry:
+                self.vna.close()
+                raise
+            self.debug(f"Connection lost ({e}), reconnecting")
+        except Exception as e:
+            if self.vna is not None and self.vna.connected:
+                # Responses may be out of sync now, start the next job on a fresh session
+                self.vna.close()
+                raise
+            self.debug(f"Session not available ({e}), reconnecting")
+
+        if self.vna is not None:
+            self.vna.close()
+        lease = self.arbiter.lease
+        if lease is not None and lease.expired:
+            raise LeaseTimeout(f"{lease.name} aborted, its lease of {lease.lease_time:.0f} s expired")
+        return action(self.session())
+
+    # *** Jobs *** #
+    def run_measure(self, count=1):
+        for i in range(int(count)):
+            self.debug(f"Starting measurement {i + 1} at {datetime.now(timezone.utc).isoformat()}")
+
+            # Read configuration file, an invalid one raises ConfigError before the sweep
+            settings = get_settings()
+
+            # A stale session is replaced while setting up, before anything is measured
+            self.with_session(lambda vna: vna.setup(settings))
+            try:
+                # VV is written and sent while VH is measured. Not retried: when the
+                # connection drops during VH, VV is already stored
+                self.with_session(lambda vna: vna.measure(pipeline=self.pipeline), retry=False)
+            finally:
+                # The lease ends once the sweeps are stored, the pipeline uploads them
+                # after it and upload_backlog of the controller sends what is left
+                self.pipeline.join_stored()
+
+        self.debug("Done")
+        return int(count)
+
+    def run_temperature(self):
+        return self.with_session(lambda vna: vna.get_temp())
+
+    def run_configure(self):
+        # Changed settings are applied while the session is idle, not at the start of the next sweep
+        if self.vna is None or not self.vna.connected:
+            return False
+        self.vna.setup(get_settings())
+        return True
+
+    def run_calibration(self):
+        # The operator calibrates in LibreVNA-GUI, sweeps wait until the lease is released or expires
+        if self.vna is not None:
+            self.vna.close()
+        lease = self.arbiter.lease
+        self.debug(f"Instrument leased for calibration ({lease.lease_time:.0f} s)")
+        if not lease.hold():
+            self.debug("⚠️ Calibration lease expired")
+        return True
+
+    def handle_config_event(self, event):
+        # Config bus subscription of a worker that runs on its own
+        if isinstance(event, list) and any(change.section == "vna" for change in event):
+            self.submit("configure")
+
+    # *** Local socket API *** #
+    def serve(self):
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(self.socket_path)
+        server.listen()
+
+        self.debug(f"🟢 Listening on {self.socket_path}")
+
+        try:
+            while True:
+                conn, _ = server.accept()
+                threading.Thread(target=self.handle_client, args=(conn,), daemon=True).start()
+        finally:
+            server.close()
+            os.remove(self.socket_path)
+
+    def handle_client(self, conn):
+        # Calibration leases of this connection, released when it closes
+        held = []
+        with conn, conn.makefile('rwb') as stream:
+            try:
+                for line in stream:
+                    try:
+                        request = json.loads(line)
+                        job = request.pop("job")
+                        if job == "release":
+                            result = self.arbiter.release(request.get("lease"))
+                        elif job == "calibration":
+                            # Answered once granted, the client releases it (or disconnects) when done
+                            lease = self.request(job, **request)
+                            held.append(lease)
+                            result = lease.granted.result().info()
+                        else:
+                            result = self.submit(job, **request).result()
+                        response = {"status": "ok", "result": result}
+                    except Exception as e:
+                        response = {"status": "error", "message": str(e)}
+                    stream.write((json.dumps(response) + "\n").encode())
+                    stream.flush()
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+            finally:
+                for lease in held:
+                    self.arbiter.release(lease.id)
+
+    def debug(self, string):
+        print(f"[Worker] {string}")
+
+
+if __name__ == "__main__":
+    worker = MeasurementWorker()
+    worker.start(serve_socket=False)
+    threading.Thread(target=config_bus.listen, args=(worker.handle_config_event,), daemon=True).start()
+    worker.serve()
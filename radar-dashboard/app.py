@@ -1,11 +1,11 @@
 from flask import Flask, session, render_template, request, jsonify, Response, redirect, url_for
 from werkzeug.security import check_password_hash
-import yaml
 import os
-from filelock import FileLock
 import sys
 sys.path.append(os.path.abspath("..")) 
 from lib.socket_helper import *
+from lib.configuration import config_cache, config_transaction, read_yaml_file, compile_config
+from lib.config_bus import split_events, publish_config_change, send_command
 
 # Set username and password
 USERNAME = 'admin'
@@ -51,33 +51,32 @@ def protected():
     return index()
 
 def index():
-    config = {}
-    if os.path.exists(CONFIG_PATH):
-        with FileLock(LOCK_PATH):
-            with open(CONFIG_PATH, 'r') as file:
-                config = yaml.safe_load(file) or {}
-        return render_template('index.html', config=config)
+    # Cached snapshot, only parsed again when the file changed
+    return render_template('index.html', config=config_cache.get())
 
 @app.route('/save_config', methods=['POST'])
 def save_config():
     data = request.json  # De nieuwe data van de POST request
     print(data)
     try:
-        # Lees de bestaande configuratie uit het YAML-bestand
-        try:
-            with FileLock(LOCK_PATH):
-                with open(CONFIG_PATH, 'r') as file:
-                    current_config = yaml.safe_load(file) or {}
-        except FileNotFoundError:
-            current_config = {}
+        # Flags and commands (single measurement) go over the config bus, not into the file
+        commands = split_events(data)
+
+        # Lees, combineer en schrijf de configuratie onder één lock
+        with config_transaction() as current_config:
+            # Gebruik de deep_update-functie i.p.v. .update()
+            deep_update(current_config, data)
 
-        # Gebruik de deep_update-functie i.p.v. .update()
-        deep_update(current_config, data)
+            # An invalid config raises ConfigError and is not written
+            compile_config(current_config)
 
-        # Schrijf de gecombineerde configuratie terug naar het bestand
-        with FileLock(LOCK_PATH):
-            with open(CONFIG_PATH, 'w') as file:
-                yaml.dump(current_config, file)
+        # The controller gets what changed right away
+        try:
+            publish_config_change()
+            for command in commands:
+                send_command(command)
+        except OSError as e:
+            return jsonify({"status": "error", "message": f"Config saved, but the controller is not reachable: {e}"})
 
         return jsonify({"status": "success", "message": "Config saved."})
     
@@ -92,19 +91,16 @@ def deep_update(source, overrides):
             source[key] = value
 
 def load_config():
-    with FileLock(LOCK_PATH):
-        with open(CONFIG_PATH, 'r') as file:
-            return yaml.safe_load(file)
+    return read_yaml_file()
 
 def save_config(config):
-    with FileLock(LOCK_PATH):
-        with open(CONFIG_PATH, 'w') as file:
-            yaml.dump(config, file)
+    with config_transaction() as current_config:
+        current_config.clear()
+        current_config.update(config)
 
 @app.route('/get_config', methods=['GET'])
 def get_config():
-    config = load_config()
-    return jsonify(config)
+    return jsonify(config_cache.get())
 
 @app.route('/update_config', methods=['POST'])
 def update_config():
@@ -4,20 +4,20 @@ from lib.configuration import *
 
 if __name__ == "__main__":
     # Read configuration file
-    config = retrieve_yaml_file()
+    settings = get_settings()
 
     # Print number of measurements
-    print(f"[LibreVNA] Number of measurements: {config["configurations"]["measurements"]}")
+    print(f"[LibreVNA] Number of measurements: {settings.vna.measurements}")
 
     # Execute measurements
-    for i in range(0, int(number_of_measurements)):
+    for i in range(0, settings.vna.measurements):
         print(f"[LibreVNA] Starting measurement {i + 1}")
         try:
             # Create LibreVNA class
             vna = LibreVNA()
 
             # Setup VNA
-            vna.setup(config)
+            vna.setup(settings)
 
             # Measure with VNA
             vna.measure()
@@ -26,7 +26,7 @@ if __name__ == "__main__":
             vna.close()
 
             # Send data to influxdb
-            send_vna_data(config, "[LibreVNA]")
+            send_vna_data(settings.raw, "[LibreVNA]")
 
             print("[LibreVNA] Done")
         except Exception as e:
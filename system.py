@@ -27,42 +27,35 @@ def get_disk_usage():
     except Exception:
         return None 
 
-def read_vna_temp(config):
-    while 1:
-        if check_vna_ready(config):
-            try:
-                # Create LibreVNA class
-                vna = LibreVNA()
-
-                # Setup VNA
-                vna_temperature = vna.get_temp()
-                # print(vna_temperature)
-
-                time.sleep(1)
-
-                # Close VNA connection
-                vna.close()
-
-                return vna_temperature
-            except Exception as e:
-                print(e)
-        else:
-            time.sleep(1)
-            print("[System] Waiting for the end of the ongoing measurement!")
-
-def check_vna_ready(config):
-    if config["measurement_status"]["auto_measurement"] == 1:
-        if not check_measurement_active() and check_next_measurement() > 10:
-            print(check_measurement_active())
-            print(check_next_measurement())
-            return True
-        else:
-            return False
-    else:
-        if not check_measurement_active():
-            return True
-        else:
-            return False
+def read_vna_temp():
+    # The controller's arbiter hands the LibreVNA to the worker as soon as it is free
+    try:
+        return request_worker_job("temperature", timeout=60, start_deadline=50)
+    except (FileNotFoundError, ConnectionRefusedError):
+        pass
+    except Exception as e:
+        # Not granted in time or failed, the point is sent without VNA temperatures
+        print(e)
+        return [None, None, None]
+
+    # No controller running, nothing else is using the LibreVNA
+    try:
+        # Create LibreVNA class
+        vna = LibreVNA()
+
+        # Setup VNA
+        vna_temperature = vna.get_temp()
+        # print(vna_temperature)
+
+        time.sleep(1)
+
+        # Close VNA connection
+        vna.close()
+
+        return vna_temperature
+    except Exception as e:
+        print(e)
+        return [None, None, None]
 
 
 if __name__ == "__main__":
@@ -74,7 +67,7 @@ if __name__ == "__main__":
     }
 
     # Get config file
-    config = retrieve_yaml_file()
+    config = get_config()
 
     # temps = asyncio.run(read_vna_temperature())
     # print("Temperaturen:", temps)
@@ -82,7 +75,7 @@ if __name__ == "__main__":
     vna_temperature = [0,0,0]
 
     # Read VNA temperature
-    vna_temperature = read_vna_temp(config)
+    vna_temperature = read_vna_temp()
 
     # Read DS18B20 sensors
     try:
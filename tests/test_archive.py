@@ -0,0 +1,44 @@
+import os
+import zipfile
+
+import pytest
+
+from lib.archive import SweepArchive
+
+
+def sweep_file(directory, name, text="sweep"):
+    path = os.path.join(directory, name)
+    with open(path, "w") as fp:
+        fp.write(text)
+    return path
+
+
+def test_add_and_read_back(tmp_path):
+    archive = SweepArchive(str(tmp_path / "archive"))
+    names = archive.add_files([sweep_file(tmp_path, "2026-01-01_10-00-00_VV.txt", "first")])
+
+    assert names == ["2026-01-01_10-00-00_VV.txt"]
+    assert archive.read_bytes(names[0]) == b"first"
+    assert not os.path.exists(tmp_path / names[0])
+
+
+def test_failed_add_leaves_no_orphan_members(tmp_path):
+    archive = SweepArchive(str(tmp_path / "archive"))
+    archive.add_files([sweep_file(tmp_path, "2026-01-01_10-00-00_VV.txt", "first")])
+
+    good = sweep_file(tmp_path, "2026-01-01_10-02-00_VV.txt", "second")
+    new_day = sweep_file(tmp_path, "2026-01-02_10-00-00_VV.txt", "third")
+    missing = str(tmp_path / "2026-01-02_10-02-00_VV.txt")
+    with pytest.raises(FileNotFoundError):
+        archive.add_files([good, new_day, missing])
+
+    with zipfile.ZipFile(tmp_path / "archive" / "2026-01-01.zip") as zf:
+        assert zf.namelist() == ["2026-01-01_10-00-00_VV.txt"]
+    assert not os.path.exists(tmp_path / "archive" / "2026-01-02.zip")
+    assert archive.names() == ["2026-01-01_10-00-00_VV.txt"]
+    assert os.path.exists(good) and os.path.exists(new_day)
+
+    # The same files are archived once the batch is retried
+    archive.add_files([good, new_day])
+    assert archive.read_bytes("2026-01-01_10-02-00_VV.txt") == b"second"
+    assert archive.read_bytes("2026-01-02_10-00-00_VV.txt") == b"third"
@@ -0,0 +1,55 @@
+import threading
+import time
+
+import pytest
+
+from lib.circuit_breaker import CircuitBreaker, CircuitOpenError
+
+
+def make_breaker(tmp_path, probe, **kwargs):
+    return CircuitBreaker("InfluxDB", probe, str(tmp_path / "circuit.json"), threshold=3,
+                          base_delay=0.05, max_delay=0.2, **kwargs)
+
+
+def test_opens_after_threshold_failures(tmp_path):
+    breaker = make_breaker(tmp_path, probe=lambda: False)
+    breaker.failure()
+    breaker.failure()
+    breaker.check()
+
+    breaker.failure()
+    with pytest.raises(CircuitOpenError):
+        breaker.check()
+
+
+def test_success_resets_the_count(tmp_path):
+    breaker = make_breaker(tmp_path, probe=lambda: False)
+    breaker.failure()
+    breaker.failure()
+    breaker.success()
+    breaker.failure()
+    breaker.failure()
+    assert not breaker.is_open()
+
+
+def test_probe_closes_the_circuit(tmp_path):
+    healthy = threading.Event()
+    breaker = make_breaker(tmp_path, probe=healthy.is_set)
+    for _ in range(3):
+        breaker.failure()
+    assert breaker.is_open()
+
+    healthy.set()
+    deadline = time.monotonic() + 2
+    while breaker.is_open() and time.monotonic() < deadline:
+        time.sleep(0.02)
+    breaker.check()
+
+
+def test_state_is_shared_through_the_file(tmp_path):
+    first = make_breaker(tmp_path, probe=lambda: False)
+    second = make_breaker(tmp_path, probe=lambda: False)
+    for _ in range(3):
+        first.failure()
+    with pytest.raises(CircuitOpenError):
+        second.check()
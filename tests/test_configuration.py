@@ -0,0 +1,119 @@
+import copy
+import os
+import threading
+from datetime import timedelta
+
+import pytest
+import yaml
+
+from lib.configuration import (ConfigCache, ConfigError, compile_config, config_transaction,
+                               freeze, thaw)
+
+REPO_CONFIG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config.yaml")
+
+
+@pytest.fixture
+def config():
+    with open(REPO_CONFIG) as fp:
+        return yaml.safe_load(fp)
+
+
+def test_repository_config_compiles(config):
+    settings = compile_config(config)
+    assert settings.vna.center == 5_000_000_000
+    assert settings.vna.start == 4e9 and settings.vna.stop == 6e9
+    assert settings.vna.parameters == ("S21",)
+    assert settings.fixed.polarisation_inverted is False
+    assert settings.timers.interval == timedelta(minutes=2)
+
+
+def test_long_radar_names_are_accepted(config):
+    for storage in ("binary", "text"):
+        config["fixed_configurations"].update(radar_name="radar-with-a-long-name", storage=storage)
+        assert compile_config(config).fixed.radar_name == "radar-with-a-long-name"
+
+
+def test_numbers_may_be_strings(config):
+    config["configurations"]["center"] = "5e9"
+    config["configurations"]["parameter"] = "s11, S21"
+    settings = compile_config(config)
+    assert settings.vna.center == 5_000_000_000
+    assert settings.vna.parameters == ("S11", "S21")
+
+
+@pytest.mark.parametrize("section, key, value, message", [
+    ("configurations", "points", 4502, "points: 4502 is outside 2..4501"),
+    ("configurations", "power", 5, "power"),
+    ("configurations", "ifbw", "fast", "not an integer"),
+    ("configurations", "parameter", "S33", "unknown S-parameter"),
+    ("configurations", "span", "12000000000", "outside"),
+    ("fixed_configurations", "storage", "cloud", "storage"),
+    ("timer_settings", "interval_minute", 0, "interval must be longer than 0 s"),
+    ("timer_settings", "init_month", 13, "invalid start time"),
+])
+def test_invalid_values(config, section, key, value, message):
+    config[section][key] = value
+    with pytest.raises(ConfigError, match=message):
+        compile_config(config)
+
+
+def test_snapshots_are_read_only(config):
+    snapshot = freeze(config)
+    with pytest.raises(TypeError):
+        snapshot["configurations"]["power"] = -10
+    assert thaw(snapshot) == config
+    assert copy.deepcopy(snapshot) == config
+
+
+def test_transaction_writes_only_changes(tmp_path, config):
+    path, lock_path = str(tmp_path / "config.yaml"), str(tmp_path / "config.yaml.lock")
+    with open(path, "w") as fp:
+        yaml.safe_dump(config, fp)
+    inode = os.stat(path).st_ino
+
+    with config_transaction(path, lock_path):
+        pass
+    assert os.stat(path).st_ino == inode
+
+    with config_transaction(path, lock_path) as changed:
+        changed["configurations"]["power"] = -26
+    assert os.stat(path).st_ino != inode
+    with open(path) as fp:
+        assert yaml.safe_load(fp)["configurations"]["power"] == -26
+
+
+def test_concurrent_transactions_do_not_lose_updates(tmp_path):
+    path, lock_path = str(tmp_path / "config.yaml"), str(tmp_path / "config.yaml.lock")
+    with open(path, "w") as fp:
+        yaml.safe_dump({"counter": {"value": 0}}, fp)
+
+    def increment():
+        with config_transaction(path, lock_path) as config:
+            config["counter"]["value"] += 1
+
+    threads = [threading.Thread(target=increment) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    with open(path) as fp:
+        assert yaml.safe_load(fp)["counter"]["value"] == 10
+
+
+def test_cache_reparses_only_after_a_change(tmp_path, config):
+    path, lock_path = str(tmp_path / "config.yaml"), str(tmp_path / "config.yaml.lock")
+    with open(path, "w") as fp:
+        yaml.safe_dump(config, fp)
+    cache = ConfigCache(path, lock_path)
+
+    settings = cache.settings()
+    assert cache.settings() is settings
+
+    with config_transaction(path, lock_path) as changed:
+        changed["configurations"]["points"] = 9999
+    with pytest.raises(ConfigError):
+        cache.settings()
+
+    with config_transaction(path, lock_path) as changed:
+        changed["configurations"]["points"] = 401
+    assert cache.settings().vna.points == 401
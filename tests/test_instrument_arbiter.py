@@ -0,0 +1,115 @@
+import threading
+import time
+
+import pytest
+
+from lib.instrument_arbiter import InstrumentArbiter, LeaseTimeout
+
+
+@pytest.fixture
+def arbiter():
+    arbiter = InstrumentArbiter()
+    threading.Thread(target=arbiter.serve, daemon=True).start()
+    return arbiter
+
+
+def occupy(arbiter):
+    # Keeps the instrument busy until the returned event is set
+    done = threading.Event()
+    lease = arbiter.submit("busy", lambda lease: done.wait(5), "calibration")
+    lease.granted.result(timeout=1)
+    return done
+
+
+def test_priority_order(arbiter):
+    done = occupy(arbiter)
+    order = []
+    leases = [arbiter.submit(name, lambda lease, name=name: order.append(name), priority)
+              for name, priority in [("temperature", "temperature"), ("scheduled 1", "scheduled"),
+                                     ("manual", "manual"), ("calibration", "calibration"),
+                                     ("scheduled 2", "scheduled")]]
+    assert arbiter.pending() == ["calibration", "manual", "scheduled 1", "scheduled 2", "temperature"]
+
+    done.set()
+    for lease in leases:
+        lease.future.result(timeout=1)
+    assert order == ["calibration", "manual", "scheduled 1", "scheduled 2", "temperature"]
+
+
+def test_waiting_job_starts_when_the_lease_ends(arbiter):
+    done = occupy(arbiter)
+    started = []
+    lease = arbiter.submit("temperature", lambda lease: started.append(time.monotonic()), "temperature")
+    time.sleep(0.1)
+    assert not started
+
+    released = time.monotonic()
+    done.set()
+    lease.future.result(timeout=1)
+    # Granted on release, not at the next tick of a polling loop
+    assert started[0] - released < 0.5
+    assert arbiter.lease is None
+
+
+def test_start_deadline(arbiter):
+    done = occupy(arbiter)
+    lease = arbiter.submit("temperature", lambda lease: 1, "temperature", start_deadline=0.05)
+    with pytest.raises(LeaseTimeout):
+        lease.future.result(timeout=1)
+    assert arbiter.pending() == []
+    done.set()
+
+
+def test_expired_lease_is_aborted(arbiter):
+    aborted = threading.Event()
+
+    def job(lease):
+        if not aborted.wait(2):
+            return "finished"
+        raise LeaseTimeout("aborted")
+
+    lease = arbiter.submit("measure", job, "scheduled", lease_time=0.1, on_expire=lambda lease: aborted.set())
+    with pytest.raises(LeaseTimeout):
+        lease.future.result(timeout=1)
+    assert lease.expired
+
+    # The instrument is free again
+    assert arbiter.submit("temperature", lambda lease: 1, "temperature").future.result(timeout=1) == 1
+
+
+def test_lease_within_deadline_is_not_aborted(arbiter):
+    aborted = []
+    lease = arbiter.submit("measure", lambda lease: 1, "scheduled", lease_time=0.05, on_expire=aborted.append)
+    assert lease.future.result(timeout=1) == 1
+    time.sleep(0.1)
+    assert not aborted and not lease.expired
+
+
+def test_held_lease_ends_on_release_or_expiry(arbiter):
+    lease = arbiter.submit("calibration", lambda lease: lease.hold(), "calibration", lease_time=5)
+    lease.granted.result(timeout=1)
+    assert arbiter.lease is lease
+    assert arbiter.release(lease.id)
+    assert lease.future.result(timeout=1) is True
+
+    lease = arbiter.submit("calibration", lambda lease: lease.hold(), "calibration", lease_time=0.05)
+    assert lease.future.result(timeout=1) is False
+
+
+def test_release_cancels_a_waiting_request(arbiter):
+    done = occupy(arbiter)
+    lease = arbiter.submit("temperature", lambda lease: 1, "temperature")
+    assert arbiter.release(lease.id)
+    assert lease.future.cancelled() and lease.granted.cancelled()
+    assert not arbiter.release(12345)
+    done.set()
+
+
+def test_listeners_see_lease_changes(arbiter):
+    seen = []
+    arbiter.add_listener(lambda: seen.append(None if arbiter.lease is None else arbiter.lease.name))
+    arbiter.submit("temperature", lambda lease: 1, "temperature").future.result(timeout=1)
+    deadline = time.monotonic() + 1
+    while len(seen) < 2 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert seen == ["temperature", None]
@@ -0,0 +1,81 @@
+import asyncio
+import os
+
+import pytest
+import yaml
+
+pytest.importorskip("RPi.GPIO")
+
+from lib.configuration import ConfigError
+from librevna_async import _asyncLibreVNA, READ_LIMIT, get_instrument_configs
+
+REPO_CONFIG = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "config.yaml")
+
+
+def run_with_server(reply, client):
+    async def main():
+        async def handle(reader, writer):
+            await reader.readline()
+            writer.write(reply)
+            await writer.drain()
+            writer.close()
+
+        server = await asyncio.start_server(handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        try:
+            vna = await _asyncLibreVNA.open("127.0.0.1", port)
+            try:
+                return await client(vna)
+            finally:
+                await vna.close()
+        finally:
+            server.close()
+
+    return asyncio.run(main())
+
+
+def test_trace_reply_above_64_kib():
+    points = 4501
+    reply = ",".join(f"[{1e9 + i},{0.001 * i},{-0.002 * i}]" for i in range(points)).encode() + b"\n"
+    assert len(reply) > 64 * 1024
+
+    frequencies, traces = run_with_server(reply, lambda vna: vna.get_traces(["S11"]))
+
+    assert frequencies.shape == (points,)
+    assert traces.shape == (1, points)
+    assert traces[0][-1] == pytest.approx(complex(0.001 * (points - 1), -0.002 * (points - 1)))
+
+
+def test_reply_over_limit_closes_connection():
+    async def client(vna):
+        with pytest.raises(Exception, match="too long"):
+            await vna.query(":VNA:TRACE:DATA? S11")
+        assert vna.writer.is_closing()
+
+    run_with_server(b"x" * (READ_LIMIT + 1) + b"\n", client)
+
+
+def config_with(instruments):
+    with open(REPO_CONFIG) as fp:
+        config = yaml.safe_load(fp)
+    config["instruments"] = instruments
+    return config
+
+
+def test_instruments_with_their_own_radar_and_switch():
+    configs = get_instrument_configs(config_with([
+        {"name": "north", "fixed_configurations": {"radar_name": "C002-N", "rf_switch_pin": 23}},
+        {"name": "south", "fixed_configurations": {"radar_name": "C002-S", "rf_switch_pin": 24}, "port": 1235},
+    ]))
+    assert [(name, settings.fixed.radar_name, port) for name, settings, _, port in configs] == \
+        [("north", "C002-N", 1234), ("south", "C002-S", 1235)]
+
+
+@pytest.mark.parametrize("south, message", [
+    ({"rf_switch_pin": 24}, "north, south share fixed_configurations.radar_name C002"),
+    ({"radar_name": "C002-S"}, "north, south share fixed_configurations.rf_switch_pin 23"),
+])
+def test_instruments_must_not_share_radar_or_switch(south, message):
+    config = config_with([{"name": "north"}, {"name": "south", "fixed_configurations": south}])
+    with pytest.raises(ConfigError, match=message):
+        get_instrument_configs(config)
@@ -0,0 +1,54 @@
+from datetime import datetime, timezone
+
+import numpy as np
+import pytest
+from influxdb_client import Point
+
+from lib.line_protocol import trace_lines, timestamp_ns
+
+TAGS = {"radar": "radar 1", "pol": "VV", "parameter": "S11", "a,b": "x=y"}
+TS = datetime(2026, 1, 1, 12, 0, 0, 123456, tzinfo=timezone.utc)
+
+
+def point_lines(frequencies, reals, imags, ts=TS):
+    lines = []
+    for frequency, real, imag in zip(frequencies, reals, imags):
+        point = Point("radar_measurement").tag("frequency", frequency).field("real", real).field("imag", imag)
+        for key, value in TAGS.items():
+            point.tag(key, value)
+        if ts is not None:
+            point.time(ts)
+        line = point.to_line_protocol()
+        if line:
+            lines.append(line)
+    return "\n".join(lines)
+
+
+@pytest.mark.parametrize("ts", [TS, None])
+def test_matches_point_for_finite_values(ts):
+    rng = np.random.default_rng(7)
+    frequencies = np.linspace(100e3, 6e9, 501)
+    reals = rng.standard_normal(501) * 10.0 ** rng.integers(-9, 9, 501)
+    imags = rng.standard_normal(501)
+    imags[0] = -0.0
+    reals[1] = 1.0
+
+    expected = point_lines(frequencies.tolist(), reals.tolist(), imags.tolist(), ts)
+    assert trace_lines("radar_measurement", TAGS, frequencies, reals, imags, ts) == expected
+
+
+def test_matches_point_for_non_finite_values():
+    frequencies = [1e9, 2e9, 3e9, 4e9, 5e9]
+    reals = [1.5, np.nan, np.inf, np.nan, -2.0]
+    imags = [np.nan, 2.5, 3.0, -np.inf, 0.25]
+
+    lines = trace_lines("radar_measurement", TAGS, frequencies, reals, imags, TS)
+    assert lines == point_lines(frequencies, reals, imags)
+    # Only the bin without any finite field is left out
+    assert len(lines.splitlines()) == 4
+
+
+def test_timestamp_ns():
+    assert timestamp_ns("2026-01-01T12:00:00.123456Z") == timestamp_ns(TS)
+    assert timestamp_ns(TS.replace(tzinfo=None)) == timestamp_ns(TS)
+    assert timestamp_ns(TS) % 10**9 == 123456000
@@ -0,0 +1,82 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("RPi.GPIO")
+
+import librevna
+import measurement_worker
+from measurement_worker import MeasurementWorker
+
+
+class FakeSession:
+    def __init__(self, fail_measure=0, fail_setup=0, sweeps=()):
+        self.connected = True
+        self.fail_measure = fail_measure
+        self.fail_setup = fail_setup
+        self.setups = 0
+        self.measures = 0
+        self.sweeps = sweeps
+
+    def setup(self, settings):
+        self.setups += 1
+        if self.fail_setup:
+            self.fail_setup -= 1
+            raise ConnectionResetError("GUI restarted")
+
+    def measure(self, pipeline=None):
+        self.measures += 1
+        for name in self.sweeps:
+            pipeline.put({}, name, None)
+        if self.fail_measure:
+            self.fail_measure -= 1
+            raise ConnectionResetError("connection dropped during VH")
+
+    def close(self):
+        self.connected = False
+
+
+@pytest.fixture
+def worker(monkeypatch):
+    monkeypatch.setattr(measurement_worker, "get_settings", lambda: SimpleNamespace(raw={}))
+    worker = MeasurementWorker()
+
+    def session():
+        if not worker.vna.connected:
+            worker.vna.connected = True
+        return worker.vna
+
+    worker.session = session
+    return worker
+
+
+def test_dropped_sweep_is_not_measured_again(worker):
+    worker.vna = FakeSession(fail_measure=1)
+    with pytest.raises(ConnectionResetError):
+        worker.run_measure()
+    assert worker.vna.measures == 1
+    assert not worker.vna.connected
+
+
+def test_stale_session_is_replaced_during_setup(worker):
+    worker.vna = FakeSession(fail_setup=1)
+    assert worker.run_measure() == 1
+    assert worker.vna.setups == 2 and worker.vna.measures == 1
+
+
+def test_lease_ends_before_the_uploads(worker, monkeypatch):
+    stored = []
+    upload = threading.Event()
+    monkeypatch.setattr(librevna, "persist_sweep", lambda config, name, sweep: stored.append(name) or name)
+    monkeypatch.setattr(librevna, "send_vna_record", lambda *args: upload.wait(5))
+    worker.vna = FakeSession(sweeps=["vv", "vh"])
+
+    # Returns, and ends the lease, with both sweeps stored while the upload still waits
+    assert worker.run_measure() == 1
+    assert stored == ["vv", "vh"]
+    assert worker.pipeline.uploads.unfinished_tasks > 0
+
+    upload.set()
+    worker.pipeline.join()
+    assert worker.pipeline.uploads.unfinished_tasks == 0
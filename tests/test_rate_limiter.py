@@ -0,0 +1,26 @@
+import time
+
+from lib.rate_limiter import RateLimiter
+
+
+def test_no_limit():
+    limiter = RateLimiter(0)
+    assert limiter.acquire(10**9) == 0
+
+
+def test_burst_is_free_then_rate_applies():
+    limiter = RateLimiter(rate=100, burst=10)
+    assert limiter.acquire(10) == 0
+
+    started = time.monotonic()
+    delay = limiter.acquire(5)
+    assert 0.04 <= delay <= 0.06
+    assert time.monotonic() - started >= 0.04
+
+
+def test_amount_above_burst_is_paid_off_afterwards():
+    limiter = RateLimiter(rate=1000, burst=10)
+    started = time.monotonic()
+    # 20 tokens more than the bucket holds: 20 ms at 1000/s
+    assert 0.015 <= limiter.acquire(30) <= 0.025
+    assert time.monotonic() - started >= 0.015
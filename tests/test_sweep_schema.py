@@ -0,0 +1,26 @@
+import numpy as np
+
+from lib.sweep_schema import CHUNK_BINS, pack_trace, unpack_trace, pack_axis, unpack_axis, axis_hash
+
+
+def test_trace_round_trip_keeps_float64():
+    trace = np.random.default_rng(1).standard_normal(4501) * (1 + 1e-12) + 1j / 3
+    fields = pack_trace(trace)
+
+    assert fields["bins"] == 4501
+    assert len([name for name in fields if name.startswith("data_")]) == -(-4501 // CHUNK_BINS)
+    np.testing.assert_array_equal(unpack_trace(fields), trace)
+
+
+def test_axis_round_trip():
+    frequencies = np.linspace(100e3, 6e9, 2001)
+    fields = pack_axis(frequencies)
+    np.testing.assert_array_equal(unpack_axis(fields), frequencies)
+    assert axis_hash(frequencies) == axis_hash(unpack_axis(fields))
+
+
+def test_flux_string_escapes_quotes_and_backslashes():
+    from lib.influxdb import flux_string
+    assert flux_string('radar "1"') == '"radar \\"1\\""'
+    assert flux_string("a\\b") == '"a\\\\b"'
+    assert flux_string("${x}") == '"\\${x}"'
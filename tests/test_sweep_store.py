@@ -0,0 +1,89 @@
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+
+from lib.sweep_store import SweepStore, Sweep, SweepRef, RECORD_HEADER
+
+
+def make_sweep(index=0, radar="radar-1", points=5):
+    frequencies = np.linspace(1e9, 2e9, points)
+    traces = np.arange(2 * points).reshape(2, points) * (1 + 1j) + index
+    timestamp = datetime(2026, 1, 1, tzinfo=timezone.utc) + timedelta(seconds=index)
+    return Sweep(timestamp, "VV", radar, "0123456789abcdef", ["S11", "S21"], frequencies, traces)
+
+
+def torn_record(fill=b"\0"):
+    # Complete header, data cut off by a crash
+    header = RECORD_HEADER.pack(b"SWP1", 0.0, b"VV", 7, b"0123456789abcdef", 16, 2, 5, b"S11S21")
+    return header + b"radar-1\0" + fill * 7
+
+
+def stored(store):
+    return [sweep for segment in store.segments() for _, sweep in store.iter_segment(segment)]
+
+
+def test_round_trip(tmp_path):
+    store = SweepStore(str(tmp_path))
+    ref = store.append(make_sweep())
+    sweep = store.read(ref)
+
+    assert ref.offset == 0 and ref.size == RECORD_HEADER.size + 8 + 2 * 5 * 16
+    assert sweep.radar == "radar-1" and sweep.polarisation == "VV"
+    assert sweep.parameters == ["S11", "S21"]
+    assert sweep.timestamp == make_sweep().timestamp
+    np.testing.assert_array_equal(sweep.traces, make_sweep().traces)
+    np.testing.assert_array_equal(sweep.frequencies, make_sweep().frequencies)
+
+
+def test_long_radar_names_stay_distinct(tmp_path):
+    store = SweepStore(str(tmp_path))
+    names = ["radar-with-a-long-name-north", "radar-with-a-long-name-south", "r\u00e4dar"]
+    refs = [store.append(make_sweep(index, radar=name)) for index, name in enumerate(names)]
+
+    assert [store.read(ref).radar for ref in refs] == names
+    assert [sweep.radar for sweep in stored(store)] == names
+    assert all(ref.offset % 8 == 0 for ref in refs)
+
+
+def test_segments_are_named_by_utc_day(tmp_path):
+    store = SweepStore(str(tmp_path))
+    local = timezone(timedelta(hours=2))
+    assert store.segment_path(datetime(2026, 1, 2, 1, 0, tzinfo=local)).endswith("2026-01-01.swp")
+    assert store.segment_path(datetime(2026, 1, 2, 1, 0)).endswith("2026-01-02.swp")
+
+
+def test_torn_record_is_removed_before_append(tmp_path):
+    store = SweepStore(str(tmp_path))
+    first = store.append(make_sweep(0))
+    with open(first.segment, "ab") as fp:
+        fp.write(torn_record())
+
+    # A new process does not know the end of the segment
+    store = SweepStore(str(tmp_path))
+    second = store.append(make_sweep(1))
+
+    assert second.offset == first.size
+    assert [sweep.timestamp for sweep in stored(store)] == [make_sweep(0).timestamp, make_sweep(1).timestamp]
+
+
+def test_reader_skips_torn_record_between_records(tmp_path):
+    # Segments written before torn ends were removed
+    store = SweepStore(str(tmp_path))
+    first = store.append(make_sweep(0))
+    with open(first.segment, "rb") as fp:
+        record = fp.read()
+    with open(first.segment, "ab") as fp:
+        fp.write(torn_record(b"\1") + record)
+
+    sweeps = stored(SweepStore(str(tmp_path)))
+    assert len(sweeps) == 2
+    np.testing.assert_array_equal(sweeps[1].traces, make_sweep(0).traces)
+
+
+def test_upload_cursor(tmp_path):
+    store = SweepStore(str(tmp_path))
+    ref = store.append(make_sweep())
+    assert store.uploaded_offset(ref.segment) == 0
+    store.set_uploaded_offset(ref.segment, ref.offset + ref.size)
+    assert store.uploaded_offset(ref.segment) == ref.size
+    assert list(store.iter_segment(ref.segment, store.uploaded_offset(ref.segment))) == []
@@ -0,0 +1,46 @@
+from lib.sweep_store import SweepRef
+from lib.upload_queue import UploadQueue, upload_location
+
+
+def test_uploads_come_back_in_order(tmp_path):
+    queue = UploadQueue(str(tmp_path / "uploads.db"))
+    ref = SweepRef("segment.swp", 64, 1024)
+    queue.enqueue("sweep.txt", "2026-01-01T00:00:00Z", "VV", "abc", ["S11"])
+    queue.enqueue(ref, "2026-01-01T00:00:01Z", "VH", "abc", ["S11", "S21"])
+
+    first, second = queue.peek()
+    assert upload_location(first) == "sweep.txt" and first.parameters == ["S11"]
+    assert upload_location(second) == ref and second.polarisation == "VH"
+    assert queue.peek(after=first.id) == [second]
+
+
+def test_known_locations_are_skipped(tmp_path):
+    queue = UploadQueue(str(tmp_path / "uploads.db"))
+    queue.enqueue("sweep.txt")
+    queue.enqueue("sweep.txt")
+    assert queue.pending() == 1
+
+
+def test_completed_uploads_are_removed_and_survive_reopening(tmp_path):
+    path = str(tmp_path / "uploads.db")
+    queue = UploadQueue(path)
+    queue.enqueue_many([(f"sweep_{i}.txt", None, "VV", None, None) for i in range(3)])
+    uploads = queue.peek()
+    queue.complete([uploads[0].id])
+    queue.failed(uploads[1].id, "timeout")
+    queue.close()
+
+    reopened = UploadQueue(path)
+    remaining = reopened.peek()
+    assert [upload.path for upload in remaining] == ["sweep_1.txt", "sweep_2.txt"]
+    assert remaining[0].attempts == 1
+    assert reopened.pending("sweep_2.txt") == 1
+
+
+def test_records(tmp_path):
+    queue = UploadQueue(str(tmp_path / "uploads.db"))
+    queue.enqueue_records(["system_data value=1 1", "system_data value=2 2"])
+    records = queue.peek_records()
+    assert [line for _, line in records] == ["system_data value=1 1", "system_data value=2 2"]
+    queue.complete_records([records[0][0]])
+    assert [line for _, line in queue.peek_records()] == ["system_data value=2 2"]